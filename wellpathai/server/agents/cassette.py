@@ -0,0 +1,134 @@
+"""
+Record and replay of GPT replies, for deterministic runs without OpenAI.
+
+With LLM_CASSETTE_MODE=record every successful completion is saved as a JSON
+file under LLM_CASSETTE_DIR/<call type>/, named after a hash of the call type
+and prompt messages. With LLM_CASSETTE_MODE=replay completions are answered
+from those files and no request is sent:
+
+- A request whose messages were recorded gets exactly the recorded reply.
+- Any other request gets the recordings of its call type in turn, sorted by
+  file name, so a load test can replay a few real sessions over and over.
+- A call type without recordings raises CassetteMiss.
+
+The model is left out of the hash because the router may pick a different one
+between recording and replay.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils import metrics
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+
+MODE = os.getenv("LLM_CASSETTE_MODE", OFF)
+CASSETTE_DIR = os.getenv(
+    "LLM_CASSETTE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cassettes"),
+)
+
+_lock = threading.Lock()
+_recordings = {}  # (directory, call type) -> sorted recording paths
+_turns = {}  # (directory, call type) -> recordings replayed so far
+
+
+class CassetteMiss(LookupError):
+    """Replay was asked for a call type that has no recordings"""
+
+
+def request_key(call_type, messages):
+    """Hash identifying a completion request by its call type and prompt"""
+    payload = json.dumps({"call_type": call_type, "messages": messages}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def _path(call_type, key):
+    return os.path.join(CASSETTE_DIR, call_type, f"{key}.json")
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)["content"]
+
+
+def _recordings_of(call_type):
+    directory = os.path.join(CASSETTE_DIR, call_type)
+    with _lock:
+        if (CASSETTE_DIR, call_type) not in _recordings:
+            names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+            _recordings[(CASSETTE_DIR, call_type)] = [
+                os.path.join(directory, name) for name in names if name.endswith(".json")
+            ]
+        return _recordings[(CASSETTE_DIR, call_type)]
+
+
+def replay(call_type, request):
+    """
+    The recorded reply for a completion request when replaying
+
+    Args:
+        call_type (str): The call type
+        request (dict): The completion arguments, with "messages"
+
+    Returns:
+        str: The reply text, or None when not replaying
+
+    Raises:
+        CassetteMiss: There are no recordings of the call type
+    """
+    if MODE != REPLAY:
+        return None
+
+    path = _path(call_type, request_key(call_type, request["messages"]))
+    if os.path.exists(path):
+        metrics.increment("llm_cassette_total", call_type=call_type, outcome="hit")
+        return _load(path)
+
+    recordings = _recordings_of(call_type)
+    if not recordings:
+        raise CassetteMiss(f"No recorded {call_type} replies in {CASSETTE_DIR}")
+    with _lock:
+        turn = _turns.get((CASSETTE_DIR, call_type), 0)
+        _turns[(CASSETTE_DIR, call_type)] = turn + 1
+    metrics.increment("llm_cassette_total", call_type=call_type, outcome="substituted")
+    return _load(recordings[turn % len(recordings)])
+
+
+def record(call_type, request, content):
+    """Save the reply to a completion request when recording"""
+    if MODE != RECORD or content is None:
+        return
+
+    key = request_key(call_type, request["messages"])
+    path = _path(call_type, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Written to a temporary file first so a concurrent replay never reads half a file
+    temporary = f"{path}.{threading.get_ident()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(
+            {
+                "call_type": call_type,
+                "model": request.get("model"),
+                "messages": request["messages"],
+                "content": content,
+                "recorded_at": time.time(),
+            },
+            f,
+            indent=2,
+        )
+    os.replace(temporary, path)
+    metrics.increment("llm_cassette_total", call_type=call_type, outcome="recorded")
+
+
+def reset():
+    """Forget the listed recordings and replay turns, used by tests"""
+    with _lock:
+        _recordings.clear()
+        _turns.clear()
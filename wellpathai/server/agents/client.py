@@ -0,0 +1,139 @@
+"""
+Shared, connection-pooled OpenAI clients for the agents.
+
+Every GPT call goes through the clients built here instead of creating its own.
+Both keep a bounded pool of keep-alive connections, so repeated calls skip the
+TCP and TLS handshake, and every call gets a timeout for its call type instead
+of waiting forever on a slow response.
+
+get_client() is the synchronous client used from Flask request handlers.
+get_async_client() is its asyncio counterpart: one event loop can have many
+calls in flight at once without a thread per call.
+
+Inside `with first_byte_timer() as first_byte:` the time the response headers
+of a call arrived is appended to `first_byte`.
+"""
+
+import asyncio
+from contextlib import contextmanager
+import contextvars
+import os
+import threading
+import time
+import weakref
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+load_dotenv()
+
+# Point the clients at another server, e.g. the fake one in loadtest/
+BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# Connection pool limits, per client
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 30))
+
+# Retries done by the OpenAI SDK itself. Off by default, agents.resilience
+# retries within the call type's deadline instead
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 0))
+
+CONNECT_TIMEOUT_SECONDS = 5
+
+# Seconds a whole completion may take, per call type
+CALL_TIMEOUTS = {
+    "next_question": float(os.getenv("OPENAI_TIMEOUT_NEXT_QUESTION", 20)),
+    "conclusion": float(os.getenv("OPENAI_TIMEOUT_CONCLUSION", 90)),
+    "case_title": float(os.getenv("OPENAI_TIMEOUT_CASE_TITLE", 15)),
+}
+DEFAULT_TIMEOUT_SECONDS = 60
+
+_lock = threading.Lock()
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+# List receiving the perf_counter() time response headers arrived, per call
+_first_byte = contextvars.ContextVar("openai_first_byte", default=None)
+
+
+@contextmanager
+def first_byte_timer():
+    """Collect the time the response headers of the calls made inside arrive"""
+    times = []
+    token = _first_byte.set(times)
+    try:
+        yield times
+    finally:
+        _first_byte.reset(token)
+
+
+def _mark_first_byte(response):
+    times = _first_byte.get()
+    if times is not None:
+        times.append(time.perf_counter())
+
+
+async def _amark_first_byte(response):
+    _mark_first_byte(response)
+
+
+def pool_limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def call_timeout(call_type, seconds=None):
+    """httpx timeout for one completion of the given call type, or of `seconds`"""
+    if seconds is None:
+        seconds = CALL_TIMEOUTS.get(call_type, DEFAULT_TIMEOUT_SECONDS)
+    return httpx.Timeout(seconds, connect=CONNECT_TIMEOUT_SECONDS)
+
+
+def get_client():
+    """The process-wide synchronous client"""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=BASE_URL,
+                max_retries=MAX_RETRIES,
+                timeout=DEFAULT_TIMEOUT_SECONDS,
+                http_client=httpx.Client(
+                    limits=pool_limits(),
+                    timeout=DEFAULT_TIMEOUT_SECONDS,
+                    event_hooks={"response": [_mark_first_byte]},
+                ),
+            )
+        return _client
+
+
+def get_async_client():
+    """
+    The async client of the running event loop
+
+    httpx connections belong to the loop that opened them, so each loop gets its
+    own client and pool. Must be called from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=BASE_URL,
+                max_retries=MAX_RETRIES,
+                timeout=DEFAULT_TIMEOUT_SECONDS,
+                http_client=httpx.AsyncClient(
+                    limits=pool_limits(),
+                    timeout=DEFAULT_TIMEOUT_SECONDS,
+                    event_hooks={"response": [_amark_first_byte]},
+                ),
+            )
+            _async_clients[loop] = client
+        return client
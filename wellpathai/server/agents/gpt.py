@@ -1,16 +1,173 @@
 from flask import jsonify
-from openai import OpenAI
-import json
-import os
+from agents.client import call_timeout, first_byte_timer, get_async_client, get_client
+from agents.prompt_format import count_tokens, format_answers, format_case_history
+from agents import cassette, resilience, telemetry
+from agents.router import router
+from agents.schemas import ConclusionWithCase, parse_reply, response_format
+import re
+import time
+from types import SimpleNamespace
 from dotenv import load_dotenv
+from utils import metrics
 
 load_dotenv(".env.local")
 
-client = OpenAI(api_key = os.getenv("OPENAI_API_KEY"))
+client = get_client()
 
-def generate_next_question(questionnaire_data):
-    # Craft the prompt
+def _messages(system_prompt, user_prompt):
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": user_prompt
+        }
+    ]
+
+def _request(call_type, system_prompt, user_prompt, schema=None, **kwargs):
+    """Arguments of a completion for the call type, on the model its route picks"""
+    route = router.get_route(call_type)
+    return dict(
+        model=router.choose_model(call_type),
+        max_tokens=route.max_tokens,
+        messages=_messages(system_prompt, user_prompt),
+        timeout=call_timeout(call_type, route.timeout),
+        response_format=response_format(call_type, schema),
+        **kwargs
+    )
+
+def _finish(completion, started, first_byte, usage=None, failed=False):
+    """Fill in a completion's latency, TTFB and usage and record it with the router"""
+    completion.latency = time.perf_counter() - started
+    if first_byte:
+        completion.ttfb = first_byte[0] - started
+    if failed:
+        router.record(completion.call_type, completion.model, completion.latency, error=True)
+        # A failed completion has no reply to parse, so it is recorded right away
+        telemetry.record(completion, telemetry.ERROR)
+        return
+    completion.add_usage(usage)
+    router.record(completion.call_type, completion.model, completion.latency, usage)
+
+def _complete(call_type, system_prompt, user_prompt, **kwargs):
+    """
+    Run a chat completion on the pooled client
+
+    Raises resilience.LLMUnavailable when the call can't be completed within
+    the call type's deadline or its circuit breaker is open. Replies are
+    recorded or replayed instead of requested as set up in agents.cassette.
+
+    Returns:
+        tuple: (reply text, telemetry.Completion to record once the reply is
+        parsed, or None for a replayed reply)
+    """
+    request = _request(call_type, system_prompt, user_prompt, **kwargs)
+    replayed = cassette.replay(call_type, request)
+    if replayed is not None:
+        return replayed, None
+    route = telemetry.current_route()
+
+    def attempt(timeout):
+        completion = telemetry.Completion(call_type, request["model"], route)
+        started = time.perf_counter()
+        with first_byte_timer() as first_byte:
+            try:
+                response = client.chat.completions.create(
+                    **{**request, "timeout": call_timeout(call_type, timeout)}
+                )
+            except Exception:
+                _finish(completion, started, first_byte, failed=True)
+                raise
+        _finish(completion, started, first_byte, response.usage)
+        return response.choices[0].message.content, completion
+
+    content, completion = resilience.call(call_type, attempt, router.get_route(call_type).timeout)
+    cassette.record(call_type, request, content)
+    return content, completion
+
+async def _acomplete(call_type, system_prompt, user_prompt, **kwargs):
+    """Async version of _complete, on the event loop's pooled client"""
+    request = _request(call_type, system_prompt, user_prompt, **kwargs)
+    replayed = cassette.replay(call_type, request)
+    if replayed is not None:
+        return replayed, None
+    route = telemetry.current_route()
+
+    async def attempt(timeout):
+        completion = telemetry.Completion(call_type, request["model"], route)
+        started = time.perf_counter()
+        with first_byte_timer() as first_byte:
+            try:
+                response = await get_async_client().chat.completions.create(
+                    **{**request, "timeout": call_timeout(call_type, timeout)}
+                )
+            except Exception:
+                _finish(completion, started, first_byte, failed=True)
+                raise
+        _finish(completion, started, first_byte, response.usage)
+        return response.choices[0].message.content, completion
+
+    content, completion = await resilience.acall(call_type, attempt, router.get_route(call_type).timeout)
+    cassette.record(call_type, request, content)
+    return content, completion
+
+def _decode(call_type, content, completion=None, schema=None):
+    """Decode a reply with parse_reply, recording the completion with the outcome"""
+    response_data, outcome = parse_reply(call_type, content, schema)
+    if completion is not None:
+        telemetry.record(completion, outcome)
+    return response_data
+
+# Asked instead of a generated question while GPT is unavailable
+DEGRADED_QUESTIONS = [
+    {
+        "question": "Could you describe your main symptoms in a bit more detail, including when they started?",
+        "type": "text",
+    },
+    {
+        "question": "Is there anything that seems to make your symptoms better or worse?",
+        "type": "text",
+    },
+    {
+        "question": "Is there anything else about your health you'd like us to know?",
+        "type": "text",
+    },
+]
+
+def degraded_next_question(questionnaire_data):
+    """A predefined follow-up question not asked yet, or an error dict if all were asked"""
+    metrics.increment("llm_degraded_total", call_type="next_question")
+    asked = {q.get("question") for q in questionnaire_data if isinstance(q, dict)} if isinstance(questionnaire_data, list) else set()
+    for question in DEGRADED_QUESTIONS:
+        if question["question"] not in asked:
+            return {**question, "degraded": True}
+    return {"status": "error", "error": "Question service temporarily unavailable"}
+
+def degraded_conclusion():
+    metrics.increment("llm_degraded_total", call_type="conclusion")
+    return {
+        "status": "error",
+        "error": "Report generation is temporarily unavailable, please try again shortly",
+        "degraded": True,
+    }
+
+# Added before the answers when the questionnaire continues an existing case
+CASE_HISTORY_SECTION = """
+    ### Earlier Visits For This Case (for context, the current answers take precedence):
+    {history}
+"""
+
+def _case_history_section(case_history):
+    history = format_case_history(case_history)
+    return CASE_HISTORY_SECTION.format(history=history) if history else ""
+
+def _next_question_prompts(questionnaire_data, case_history=None):
+    """Build the system and user prompts for generating the next question"""
     system_prompt = "You are an intelligent, empathetic healthcare assistant for a wellness app, guiding users through personalized, conversational health assessments. Your goal is to make users feel like they're talking with a caring, attentive healthcare professional rather than filling out a form."
+    answers = format_answers(questionnaire_data, "next_question")
+    history = _case_history_section(case_history)
     user_prompt = f"""
     ### Instructions:
     1. IMPORTANT: You can only ask a MAXIMUM of 8-9 questions total for the entire assessment, so each question must be highly strategic and provide maximum diagnostic value. 
@@ -59,9 +216,9 @@ def generate_next_question(questionnaire_data):
         - "Let's talk about how your sleep has been lately. Are you having any trouble falling asleep or staying asleep through the night?"
 
     5. Respond in JSON format as shown below.
-
+{history}
     ### User's Previous Answers:
-    {questionnaire_data}
+    {answers}
 
     ### Response Format:
     ```json
@@ -72,52 +229,188 @@ def generate_next_question(questionnaire_data):
     }}
     ```
     """
+    return system_prompt, user_prompt
+
+def generate_next_question(questionnaire_data, case_history=None):
+    """
+    Generate the next question of a questionnaire
+
+    `case_history` is the summary of the selected case's earlier visits, see
+    case/history.py.
+    """
+    # Craft the prompt
+    system_prompt, user_prompt = _next_question_prompts(questionnaire_data, case_history)
+
     # Make the API call
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        temperature=0.5,
-        messages=[
-            {
-                "role": "system", 
-                "content": system_prompt
-            },
-            {
-                "role": "user", 
-                "content": user_prompt
-            }
-        ]
+    try:
+        advice, completion = _complete("next_question", system_prompt, user_prompt, temperature=0.5)
+    except resilience.LLMUnavailable as e:
+        print(f"Serving a degraded next question: {str(e)}", flush=True)
+        return degraded_next_question(questionnaire_data)
+
+    return _parse_next_question(advice, completion)
+
+async def agenerate_next_question(questionnaire_data, case_history=None):
+    """Async version of generate_next_question"""
+    system_prompt, user_prompt = _next_question_prompts(questionnaire_data, case_history)
+    try:
+        advice, completion = await _acomplete("next_question", system_prompt, user_prompt, temperature=0.5)
+    except resilience.LLMUnavailable as e:
+        print(f"Serving a degraded next question: {str(e)}", flush=True)
+        return degraded_next_question(questionnaire_data)
+    return _parse_next_question(advice, completion)
+
+def _parse_next_question(advice, completion=None):
+    """Parse the model's next-question reply into a dict"""
+    response_data = _decode("next_question", advice, completion)
+    if response_data is None:
+        return {"status": "error", "error": "Failed to parse JSON response"}
+
+    # Text questions are stored without options, as before structured output
+    if response_data["type"] == "text" and not response_data["options"]:
+        del response_data["options"]
+
+    print("Debugging output from response of gpt: ", response_data, flush=True)
+    return response_data
+
+class QuestionTextExtractor:
+    """
+    Pull the value of the "question" field out of a JSON reply while it streams in.
+
+    feed() takes each new chunk of the reply and returns the part of the question
+    text that became available, already unescaped.
+    """
+
+    _START = re.compile(r'"question"\s*:\s*"')
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None  # Index of the next unread character of the value
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.done:
+            return ""
+
+        if self.position is None:
+            match = self._START.search(self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        text = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if char == '"':
+                self.done = True
+                break
+            if char != "\\":
+                text.append(char)
+                self.position += 1
+                continue
+
+            # Wait for the rest of an escape sequence split across chunks
+            if self.position + 1 >= len(self.buffer):
+                break
+            code = self.buffer[self.position + 1]
+            if code == "u":
+                if self.position + 6 > len(self.buffer):
+                    break
+                text.append(chr(int(self.buffer[self.position + 2:self.position + 6], 16)))
+                self.position += 6
+            else:
+                text.append(self._ESCAPES.get(code, code))
+                self.position += 2
+
+        return "".join(text)
+
+def stream_next_question(questionnaire_data, case_history=None):
+    """
+    Generate the next question as a stream
+
+    Yields:
+        tuple: ("token", text) for each new piece of the question text as it is
+        generated, then one ("question", dict) with the parsed question, or
+        ("question", error dict) if the reply could not be parsed
+    """
+    system_prompt, user_prompt = _next_question_prompts(questionnaire_data, case_history)
+    request = _request(
+        "next_question", system_prompt, user_prompt, temperature=0.5, stream=True
     )
 
-    # Get the response content
-    advice = response.choices[0].message.content
+    replayed = cassette.replay("next_question", request)
+    if replayed is not None:
+        text = QuestionTextExtractor().feed(replayed)
+        if text:
+            yield "token", text
+        yield "question", _parse_next_question(replayed)
+        return
 
-    # Strip the code block markers and newlines
-    json_string = advice.strip("```json\n").strip("```")
+    # A stream can't be retried once tokens were sent, so only the breaker applies
+    breaker = resilience.get_breaker("next_question")
+    if not breaker.allow():
+        question = degraded_next_question(questionnaire_data)
+        if "question" in question:
+            yield "token", question["question"]
+        yield "question", question
+        return
 
+    completion = telemetry.Completion("next_question", request["model"], telemetry.current_route())
+    started = time.perf_counter()
+    first_content = []
+    extractor = QuestionTextExtractor()
+    # A client that disconnects closes the generator with GeneratorExit, so the
+    # breaker is settled in finally to never leave a half-open trial running
+    settle = breaker.release
     try:
-        # Parse the JSON string
-        response_data = json.loads(json_string)
+        for chunk in client.chat.completions.create(**request):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if delta and not first_content:
+                first_content.append(time.perf_counter())
+            text = extractor.feed(delta)
+            if text:
+                yield "token", text
+        settle = breaker.record_success
+    except Exception as e:
+        _finish(completion, started, first_content, failed=True)
+        if isinstance(e, resilience.RETRYABLE_ERRORS):
+            settle = breaker.record_failure
+        raise
+    finally:
+        settle()
+    # Streamed responses carry no usage, so the tokens are counted here
+    usage = SimpleNamespace(
+        prompt_tokens=count_tokens(system_prompt) + count_tokens(user_prompt),
+        completion_tokens=count_tokens(extractor.buffer),
+    )
+    _finish(completion, started, first_content, usage)
+    cassette.record("next_question", request, extractor.buffer)
 
-        '''
-        Response_data format should be like this:
-        {
-            "question": "How would you describe your diet?",
-            "type": "multiselect",
-            "options": [
-                "Vegetarian", "Vegan", "Pescatarian", "Omnivore",
-                "Low-carb", "Gluten-free", "None of the above"
-            ]
-        }
-        '''
+    yield "question", _parse_next_question(extractor.buffer, completion)
 
-        print("Debugging output from response of gpt: ", response_data, flush=True)
-        return response_data
-    except json.JSONDecodeError:
-        return {"status": "error", "error": "Failed to parse JSON response"}
+# Added to the conclusion prompt when the report also titles a new case
+CASE_TITLE_INSTRUCTIONS = """
+        e) For the **case_title** and **case_description** of the patient's new case folder:
+           - case_title: 1-2 words naming the primary symptom or health concern, in standard medical terminology patients understand
+           - case_description: 1-2 sentences on the key symptoms and notable features of the condition
+           - DO NOT include demographic information or time-bound descriptions (e.g., "for the past two weeks")
+"""
 
-def generate_conclusion(questionnaire_data):
-    # Craft the prompt
+CASE_TITLE_FIELDS = ''',
+    "case_title": "Primary Condition",
+    "case_description": "Primary condition characterized by key symptoms and notable features"'''
+
+def _conclusion_prompts(questionnaire_data, include_case_title=False, case_history=None):
+    """Build the system and user prompts for the conclusion report, optionally with a case title"""
     system_prompt = "You are a clinical advisor generating insightful health reports with actionable, personalized recommendations based on questionnaire data."
+    answers = format_answers(questionnaire_data, "conclusion")
+    case_instructions = CASE_TITLE_INSTRUCTIONS if include_case_title else ""
+    case_fields = CASE_TITLE_FIELDS if include_case_title else ""
+    history = _case_history_section(case_history)
     user_prompt = f"""
     ### Instructions:
     1. Based on the patient's answers, generate an insightful health report with four distinct sections:
@@ -155,11 +448,11 @@ def generate_conclusion(questionnaire_data):
            - Suggest specific tests, examinations, or specialist referrals that would be appropriate
            - Note any red flags or priority concerns in the patient's data
            - Use professional medical terminology while keeping it understandable
-
+{case_instructions}
     2. Only base your analysis on the provided answers - avoid speculative recommendations.
-
+{history}
     ### Patient's Answers:
-    {questionnaire_data}
+    {answers}
 
     ### Response Format:
     ```json
@@ -175,94 +468,60 @@ def generate_conclusion(questionnaire_data):
         "considerations": "Important usage notes, side effects, contraindications"
       }}
     ],
-    "clinical_notes": ["clinical recommendation 1", "clinical recommendation 2", ...]
+    "clinical_notes": ["clinical recommendation 1", "clinical recommendation 2", ...]{case_fields}
     }}
     ```
     """
+    return system_prompt, user_prompt
 
-    # Make the API call
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        temperature=0.5,
-        messages=[
-            {
-                "role": "system", 
-                "content": system_prompt
-            },
-            {
-                "role": "user", 
-                "content": user_prompt
-            }
-        ]
-    )
-    
-    # Get the response content
-    advice = response.choices[0].message.content    
-    print("Raw GPT response:", advice, flush=True)
-    # Strip the code block markers and newlines
-    json_string = advice.strip("```json\n").strip("```")    
-    try:
-        # First cleanup - fix missing commas between properties
-        import re
-        
-        # This regex finds property transitions without commas
-        # Example: "property1": "value" "property2":
-        fixed_json = re.sub(r'"\s+("[\w_]+"\s*:)', r'",\n\1', json_string)
-        
-        # Replace any triple quotes with single quotes
-        fixed_json = fixed_json.replace('"""', '"')
-        
-        # Use json5 to parse the fixed string (more forgiving JSON parser)
-        import json5
-        response_data = json5.loads(fixed_json)
-        print("Successfully parsed JSON with fixes", flush=True)
-        return response_data
-        
-    except Exception as e:
-        print(f"JSON parsing error: {str(e)}", flush=True)
-        
-        # Fallback method using a more direct approach
-        try:
-            # This is a last resort parsing method
-            import ast
-            # Extract content between outer curly braces
-            content = json_string.strip()
-            if content.startswith('{') and content.endswith('}'):
-                content = content[1:-1]
-            
-            # Split by known major properties and reconstruct
-            result = {}
-            
-            # Extract conclusion
-            if '"conclusion":' in content:
-                conclusion_parts = content.split('"conclusion":')
-                conclusion_text = conclusion_parts[1].split('"suggestions":')[0].strip()
-                # Clean up the text
-                conclusion_text = conclusion_text.strip('"').strip()
-                result["conclusion"] = conclusion_text
-            
-            # Handle other sections similarly...
-            
-            print("Fallback parsing method used", flush=True)
-            return result
-            
-        except Exception as fallback_error:
-            print(f"Fallback parsing also failed: {str(fallback_error)}", flush=True)
-            return {"status": "error", "error": "Failed to parse JSON response"}
-
-def generate_case_title(questionnaire_data):
+def generate_conclusion(questionnaire_data, include_case_title=False, case_history=None):
     """
-    Generate a concise title (max 2 words) for a case based on the answered questions in a questionnaire
-    
-    Args:
-        questionnaire_data (dict): The questionnaire data containing the user's answers
-        
-    Returns:
-        str: A generated title for the case
+    Generate the conclusion report of a questionnaire
+
+    With `include_case_title` the report also carries case_title and
+    case_description for the new case it starts, so that creating the case
+    needs no generate_case_title call of its own. `case_history` is the
+    summary of the selected case's earlier visits, see case/history.py.
     """
-    
     # Craft the prompt
+    system_prompt, user_prompt = _conclusion_prompts(questionnaire_data, include_case_title, case_history)
+    schema = ConclusionWithCase if include_case_title else None
+
+    # Make the API call
+    try:
+        advice, completion = _complete(
+            "conclusion", system_prompt, user_prompt, schema=schema, temperature=0.5
+        )
+    except resilience.LLMUnavailable as e:
+        print(f"Conclusion unavailable: {str(e)}", flush=True)
+        return degraded_conclusion()
+    return _parse_conclusion(advice, completion, schema)
+
+async def agenerate_conclusion(questionnaire_data, include_case_title=False, case_history=None):
+    """Async version of generate_conclusion"""
+    system_prompt, user_prompt = _conclusion_prompts(questionnaire_data, include_case_title, case_history)
+    schema = ConclusionWithCase if include_case_title else None
+    try:
+        advice, completion = await _acomplete(
+            "conclusion", system_prompt, user_prompt, schema=schema, temperature=0.5
+        )
+    except resilience.LLMUnavailable as e:
+        print(f"Conclusion unavailable: {str(e)}", flush=True)
+        return degraded_conclusion()
+    return _parse_conclusion(advice, completion, schema)
+
+def _parse_conclusion(advice, completion=None, schema=None):
+    """Parse the model's conclusion reply into a dict"""
+    response_data = _decode("conclusion", advice, completion, schema)
+    if response_data is None:
+        print("Raw GPT response:", advice, flush=True)
+        return {"status": "error", "error": "Failed to parse JSON response"}
+    return response_data
+
+def _case_title_prompts(questionnaire_data):
+    """Build the system and user prompts for a case title and description"""
     system_prompt = "You are a medical professional creating concise, informative case summaries."
+    answers = format_answers(questionnaire_data, "case_title")
     user_prompt = f"""
     ### Instructions:
     1. Based on the user's answers, generate two outputs:
@@ -289,7 +548,7 @@ def generate_case_title(questionnaire_data):
     - "General health assessment with focus on preventive care, lifestyle optimization, and establishing baseline health metrics."
 
     ### User's Answers:
-    {questionnaire_data}
+    {answers}
 
     ### Response Format:
     ```json
@@ -299,39 +558,44 @@ def generate_case_title(questionnaire_data):
     }}
     ```
     """
+    return system_prompt, user_prompt
+
+def generate_case_title(questionnaire_data):
+    """
+    Generate a concise title (max 2 words) for a case based on the answered questions in a questionnaire
     
+    Args:
+        questionnaire_data (dict): The questionnaire data containing the user's answers
+        
+    Returns:
+        tuple: (description, title), or None if no title could be generated
+    """
+    
+    # Craft the prompt
+    system_prompt, user_prompt = _case_title_prompts(questionnaire_data)
+
     # Make the API call
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            temperature=0.7,
-            messages=[
-                {
-                    "role": "system", 
-                    "content": system_prompt
-                },
-                {
-                    "role": "user", 
-                    "content": user_prompt
-                }
-            ]
-        )
-        
-        # Get the response content
-        content = response.choices[0].message.content
-        
-        # Strip the code block markers and newlines
-        json_string = content.strip("```json\n").strip("```")
-        
-        # Parse the JSON string
-        response_data = json.loads(json_string)
-        
-        if "title" and "description" in response_data:
-            return response_data["description"], response_data["title"]
-        else:
-            print("Error: No title in GPT response")
-            return None
-            
+        content, completion = _complete("case_title", system_prompt, user_prompt, temperature=0.7)
+        return _parse_case_title(content, completion)
     except Exception as e:
         print(f"Error generating case title: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+async def agenerate_case_title(questionnaire_data):
+    """Async version of generate_case_title"""
+    system_prompt, user_prompt = _case_title_prompts(questionnaire_data)
+    try:
+        content, completion = await _acomplete("case_title", system_prompt, user_prompt, temperature=0.7)
+        return _parse_case_title(content, completion)
+    except Exception as e:
+        print(f"Error generating case title: {str(e)}")
+        return None
+
+def _parse_case_title(content, completion=None):
+    """Parse the model's case title reply into (description, title), or None"""
+    response_data = _decode("case_title", content, completion)
+    if response_data is None:
+        print("Error: No title in GPT response")
+        return None
+    return response_data["description"], response_data["title"]
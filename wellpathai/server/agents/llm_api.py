@@ -0,0 +1,39 @@
+from flask import Blueprint, Response, jsonify
+from agents import resilience, telemetry
+from agents.router import router
+from utils import metrics
+from utils.auth import admin_required
+
+"""
+# Blueprint for admin views of the GPT calls
+"""
+
+llm_blueprint = Blueprint("llm", __name__)
+
+
+# Routes per call type with the active model, and latency, tokens and cost per model
+@llm_blueprint.route("/api/admin/llm/routes", methods=["GET"])
+@admin_required
+def api_llm_routes():
+    return jsonify(router.report()), 200
+
+
+# Circuit breaker state, consecutive failures and trip count per call type
+@llm_blueprint.route("/api/admin/llm/breakers", methods=["GET"])
+@admin_required
+def api_llm_breakers():
+    return jsonify(resilience.get_stats()), 200
+
+
+# Completions by outcome, tokens, latency and time to first byte per call type, route and model
+@llm_blueprint.route("/api/admin/llm/usage", methods=["GET"])
+@admin_required
+def api_llm_usage():
+    return jsonify({"completions": telemetry.summary()}), 200
+
+
+# The GPT call counters and histograms in the Prometheus text format, for scraping
+@llm_blueprint.route("/api/admin/llm/metrics", methods=["GET"])
+@admin_required
+def api_llm_metrics():
+    return Response(metrics.prometheus_text(prefix="llm_"), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,155 @@
+"""
+Compact, token-budgeted serialization of questionnaire answers for prompts.
+
+The prompts used to embed the raw Python repr of the question list, including
+ids, `initialized` flags, option lists, placeholders and the case ids of q2b.
+format_answers() writes only what the model needs:
+
+    Q: What brings you here today?
+    A: Feeling Unwell
+
+Unanswered questions are left out and multiple answers are joined with commas.
+Free-text answers longer than the per-answer limit of the call type are trimmed,
+and if the whole block is still over the call type's budget the per-answer
+limit is lowered until it fits.
+
+format_case_history() bounds the summary of a case's earlier visits the same
+way, so prompts for a case with many visits stay the same size.
+
+Tokens are counted with tiktoken when its encoding is available locally and
+estimated from the text length otherwise.
+"""
+
+import os
+import threading
+
+# Most tokens the answers block of each call type's prompt may take
+PROMPT_TOKEN_BUDGETS = {
+    "next_question": int(os.getenv("PROMPT_BUDGET_NEXT_QUESTION", 1200)),
+    "conclusion": int(os.getenv("PROMPT_BUDGET_CONCLUSION", 2500)),
+    "case_title": int(os.getenv("PROMPT_BUDGET_CASE_TITLE", 600)),
+    # Earlier visits of the selected case, see case/history.py
+    "case_history": int(os.getenv("PROMPT_BUDGET_CASE_HISTORY", 400)),
+}
+
+# Most tokens a single answer may take before it is trimmed, per call type
+ANSWER_TOKEN_LIMITS = {
+    "next_question": int(os.getenv("PROMPT_ANSWER_LIMIT_NEXT_QUESTION", 120)),
+    "conclusion": int(os.getenv("PROMPT_ANSWER_LIMIT_CONCLUSION", 250)),
+    "case_title": int(os.getenv("PROMPT_ANSWER_LIMIT_CASE_TITLE", 60)),
+}
+
+# Answers are never trimmed below this many tokens to meet the budget
+MIN_ANSWER_TOKENS = 16
+
+TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER_ENCODING", "cl100k_base")
+
+# Average characters per token of English text, used without a tokenizer
+CHARS_PER_TOKEN = 4
+
+TRIM_MARKER = " [...]"
+
+_encoding_lock = threading.Lock()
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """The tiktoken encoding, or None if it can't be loaded (e.g. offline)"""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception as e:
+                print(f"Tokenizer unavailable, estimating token counts: {str(e)}", flush=True)
+                _encoding = None
+        return _encoding
+
+
+def count_tokens(text):
+    """Number of tokens in `text`"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def trim_to_tokens(text, limit):
+    """Cut `text` to at most `limit` tokens, marking that it was trimmed"""
+    if count_tokens(text) <= limit:
+        return text
+
+    keep = max(limit - count_tokens(TRIM_MARKER), 1)
+    encoding = _get_encoding()
+    if encoding is not None:
+        trimmed = encoding.decode(encoding.encode(text)[:keep])
+    else:
+        trimmed = text[:keep * CHARS_PER_TOKEN]
+    return trimmed.rstrip() + TRIM_MARKER
+
+
+def _answer_text(answer):
+    if isinstance(answer, list):
+        return ", ".join(str(item) for item in answer)
+    return " ".join(str(answer).split())
+
+
+def _answered_pairs(questions):
+    pairs = []
+    for question in questions:
+        if not isinstance(question, dict) or "answer" not in question:
+            continue
+        pairs.append((" ".join(str(question.get("question", "")).split()), _answer_text(question["answer"])))
+    return pairs
+
+
+def _render(pairs, answer_limit):
+    return "\n".join(
+        f"Q: {question}\nA: {trim_to_tokens(answer, answer_limit)}"
+        for question, answer in pairs
+    )
+
+
+def format_answers(questions, call_type):
+    """
+    Serialize the answered questions for a prompt of the given call type
+
+    Args:
+        questions (list): Questions as stored on the questionnaire
+        call_type (str): "next_question", "conclusion" or "case_title"
+
+    Returns:
+        str: One "Q:"/"A:" pair per answered question, within the call type's budget
+    """
+    if not isinstance(questions, list):
+        # Not a question list (e.g. an error from the loader), pass it through as before
+        return str(questions)
+
+    pairs = _answered_pairs(questions)
+    budget = PROMPT_TOKEN_BUDGETS.get(call_type)
+    answer_limit = ANSWER_TOKEN_LIMITS.get(call_type, MIN_ANSWER_TOKENS)
+
+    text = _render(pairs, answer_limit)
+    while budget and answer_limit > MIN_ANSWER_TOKENS and count_tokens(text) > budget:
+        answer_limit = max(answer_limit // 2, MIN_ANSWER_TOKENS)
+        text = _render(pairs, answer_limit)
+    return text
+
+
+def format_case_history(history):
+    """
+    The summary of the selected case's earlier visits, within its budget
+
+    Args:
+        history (str): The case history copied onto the questionnaire, or None
+
+    Returns:
+        str: The history, or "" without one
+    """
+    if not history:
+        return ""
+    return trim_to_tokens(str(history).strip(), PROMPT_TOKEN_BUDGETS["case_history"])
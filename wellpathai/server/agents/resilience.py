@@ -0,0 +1,295 @@
+"""
+Deadlines, retries, hedging and circuit breaking around OpenAI calls.
+
+call() runs one completion attempt after another until one succeeds, a
+non-retryable error comes back or the call type's deadline runs out:
+
+- Each attempt gets the route's timeout, shortened to what is left of the
+  deadline, so a call never takes longer than its deadline in total.
+- Timeouts, connection errors, 429s and 5xx are retried after a full-jitter
+  exponential backoff, at most MAX_RETRIES times.
+- With hedging enabled for the call type, a duplicate request is started when
+  the first one hasn't answered within HEDGE_DELAY_SECONDS and whichever
+  answers first is used.
+- Each call type has a circuit breaker. After FAILURE_THRESHOLD consecutive
+  failed calls it opens and calls fail immediately with CircuitOpenError for
+  RESET_TIMEOUT_SECONDS. Then one trial call is let through (half-open); its
+  result closes the breaker again or re-opens it.
+
+Callers catch LLMUnavailable to serve a degraded response instead of an error.
+"""
+
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import random
+import threading
+import time
+
+import openai
+
+from utils import metrics
+
+# Longest a whole call may take including retries, per call type
+DEADLINES = {
+    "next_question": float(os.getenv("LLM_DEADLINE_NEXT_QUESTION", 25)),
+    "conclusion": float(os.getenv("LLM_DEADLINE_CONCLUSION", 120)),
+    "case_title": float(os.getenv("LLM_DEADLINE_CASE_TITLE", 20)),
+}
+DEFAULT_DEADLINE_SECONDS = 60
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+BACKOFF_CAP_SECONDS = 8.0
+
+# Call types that send a hedged duplicate when the first request is slow
+HEDGED_CALL_TYPES = {
+    call_type.strip()
+    for call_type in os.getenv("LLM_HEDGED_CALL_TYPES", "").split(",")
+    if call_type.strip()
+}
+HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY", 3))
+
+FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+RESET_TIMEOUT_SECONDS = float(os.getenv("LLM_BREAKER_RESET", 30))
+
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_HEDGE_WORKERS", 16)),
+    thread_name_prefix="llm-hedge",
+)
+
+
+class LLMUnavailable(Exception):
+    """The model could not be reached in time; serve a degraded response"""
+
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one call type"""
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or RESET_TIMEOUT_SECONDS
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("llm_circuit_state", _STATE_VALUES[self.state], call_type=self.name)
+
+    def allow(self):
+        """True if a call may go out now"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._publish()
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self._publish()
+
+    def release(self):
+        """End a call that neither succeeded nor failed, freeing a half-open trial it held"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                    metrics.increment("llm_circuit_trips_total", call_type=self.name)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._publish()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(call_type):
+    with _breakers_lock:
+        if call_type not in _breakers:
+            _breakers[call_type] = CircuitBreaker(call_type)
+        return _breakers[call_type]
+
+
+def get_stats():
+    """Breaker state and counters per call type"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {call_type: breaker.get_stats() for call_type, breaker in breakers.items()}
+
+
+def reset():
+    """Forget every breaker, used by tests"""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def _backoff(attempt):
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _run_hedged(call_type, attempt, timeout):
+    """Run `attempt`, adding a duplicate if it hasn't finished after the hedge delay"""
+    first = _hedge_executor.submit(attempt, timeout)
+    done, _ = wait([first], timeout=min(HEDGE_DELAY_SECONDS, timeout))
+    if done:
+        return first.result()
+
+    metrics.increment("llm_hedges_total", call_type=call_type, outcome="started")
+    second = _hedge_executor.submit(attempt, timeout)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    metrics.increment("llm_hedges_total", call_type=call_type, outcome="won")
+                # The slower request is left to finish in the background
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call(call_type, attempt, attempt_timeout, hedge=None):
+    """
+    Run a completion with the call type's deadline, retries and circuit breaker
+
+    Args:
+        call_type (str): The call type
+        attempt (callable): Makes one request, called with its timeout in seconds
+        attempt_timeout (float): Timeout of a single attempt
+        hedge (bool, optional): Send hedged duplicates, defaults to HEDGED_CALL_TYPES
+
+    Returns:
+        The result of the first successful attempt
+
+    Raises:
+        CircuitOpenError: The breaker is open
+        DeadlineExceeded: The deadline ran out before an attempt succeeded
+        LLMUnavailable: Every retry failed
+    """
+    breaker = get_breaker(call_type)
+    hedge = call_type in HEDGED_CALL_TYPES if hedge is None else hedge
+    deadline = time.monotonic() + DEADLINES.get(call_type, DEFAULT_DEADLINE_SECONDS)
+
+    for retry in range(MAX_RETRIES + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {call_type}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {call_type} exceeded")
+        timeout = min(attempt_timeout, remaining)
+        try:
+            if hedge:
+                result = _run_hedged(call_type, attempt, timeout)
+            else:
+                result = attempt(timeout)
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            delay = _backoff(retry + 1)
+            if retry == MAX_RETRIES:
+                raise LLMUnavailable(f"{call_type} failed after {retry + 1} attempts") from e
+            if time.monotonic() + delay >= deadline:
+                raise DeadlineExceeded(f"Deadline of {call_type} exceeded") from e
+            metrics.increment("llm_retries_total", call_type=call_type)
+            time.sleep(delay)
+            continue
+        except openai.APIStatusError:
+            # The API answered (e.g. a 400), so it is reachable
+            breaker.record_success()
+            raise
+        except BaseException:
+            # Says nothing about the API, e.g. a bug or a cassette miss
+            breaker.release()
+            raise
+
+        breaker.record_success()
+        return result
+
+
+async def acall(call_type, attempt, attempt_timeout):
+    """Async version of call(), `attempt` is a coroutine function. Not hedged."""
+    breaker = get_breaker(call_type)
+    deadline = time.monotonic() + DEADLINES.get(call_type, DEFAULT_DEADLINE_SECONDS)
+
+    for retry in range(MAX_RETRIES + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {call_type}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {call_type} exceeded")
+        timeout = min(attempt_timeout, remaining)
+        try:
+            result = await attempt(timeout)
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            delay = _backoff(retry + 1)
+            if retry == MAX_RETRIES:
+                raise LLMUnavailable(f"{call_type} failed after {retry + 1} attempts") from e
+            if time.monotonic() + delay >= deadline:
+                raise DeadlineExceeded(f"Deadline of {call_type} exceeded") from e
+            metrics.increment("llm_retries_total", call_type=call_type)
+            await asyncio.sleep(delay)
+            continue
+        except openai.APIStatusError:
+            # The API answered (e.g. a 400), so it is reachable
+            breaker.record_success()
+            raise
+        except BaseException:
+            # Says nothing about the API, e.g. a bug or a cassette miss
+            breaker.release()
+            raise
+
+        breaker.record_success()
+        return result
@@ -0,0 +1,209 @@
+"""
+Latency-aware model routing for the GPT call types.
+
+Every call type has a route: the model to use, a faster fallback model, a
+max_tokens cap, a timeout and a p95 latency SLO. choose_model() returns the
+route's model unless its p95 over the recent window is above the SLO, in which
+case the fallback is used. Latency samples age out of the window, so once the
+primary model has been left alone long enough it is tried again.
+
+Routes can be changed with environment variables, e.g.
+
+    LLM_ROUTE_CONCLUSION_MODEL=gpt-4o
+    LLM_ROUTE_NEXT_QUESTION_FALLBACK_MODEL=gpt-4o-mini
+    LLM_ROUTE_CASE_TITLE_MAX_TOKENS=120
+    LLM_ROUTE_NEXT_QUESTION_SLO_P95=4
+
+or with a JSON file named by LLM_ROUTES_CONFIG mapping call types to the same
+fields in lower case, e.g. {"conclusion": {"model": "gpt-4o", "timeout": 60}}.
+The environment takes precedence over the file.
+
+Every call is recorded with its latency and token usage, and report() sums
+them up per call type and model, with cost from MODEL_PRICES.
+"""
+
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass
+import json
+import math
+import os
+import threading
+import time
+
+from agents.client import CALL_TIMEOUTS, DEFAULT_TIMEOUT_SECONDS
+
+
+@dataclass
+class Route:
+    model: str
+    fallback_model: str
+    max_tokens: int
+    timeout: float
+    slo_p95: float  # Seconds
+
+
+DEFAULT_ROUTES = {
+    "next_question": Route("gpt-4o", "gpt-4o-mini", 400, CALL_TIMEOUTS["next_question"], 6.0),
+    "conclusion": Route("gpt-4o", "gpt-4o-mini", 2000, CALL_TIMEOUTS["conclusion"], 40.0),
+    # A two-word title and a sentence of description don't need the largest model
+    "case_title": Route("gpt-4o-mini", "gpt-4o-mini", 150, CALL_TIMEOUTS["case_title"], 5.0),
+}
+
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Seconds of latency samples used for the p95 decision
+LATENCY_WINDOW_SECONDS = int(os.getenv("LLM_LATENCY_WINDOW", 300))
+
+# Fewer samples than this in the window never trigger the fallback
+MIN_SAMPLES = int(os.getenv("LLM_LATENCY_MIN_SAMPLES", 20))
+
+# Latencies kept per call type and model for the report
+REPORT_SAMPLES = 1000
+
+_FIELD_TYPES = {"model": str, "fallback_model": str, "max_tokens": int, "timeout": float, "slo_p95": float}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def load_routes(environ=None, config_path=None):
+    """The routes after applying the config file and environment overrides"""
+    environ = os.environ if environ is None else environ
+    config_path = config_path or environ.get("LLM_ROUTES_CONFIG")
+
+    overrides = defaultdict(dict)
+    if config_path:
+        with open(config_path) as f:
+            for call_type, fields in json.load(f).items():
+                overrides[call_type].update(fields)
+
+    routes = {}
+    for call_type, default in DEFAULT_ROUTES.items():
+        values = asdict(default)
+        values.update({k: v for k, v in overrides.get(call_type, {}).items() if k in _FIELD_TYPES})
+        for field, cast in _FIELD_TYPES.items():
+            name = f"LLM_ROUTE_{call_type.upper()}_{field.upper()}"
+            if name in environ:
+                values[field] = environ[name]
+        routes[call_type] = Route(**{field: _FIELD_TYPES[field](value) for field, value in values.items()})
+    return routes
+
+
+class ModelRouter:
+    """Chooses the model per call type and keeps latency and usage per model"""
+
+    def __init__(self, routes=None):
+        self.routes = routes if routes is not None else load_routes()
+        self._lock = threading.Lock()
+        self._recent = defaultdict(deque)  # (call_type, model) -> deque of (time, latency)
+        self._stats = defaultdict(lambda: {
+            "calls": 0,
+            "errors": 0,
+            "fallback_calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "latencies": deque(maxlen=REPORT_SAMPLES),
+        })
+
+    def get_route(self, call_type):
+        return self.routes.get(call_type) or Route(
+            "gpt-4o", "gpt-4o-mini", 1000, DEFAULT_TIMEOUT_SECONDS, 30.0
+        )
+
+    def _window(self, call_type, model, now):
+        samples = self._recent[(call_type, model)]
+        while samples and samples[0][0] < now - LATENCY_WINDOW_SECONDS:
+            samples.popleft()
+        return [latency for _, latency in samples]
+
+    def p95(self, call_type, model):
+        """p95 latency of a model for a call type over the recent window"""
+        with self._lock:
+            return percentile(self._window(call_type, model, time.monotonic()), 0.95)
+
+    def choose_model(self, call_type):
+        """The model to call: the route's model, or its fallback while the model is over SLO"""
+        route = self.get_route(call_type)
+        with self._lock:
+            latencies = self._window(call_type, route.model, time.monotonic())
+        if len(latencies) >= MIN_SAMPLES and percentile(latencies, 0.95) > route.slo_p95:
+            return route.fallback_model
+        return route.model
+
+    def record(self, call_type, model, latency, usage=None, error=False):
+        """
+        Record one completion
+
+        Args:
+            call_type (str): The call type
+            model (str): The model that was called
+            latency (float): Seconds the call took, including failed calls
+            usage: The response's usage (prompt_tokens, completion_tokens), if any
+            error (bool): True if the call failed
+        """
+        route = self.get_route(call_type)
+        with self._lock:
+            self._recent[(call_type, model)].append((time.monotonic(), latency))
+            stats = self._stats[(call_type, model)]
+            stats["calls"] += 1
+            stats["errors"] += 1 if error else 0
+            stats["fallback_calls"] += 1 if model != route.model else 0
+            stats["latencies"].append(latency)
+            if usage is not None:
+                stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                stats["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def report(self):
+        """
+        Latency, usage and cost per call type and model
+
+        Returns:
+            dict: "routes" with the current routes and "models" with one entry per
+            call type and model that has been called
+        """
+        with self._lock:
+            rows = []
+            for (call_type, model), stats in sorted(self._stats.items()):
+                latencies = list(stats["latencies"])
+                prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+                cost = (
+                    stats["prompt_tokens"] * prompt_price
+                    + stats["completion_tokens"] * completion_price
+                ) / 1_000_000
+                rows.append({
+                    "call_type": call_type,
+                    "model": model,
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "fallback_calls": stats["fallback_calls"],
+                    "p50_seconds": percentile(latencies, 0.5),
+                    "p95_seconds": percentile(latencies, 0.95),
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "completion_tokens": stats["completion_tokens"],
+                    "cost_usd": round(cost, 6),
+                })
+
+        routes = {
+            call_type: {**asdict(self.get_route(call_type)), "active_model": self.choose_model(call_type)}
+            for call_type in self.routes
+        }
+        return {"routes": routes, "models": rows}
+
+    def reset(self):
+        """Forget all samples and totals, used by tests"""
+        with self._lock:
+            self._recent.clear()
+            self._stats.clear()
+
+
+router = ModelRouter()
@@ -0,0 +1,121 @@
+"""
+Response schemas of the GPT call types and the single decode of their replies.
+
+Each call type asks the model for structured output: with the default
+"json_schema" mode the reply is constrained to the schema below, with
+"json_object" (for models or servers without schema support) it is only
+guaranteed to be a JSON object. Either way the reply is decoded and validated
+in one pydantic step.
+"""
+
+import os
+from typing import List, Literal
+
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+# "json_schema" or "json_object"
+STRUCTURED_OUTPUT_MODE = os.getenv("STRUCTURED_OUTPUT_MODE", "json_schema")
+
+PARSED = "parsed"
+REPAIRED = "repaired"
+FAILED = "failed"
+
+
+class _Schema(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+class NextQuestion(_Schema):
+    question: str
+    type: Literal["text", "choice", "multiselect"]
+    options: List[str]
+
+
+class OtcMedication(_Schema):
+    name: str
+    medication_type: str
+    purpose: str
+    price_range: str
+    considerations: str
+
+
+class Conclusion(_Schema):
+    conclusion: str
+    suggestions: List[str]
+    otc_medications: List[OtcMedication]
+    clinical_notes: List[str]
+
+
+class CaseTitle(_Schema):
+    description: str
+    title: str
+
+
+class ConclusionWithCase(Conclusion):
+    """A conclusion that also titles and describes the new case it starts"""
+
+    case_title: str
+    case_description: str
+
+
+SCHEMAS = {
+    "next_question": NextQuestion,
+    "conclusion": Conclusion,
+    "case_title": CaseTitle,
+}
+
+
+def response_format(call_type, schema=None):
+    """
+    The `response_format` argument for a completion of the given call type
+
+    Args:
+        call_type (str): The call type
+        schema (optional): Model to use instead of the call type's, e.g. ConclusionWithCase
+    """
+    if STRUCTURED_OUTPUT_MODE != "json_schema":
+        return {"type": "json_object"}
+
+    model = schema or SCHEMAS[call_type]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": call_type,
+            "schema": model.model_json_schema(),
+            "strict": True,
+        },
+    }
+
+
+def _strip_code_fence(content):
+    text = content.strip()
+    if not text.startswith("```"):
+        return None
+    text = text[3:]
+    if text.startswith("json"):
+        text = text[4:]
+    return text.rstrip("`").strip()
+
+
+def parse_reply(call_type, content, schema=None):
+    """
+    Decode and validate a reply against its call type's schema, or `schema`
+
+    A reply wrapped in a Markdown code fence, which only happens without schema
+    enforcement, is unwrapped once and counted as repaired.
+
+    Returns:
+        tuple: (dict or None, outcome) where outcome is "parsed", "repaired" or "failed"
+    """
+    model = schema or SCHEMAS[call_type]
+    try:
+        return model.model_validate_json(content or "").model_dump(), PARSED
+    except ValidationError as e:
+        unfenced = _strip_code_fence(content or "")
+        if unfenced is not None:
+            try:
+                return model.model_validate_json(unfenced).model_dump(), REPAIRED
+            except ValidationError:
+                pass
+        print(f"Invalid {call_type} reply: {str(e)}", flush=True)
+        return None, FAILED
@@ -0,0 +1,118 @@
+"""
+Per-completion token and latency instrumentation of the GPT calls.
+
+Every completion sent to OpenAI is recorded with its call type, the app route
+it was made for, the model, its outcome and:
+
+- prompt and completion tokens, as counters and histograms
+- time to first byte: when the response headers arrived, or for streamed
+  replies when the first content arrived
+- total latency
+
+The outcome is how its reply decoded ("parsed", "repaired" or "failed", see
+agents.schemas) or "error" when the request itself failed. The route is the
+Flask URL rule of the request that made the call, or "background" for calls
+made off a request, e.g. prefetches and jobs.
+
+summary() sums it all up per call type, route and model for the admin view.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from flask import has_request_context, request
+
+from utils import metrics
+
+ERROR = "error"
+
+BACKGROUND_ROUTE = "background"
+
+
+def current_route():
+    """The URL rule of the Flask request being served, or BACKGROUND_ROUTE"""
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return BACKGROUND_ROUTE
+
+
+@dataclass
+class Completion:
+    """Measurements of one completion request"""
+
+    call_type: str
+    model: str
+    route: str
+    latency: float = 0.0
+    ttfb: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def add_usage(self, usage):
+        if usage is not None:
+            self.prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+
+
+def record(completion, outcome):
+    """Export one completion's measurements with its outcome"""
+    labels = {"call_type": completion.call_type, "route": completion.route, "model": completion.model}
+
+    metrics.increment("llm_completions_total", outcome=outcome, **labels)
+    metrics.observe("llm_latency_seconds", completion.latency, **labels)
+    if completion.ttfb is not None:
+        metrics.observe("llm_ttfb_seconds", completion.ttfb, **labels)
+    if outcome == ERROR:
+        return
+
+    metrics.increment("llm_prompt_tokens_total", completion.prompt_tokens, **labels)
+    metrics.increment("llm_completion_tokens_total", completion.completion_tokens, **labels)
+    metrics.observe("llm_prompt_tokens", completion.prompt_tokens, buckets=metrics.TOKEN_BUCKETS, **labels)
+    metrics.observe(
+        "llm_completion_tokens", completion.completion_tokens, buckets=metrics.TOKEN_BUCKETS, **labels
+    )
+
+
+def _quantiles(name, labels):
+    histogram = metrics.get_histogram(name, **labels)
+    return {
+        "p50": metrics.histogram_quantile(histogram, 0.5),
+        "p95": metrics.histogram_quantile(histogram, 0.95),
+        "mean": histogram["sum"] / histogram["count"] if histogram else None,
+    }
+
+
+def summary():
+    """
+    Completions, tokens and latency per call type, route and model
+
+    Returns:
+        list: One dict per call type, route and model with completions per
+        outcome, token totals and means, and latency and TTFB p50, p95 and mean
+        in seconds, estimated from the histograms
+    """
+    rows = {}
+    for metric in metrics.snapshot():
+        if metric["name"] != "llm_completions_total":
+            continue
+        labels = dict(metric["labels"])
+        outcome = labels.pop("outcome")
+        key = (labels["call_type"], labels["route"], labels["model"])
+        row = rows.setdefault(key, {**labels, "completions": 0, "outcomes": {}})
+        row["completions"] += int(metric["value"])
+        row["outcomes"][outcome] = int(metric["value"])
+
+    for (call_type, route, model), row in rows.items():
+        labels = {"call_type": call_type, "route": route, "model": model}
+        prompt_tokens = metrics.get_counter("llm_prompt_tokens_total", **labels)
+        completion_tokens = metrics.get_counter("llm_completion_tokens_total", **labels)
+        answered = row["completions"] - row["outcomes"].get(ERROR, 0)
+        row.update({
+            "prompt_tokens": int(prompt_tokens),
+            "completion_tokens": int(completion_tokens),
+            "mean_prompt_tokens": prompt_tokens / answered if answered else None,
+            "mean_completion_tokens": completion_tokens / answered if answered else None,
+            "latency_seconds": _quantiles("llm_latency_seconds", labels),
+            "ttfb_seconds": _quantiles("llm_ttfb_seconds", labels),
+        })
+    return [rows[key] for key in sorted(rows)]
@@ -10,6 +10,8 @@ from case.case_api import case_blueprint
 from visit.visit_api import visit_blueprint
 from appointment.webhooks import webhook_bp
 from appointment.appointment_api import appointment_blueprint
+from agents.llm_api import llm_blueprint
+from case.enrichment import resume_pending_in_background
 import os
 
 load_dotenv()
@@ -25,6 +27,11 @@ app.register_blueprint(newsletter_bp)
 app.register_blueprint(case_blueprint)
 app.register_blueprint(visit_blueprint)
 app.register_blueprint(webhook_bp)
+app.register_blueprint(llm_blueprint)
+
+# Pick up case titles left unfinished by the last run. Conclusion jobs are
+# resumed by the first request that uses the job queue.
+resume_pending_in_background()
 
 PORT = int(os.getenv("PORT", 5002))
 
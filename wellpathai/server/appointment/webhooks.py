@@ -5,6 +5,7 @@ import firebase_admin
 import pytz
 from datetime import datetime
 from firebase_admin import credentials, firestore
+from visit.visit import update_visit
 
 # Initialize Firebase (only once in the main app)
 db = firestore.client()
@@ -108,7 +109,7 @@ def cal_webhook():
         print(f"✅ Appointment Created: {event_id} (Local Time: {start_time_local} - {end_time_local})", flush=True)
 
         # visit db, update status to scheduled
-        db.collection("visits").document(visit_id).update({
+        update_visit(visit_id, {
             "appointmentStatus": "scheduled",
             "appointmentId": event_id
         })
@@ -121,7 +122,7 @@ def cal_webhook():
         print(f"❌ Appointment Cancelled: {event_id} (Local Time: {start_time_local} - {end_time_local})", flush=True)
 
         # visit db, update status to unscheduled
-        db.collection("visits").document(visit_id).update({
+        update_visit(visit_id, {
             "appointmentStatus": "unscheduled"
         })
 
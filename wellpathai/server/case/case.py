@@ -1,17 +1,22 @@
 from firebase_admin import firestore
 from datetime import datetime
 import uuid
-from agents.gpt import generate_case_title
-from utils.data_utils import get_questionnaire_data
+from case import counters, deletion, enrichment
+from questionnaire.storage import to_list_shape
 # Initialize Firestore
 db = firestore.client()
 
 def create_case(user_id, questionnaire_id, title=None, description=None):
     """
     Create a new case for a user
-    
+
+    Without a title the case is stored under a provisional one right away and
+    its title and description are generated in the background, see
+    case.enrichment. titleStatus tells whether that is still pending.
+
     Args:
         user_id (str): The ID of the user
+        questionnaire_id (str, optional): The questionnaire the case starts from
         title (str, optional): Title of the case
         description (str, optional): Description of the case
         
@@ -19,38 +24,43 @@ def create_case(user_id, questionnaire_id, title=None, description=None):
         str: The ID of the created case
     """
     try:
-        # Generate a default title if none provided
-        if not title:
-            questionnaire_data = get_questionnaire_data(questionnaire_id, user_id)
-            gpt_description, gpt_title = generate_case_title(questionnaire_data)
-            if gpt_title and gpt_description:
-                title = gpt_title
-                description = gpt_description
-            else:
-                title = f"Case {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-            
+        if title:
+            title_status = enrichment.TITLE_READY
+        elif questionnaire_id:
+            title = enrichment.provisional_title()
+            title_status = enrichment.TITLE_PENDING
+        else:
+            title = enrichment.provisional_title()
+            title_status = enrichment.TITLE_PROVISIONAL
+
         # Create case document
         case_data = {
             'userId': user_id,
+            'questionnaireId': questionnaire_id,
             'title': title,
             'description': description,
+            'titleStatus': title_status,
             'createdAt': datetime.now(),
             'updatedAt': datetime.now(),
             'status': 'active',  # active, closed
             'visits': [],
+            **counters.EMPTY_COUNTERS,
         }
         
-        # Add to Firestore
+        # Add the case and list it on the user in a single write
         case_ref = db.collection('cases').document()
-        case_ref.set(case_data)
-        
-        # Also add to user's cases list
         user_ref = db.collection('users').document(user_id)
-        user_ref.update({
+        batch = db.batch()
+        batch.set(case_ref, case_data)
+        batch.update(user_ref, {
             'cases': firestore.ArrayUnion([case_ref.id])
         })
+        batch.commit()
         
         print(f"Case created successfully: {case_ref.id}", flush=True)
+
+        if title_status == enrichment.TITLE_PENDING:
+            enrichment.enqueue(case_ref.id, user_id, questionnaire_id)
         
         return case_ref.id
     except Exception as e:
@@ -128,6 +138,10 @@ def update_case(case_id, data):
             
         # Always update the updatedAt timestamp
         data['updatedAt'] = datetime.now()
+
+        # A title set by the user replaces any title still being generated
+        if data.get('title'):
+            data['titleStatus'] = enrichment.TITLE_READY
         
         case_ref = db.collection('cases').document(case_id)
         case_ref.update(data)
@@ -137,50 +151,75 @@ def update_case(case_id, data):
         print(f"Error updating case: {str(e)}")
         return False
 
-def add_appointment_to_case(case_id, appointment_id):
+def _read_pair(transaction, case_ref, other_ref):
+    """Read the case and the document to link to it with one get_all"""
+    snapshots = {
+        snapshot.reference.path: snapshot
+        for snapshot in db.get_all([case_ref, other_ref], transaction=transaction)
+    }
+    return snapshots[case_ref.path], snapshots[other_ref.path]
+
+def _link_to_case(case_id, collection, doc_id, case_field, label):
     """
-    Add an appointment to a case
-    
+    List a document in one of the case's fields and point it back at the case
+
+    Both documents are read together and updated in one transaction, so
+    nothing is written when either of them is missing.
+
     Args:
         case_id (str): The ID of the case
-        appointment_id (str): The ID of the appointment
-        
+        collection (str): Collection of the document, e.g. "appointments"
+        doc_id (str): The ID of the document
+        case_field (str): The case's list of such documents
+        label (str): Name of the document in log messages
+
     Returns:
-        bool: True if successful, False otherwise
+        bool: True if both exist and were linked
     """
-    try:
-        # Update case with appointment ID
-        case_ref = db.collection('cases').document(case_id)
-        case = case_ref.get()
-        
+    case_ref = db.collection('cases').document(case_id)
+    doc_ref = db.collection(collection).document(doc_id)
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _link(transaction):
+        case, doc = _read_pair(transaction, case_ref, doc_ref)
         if not case.exists:
             print(f"Case {case_id} does not exist")
             return False
-            
-        case_ref.update({
-            'appointments': firestore.ArrayUnion([appointment_id]),
-            'updatedAt': datetime.now()
-        })
-        
-        # Update appointment with case ID
-        appointment_ref = db.collection('appointments').document(appointment_id)
-        appointment = appointment_ref.get()
-        
-        if not appointment.exists:
-            print(f"Appointment {appointment_id} does not exist")
-            # Rollback the case update
-            case_ref.update({
-                'appointments': firestore.ArrayRemove([appointment_id])
-            })
+        if not doc.exists:
+            print(f"{label} {doc_id} does not exist")
             return False
-            
-        appointment_ref.update({
+
+        now = datetime.now()
+        transaction.update(case_ref, {
+            case_field: firestore.ArrayUnion([doc_id]),
+            'updatedAt': now
+        })
+        transaction.update(doc_ref, {
             'caseId': case_id,
-            'updatedAt': datetime.now()
+            'updatedAt': now
         })
-        
-        print(f"Successfully linked appointment {appointment_id} to case {case_id}")
         return True
+
+    if not _link(transaction):
+        return False
+
+    print(f"Successfully linked {label.lower()} {doc_id} to case {case_id}")
+    return True
+
+def add_appointment_to_case(case_id, appointment_id):
+    """
+    Add an appointment to a case (bidirectional update)
+    
+    Args:
+        case_id (str): The ID of the case
+        appointment_id (str): The ID of the appointment
+        
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        return _link_to_case(case_id, 'appointments', appointment_id, 'appointments', "Appointment")
     except Exception as e:
         print(f"Error adding appointment to case: {str(e)}")
         return False
@@ -188,6 +227,9 @@ def add_appointment_to_case(case_id, appointment_id):
 def add_visit_to_case(case_id, visit_id):
     """
     Add a visit to a case
+
+    The visit, the visit lists of its old and new case and their visit
+    counters are updated in one transaction, see case.counters.
     
     Args:
         case_id (str): The ID of the case
@@ -197,35 +239,34 @@ def add_visit_to_case(case_id, visit_id):
         bool: True if successful, False otherwise
     """
     try:
-        # Update case with visit ID
         case_ref = db.collection('cases').document(case_id)
-        case = case_ref.get()
-        
-        if not case.exists:
-            print(f"Case {case_id} does not exist")
-            return False
-            
-        case_ref.update({
-            'visits': firestore.ArrayUnion([visit_id]),
-            'updatedAt': datetime.now()
-        })
-        
-        # Update visit with case ID
         visit_ref = db.collection('visits').document(visit_id)
-        visit = visit_ref.get()
-        
-        if not visit.exists:
-            print(f"Visit {visit_id} does not exist")
-            # Rollback the case update
-            case_ref.update({
-                'visits': firestore.ArrayRemove([visit_id])
-            })
+        transaction = db.transaction()
+
+        @firestore.transactional
+        def _link(transaction):
+            case, visit = _read_pair(transaction, case_ref, visit_ref)
+            if not case.exists:
+                print(f"Case {case_id} does not exist")
+                return False
+            if not visit.exists:
+                print(f"Visit {visit_id} does not exist")
+                return False
+
+            now = datetime.now()
+            before = visit.to_dict()
+            case_updates = {case_id: {'visits': firestore.ArrayUnion([visit_id]), 'updatedAt': now}}
+            if before.get('caseId') and before['caseId'] != case_id:
+                case_updates[before['caseId']] = {'visits': firestore.ArrayRemove([visit_id]), 'updatedAt': now}
+
+            counters.stage(
+                transaction, before, {**before, 'caseId': case_id}, case_updates, cases={case_id: case}
+            )
+            transaction.update(visit_ref, {'caseId': case_id, 'updatedAt': now})
+            return True
+
+        if not _link(transaction):
             return False
-            
-        visit_ref.update({
-            'caseId': case_id,
-            'updatedAt': datetime.now()
-        })
         
         print(f"Successfully linked visit {visit_id} to case {case_id}")
         return True
@@ -245,38 +286,7 @@ def add_result_to_case(case_id, result_id):
         bool: True if successful, False otherwise
     """
     try:
-        # 1. Update case with result ID
-        case_ref = db.collection('cases').document(case_id)
-        case = case_ref.get()
-        
-        if not case.exists:
-            print(f"Case {case_id} does not exist")
-            return False
-            
-        case_ref.update({
-            'results': firestore.ArrayUnion([result_id]),
-            'updatedAt': datetime.now()
-        })
-        
-        # 2. Update result with case ID
-        result_ref = db.collection('results').document(result_id)
-        result = result_ref.get()
-        
-        if not result.exists:
-            print(f"Result {result_id} does not exist")
-            # Rollback the case update
-            case_ref.update({
-                'results': firestore.ArrayRemove([result_id])
-            })
-            return False
-            
-        result_ref.update({
-            'caseId': case_id,
-            'updatedAt': datetime.now()
-        })
-        
-        print(f"Successfully linked result {result_id} to case {case_id}")
-        return True
+        return _link_to_case(case_id, 'results', result_id, 'results', "Result")
     except Exception as e:
         print(f"Error adding result to case: {str(e)}")
         return False
@@ -293,38 +303,7 @@ def add_report_to_case(case_id, report_id):
         bool: True if successful, False otherwise
     """
     try:
-        # 1. Update case with report ID
-        case_ref = db.collection('cases').document(case_id)
-        case = case_ref.get()
-        
-        if not case.exists:
-            print(f"Case {case_id} does not exist")
-            return False
-            
-        case_ref.update({
-            'reports': firestore.ArrayUnion([report_id]),
-            'updatedAt': datetime.now()
-        })
-        
-        # 2. Update report with case ID
-        report_ref = db.collection('reports').document(report_id)
-        report = report_ref.get()
-        
-        if not report.exists:
-            print(f"Report {report_id} does not exist")
-            # Rollback the case update
-            case_ref.update({
-                'reports': firestore.ArrayRemove([report_id])
-            })
-            return False
-            
-        report_ref.update({
-            'caseId': case_id,
-            'updatedAt': datetime.now()
-        })
-        
-        print(f"Successfully linked report {report_id} to case {case_id}")
-        return True
+        return _link_to_case(case_id, 'reports', report_id, 'reports', "Report")
     except Exception as e:
         print(f"Error adding report to case: {str(e)}")
         return False
@@ -352,7 +331,7 @@ def get_case_questionnaires(case_id):
         
         questionnaire_list = []
         for questionnaire in questionnaires:
-            questionnaire_data = questionnaire.to_dict()
+            questionnaire_data = to_list_shape(questionnaire.to_dict())
             questionnaire_data['id'] = questionnaire.id
             
             # Format datetime objects for JSON serialization
@@ -451,36 +430,19 @@ def reopen_case(case_id):
 
 def delete_case(case_id):
     """
-    Delete a case
+    Delete a case with its visits, questionnaires and appointments
+
+    Cases with many of them are deleted in the background, see case.deletion.
     
     Args:
         case_id (str): The ID of the case
         
     Returns:
-        bool: True if successful, False otherwise
+        bool: True if the case was deleted or its deletion started, False otherwise
     """
     try:
-        # Get the case to find the user ID
-        case_ref = db.collection('cases').document(case_id)
-        case = case_ref.get()
-        
-        if not case.exists:
-            return False
-            
-        case_data = case.to_dict()
-        user_id = case_data.get('userId')
-        
-        # Remove case from user's cases list
-        if user_id:
-            user_ref = db.collection('users').document(user_id)
-            user_ref.update({
-                'cases': firestore.ArrayRemove([case_id])
-            })
-        
-        # Delete the case
-        case_ref.delete()
-        
-        return True
+        job, _ = deletion.start(case_id)
+        return job is not None and job.status != deletion.FAILED
     except Exception as e:
         print(f"Error deleting case: {str(e)}")
         return False
@@ -497,41 +459,21 @@ def get_case_summary(user_id):
         list: List of case summary data
     """
     try:
-        # Query Firestore for cases with this user ID
+        # Query Firestore for cases with this user ID, their visit counters are stored on them
         cases = db.collection('cases').where('userId', '==', user_id).stream()
-        
         case_list = []
         for case in cases:
             case_data = case.to_dict()
             case_data['id'] = case.id
-            
-            # Get all visits for this case
-            visits = db.collection('visits').where('caseId', '==', case.id).stream()
-            visit_count = 0
-            new_report_count = 0
-            last_visit_date = None
-            
-            for visit in visits:
-                visit_data = visit.to_dict()
-                visit_count += 1
-                
-                if visit_data.get('hasNewReport'):
-                    new_report_count += 1
-                    
-                visit_date = visit_data.get('visitDate')  # visitDate is already a string
-                
-                # Update last visit date only if it's more recent
-                if visit_date and (not last_visit_date or visit_date > last_visit_date):
-                    last_visit_date = visit_date  # Store it as a string without isoformat()
-
-            case_data['visitCount'] = visit_count
-            case_data['newReportCount'] = new_report_count
-            case_data['lastVisitDate'] = last_visit_date  # No need to convert to ISO format
-            
-            print(f"Case data: {case_data}", flush=True)
-            
             case_list.append(case_data)
-            
+
+        # Cases from before the counters get them computed from their visits
+        missing = [case_data['id'] for case_data in case_list if 'visitCount' not in case_data]
+        if missing:
+            computed = counters.compute(missing)
+            for case_data in case_list:
+                case_data.update(computed.get(case_data['id'], {}))
+
         return case_list
     except Exception as e:
         print(f"Error getting case summary: {str(e)}")
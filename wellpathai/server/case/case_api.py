@@ -12,9 +12,10 @@ from case.case import (
     get_case_questionnaires,
     close_case,
     reopen_case,
-    delete_case,
     get_case_summary
 )
+from case import counters, deletion, timeline
+from utils.auth import admin_required
 
 # Blueprint for case routes
 case_blueprint = Blueprint("case", __name__)
@@ -175,14 +176,54 @@ def api_reopen_case(case_id):
 
 @case_blueprint.route("/api/cases/<case_id>", methods=["DELETE"])
 def api_delete_case(case_id):
-    """Delete a case"""
-    success = delete_case(case_id)
-    
-    if success:
-        return jsonify({"message": "Case deleted successfully"}), 200
-    else:
-        return jsonify({"error": "Failed to delete case"}), 500 
+    """
+    Delete a case with its visits, questionnaires and appointments
+
+    With ?dryRun=true only counts what would be deleted. Cases with many
+    dependents are deleted in the background: the response is then 202 and
+    /api/cases/deletions/<jobId> reports the progress.
+    """
+    try:
+        if request.args.get("dryRun", "false").lower() in ("1", "true", "yes"):
+            counts = deletion.count(case_id)
+            if counts is None:
+                return jsonify({"error": "Case not found"}), 404
+            return jsonify({"caseId": case_id, "dryRun": True, "counts": counts, "total": sum(counts.values())}), 200
+
+        job, in_background = deletion.start(case_id)
+    except Exception as e:
+        print(f"Error deleting case: {str(e)}", flush=True)
+        return jsonify({"error": "Failed to delete case"}), 500
+
+    if job is None:
+        return jsonify({"error": "Case not found"}), 404
+    if in_background:
+        return jsonify({"message": "Case deletion started", **job.to_dict()}), 202
+    if job.status == deletion.FAILED:
+        return jsonify({"error": "Failed to delete case", **job.to_dict()}), 500
+    return jsonify({"message": "Case deleted successfully", **job.to_dict()}), 200
+
+@case_blueprint.route("/api/cases/deletions/<job_id>", methods=["GET"])
+def api_get_case_deletion(job_id):
+    """Progress of a case deleted in the background"""
+    job = deletion.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Deletion job not found"}), 404
+    return jsonify(job), 200
     
+@case_blueprint.route("/api/cases/<case_id>/timeline", methods=["GET"])
+def api_get_case_timeline(case_id):
+    """The case with its visits joined to their questionnaire, appointment and report, in one response"""
+    try:
+        case_timeline = timeline.get_case_timeline(case_id)
+    except Exception as e:
+        print(f"Error getting case timeline: {str(e)}", flush=True)
+        return jsonify({"error": "Failed to get case timeline"}), 500
+
+    if case_timeline is None:
+        return jsonify({"error": "Case not found"}), 404
+    return jsonify(case_timeline), 200
+
 @case_blueprint.route("/api/cases/<case_id>/questionnaires", methods=["GET"])
 def api_get_case_questionnaires(case_id):
     """Get all questionnaires for a case"""
@@ -212,9 +253,19 @@ def api_get_case_summary():
     """Get all case summary"""
     cases = get_case_summary(user_id)
     
-    print(f"Cases: {cases}", flush=True)
-    
     if cases is None:
         return jsonify({"error": "Failed to get case summary"}), 404
         
-    return jsonify(cases), 200
\ No newline at end of file
+    return jsonify(cases), 200
+
+# Recompute the visit counters stored on the cases, of one user or all, and repair drift.
+# Meant to be called by a scheduler, e.g. nightly
+@case_blueprint.route("/api/admin/cases/reconcile-counters", methods=["POST"])
+@admin_required
+def api_reconcile_counters():
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(counters.reconcile(data.get("userId"))), 200
+    except Exception as e:
+        print(f"Error reconciling case counters: {str(e)}", flush=True)
+        return jsonify({"error": "Failed to reconcile case counters"}), 500
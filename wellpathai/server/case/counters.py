@@ -0,0 +1,213 @@
+"""
+Visit rollups stored on case documents.
+
+Each case carries the numbers the case summary shows:
+
+- visitCount: visits whose caseId is the case
+- newReportCount: those of them with hasNewReport set
+- lastVisitDate: the latest of their visitDate strings
+
+Every write that changes a visit's caseId, hasNewReport or visitDate goes
+through a transaction that reads the visit, and stage() adds the matching
+Increment updates to its case in the same commit. lastVisitDate is raised with
+a read-modify-write instead of a Maximum transform, which Firestore only
+applies to numbers. It is never lowered, so a visit that moves to an earlier
+date or to another case leaves it stale until reconcile() runs.
+
+Cases created before the counters were introduced have no visitCount. stage()
+leaves them alone and the case summary computes their rollups from the visits
+instead, until reconcile() stores them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from firebase_admin import firestore
+
+from utils import metrics
+
+db = firestore.client()
+
+COUNTER_FIELDS = ('visitCount', 'newReportCount', 'lastVisitDate')
+
+# Counters of a case without visits
+EMPTY_COUNTERS = {'visitCount': 0, 'newReportCount': 0, 'lastVisitDate': None}
+
+# Most values Firestore accepts in one "in" filter
+IN_QUERY_LIMIT = 30
+
+# Visit fields the rollups are computed from
+ROLLUP_VISIT_FIELDS = ['caseId', 'hasNewReport', 'visitDate']
+
+# Runs the "in" queries of visits_by_case in parallel
+_query_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CASE_SUMMARY_QUERY_WORKERS", 8)),
+    thread_name_prefix="case-summary",
+)
+
+
+def visits_by_case(case_ids):
+    """
+    The visits of many cases grouped by case ID
+
+    One "in" query per IN_QUERY_LIMIT cases, run in parallel, each reading
+    only ROLLUP_VISIT_FIELDS.
+    """
+    def fetch(chunk):
+        query = db.collection('visits').where('caseId', 'in', chunk).select(ROLLUP_VISIT_FIELDS)
+        return [visit.to_dict() for visit in query.stream()]
+
+    chunks = [case_ids[i:i + IN_QUERY_LIMIT] for i in range(0, len(case_ids), IN_QUERY_LIMIT)]
+    if len(chunks) > 1:
+        results = _query_executor.map(fetch, chunks)
+    else:
+        results = map(fetch, chunks)
+
+    grouped = {case_id: [] for case_id in case_ids}
+    for visits in results:
+        for visit_data in visits:
+            grouped.setdefault(visit_data.get('caseId'), []).append(visit_data)
+    return grouped
+
+
+def rollup(visits):
+    """The counters of a case with the given visits"""
+    counters = dict(EMPTY_COUNTERS)
+    for visit_data in visits:
+        counters['visitCount'] += 1
+        if visit_data.get('hasNewReport'):
+            counters['newReportCount'] += 1
+        visit_date = visit_data.get('visitDate')  # visitDate is already a string
+        if visit_date and (not counters['lastVisitDate'] or visit_date > counters['lastVisitDate']):
+            counters['lastVisitDate'] = visit_date
+    return counters
+
+
+def compute(case_ids):
+    """The counters of each case computed from its visits"""
+    return {case_id: rollup(visits) for case_id, visits in visits_by_case(list(case_ids)).items()}
+
+
+def visit_changes(before, after):
+    """
+    How a visit changing from `before` to `after` moves the counters
+
+    Args:
+        before (dict): The visit before the write, or None if it is new
+        after (dict): The visit after the write
+
+    Returns:
+        dict: case ID -> {"visitCount": delta, "newReportCount": delta,
+        "visitDate": date to raise lastVisitDate to or None}
+    """
+    before = before or {}
+    old_case, new_case = before.get('caseId'), after.get('caseId')
+    old_report, new_report = int(bool(before.get('hasNewReport'))), int(bool(after.get('hasNewReport')))
+
+    changes = {}
+    if old_case and old_case == new_case:
+        changes[old_case] = {
+            'visitCount': 0,
+            'newReportCount': new_report - old_report,
+            'visitDate': after.get('visitDate') if after.get('visitDate') != before.get('visitDate') else None,
+        }
+    else:
+        if old_case:
+            changes[old_case] = {'visitCount': -1, 'newReportCount': -old_report, 'visitDate': None}
+        if new_case:
+            changes[new_case] = {'visitCount': 1, 'newReportCount': new_report, 'visitDate': after.get('visitDate')}
+
+    return {
+        case_id: change for case_id, change in changes.items()
+        if change['visitCount'] or change['newReportCount'] or change['visitDate']
+    }
+
+
+def _counter_updates(case_data, change):
+    updates = {}
+    if change['visitCount']:
+        updates['visitCount'] = firestore.Increment(change['visitCount'])
+    if change['newReportCount']:
+        updates['newReportCount'] = firestore.Increment(change['newReportCount'])
+    last_visit_date = case_data.get('lastVisitDate')
+    if change['visitDate'] and (not last_visit_date or change['visitDate'] > last_visit_date):
+        updates['lastVisitDate'] = change['visitDate']
+    return updates
+
+
+def stage(transaction, before, after, case_updates=None, cases=None):
+    """
+    Stage the counter updates of a visit write in its transaction
+
+    Reads the cases involved, so it has to come after the transaction's other
+    reads and before its writes.
+
+    Args:
+        transaction: The transaction writing the visit
+        before (dict): The visit before the write, or None if it is new
+        after (dict): The visit after the write
+        case_updates (dict, optional): case ID -> other fields to update on
+            that case in the same write
+        cases (dict, optional): case ID -> snapshot of the cases already read
+            in the transaction
+
+    Returns:
+        set: IDs of the cases that exist, only those are updated
+    """
+    case_updates = case_updates or {}
+    cases = cases or {}
+    changes = visit_changes(before, after)
+
+    writes = {}
+    for case_id in set(changes) | set(case_updates):
+        case_ref = db.collection('cases').document(case_id)
+        case = cases.get(case_id) or case_ref.get(transaction=transaction)
+        if not case.exists:
+            continue
+        case_data = case.to_dict()
+        updates = dict(case_updates.get(case_id, {}))
+        # Cases from before the counters are left to reconcile()
+        if case_id in changes and 'visitCount' in case_data:
+            updates.update(_counter_updates(case_data, changes[case_id]))
+        writes[case_id] = (case_ref, updates)
+
+    for case_ref, updates in writes.values():
+        if updates:
+            transaction.update(case_ref, updates)
+    return set(writes)
+
+
+def reconcile(user_id=None):
+    """
+    Recompute the counters of every case, or of one user's cases, and repair drift
+
+    Returns:
+        dict: {"checked": cases checked, "repaired": cases whose counters were rewritten}
+    """
+    query = db.collection('cases')
+    if user_id:
+        query = query.where('userId', '==', user_id)
+    stored = {case.id: case.to_dict() for case in query.select(list(COUNTER_FIELDS)).stream()}
+
+    repaired = 0
+    batch = db.batch()
+    pending = 0
+    for case_id, counters in compute(stored).items():
+        current = {field: stored[case_id].get(field) for field in COUNTER_FIELDS}
+        if current == counters and 'visitCount' in stored[case_id]:
+            continue
+        batch.update(db.collection('cases').document(case_id), counters)
+        repaired += 1
+        pending += 1
+        # A batch holds at most 500 writes
+        if pending == 500:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+
+    metrics.increment("case_counters_checked_total", len(stored))
+    metrics.increment("case_counters_repaired_total", repaired)
+    print(f"Reconciled visit counters: {repaired} of {len(stored)} cases repaired", flush=True)
+    return {"checked": len(stored), "repaired": repaired}
@@ -0,0 +1,223 @@
+"""
+Cascading delete of a case and everything pointing at it.
+
+Deleting a case used to remove only the case and its entry on the user, and
+left its visits, questionnaires and appointments behind. delete() finds them
+with keys-only queries on DEPENDENTS and deletes them through a BulkWriter.
+The BulkWriter is throttled to CASE_DELETE_OPS_PER_SECOND, ramping up to
+CASE_DELETE_MAX_OPS_PER_SECOND, so a large case doesn't starve live traffic.
+The case itself and its entry on the user go last, in one batch. A delete
+that fails part way can simply be run again.
+
+Cases with more than BACKGROUND_THRESHOLD dependents are deleted on a worker
+thread. start() then returns a job whose progress get_job() reports.
+count() is the dry run: it returns what would be deleted without deleting
+anything.
+
+Jobs are kept in memory for JOB_TTL_SECONDS after they finish.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import threading
+import time
+import uuid
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+
+from utils import metrics
+
+db = firestore.client()
+
+# Collection and field of the documents pointing at a case.
+# Appointments booked through cal.com carry the case as case_id.
+DEPENDENTS = (
+    ('visits', 'caseId'),
+    ('questionnaires', 'caseId'),
+    ('appointments', 'caseId'),
+    ('appointments', 'case_id'),
+)
+
+# Deletes per second the BulkWriter starts at and may ramp up to
+CASE_DELETE_OPS_PER_SECOND = int(os.getenv("CASE_DELETE_OPS_PER_SECOND", 100))
+CASE_DELETE_MAX_OPS_PER_SECOND = int(os.getenv("CASE_DELETE_MAX_OPS_PER_SECOND", 300))
+
+# Cases with more dependents than this are deleted in the background
+BACKGROUND_THRESHOLD = int(os.getenv("CASE_DELETE_BACKGROUND_THRESHOLD", 100))
+
+# Times a failed delete is retried by the BulkWriter before it is given up
+MAX_ATTEMPTS = 5
+
+# How long finished jobs stay available to get_job()
+JOB_TTL_SECONDS = int(os.getenv("CASE_DELETE_JOB_TTL", 3600))
+
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CASE_DELETE_WORKERS", 1)),
+    thread_name_prefix="case-delete",
+)
+
+_jobs_lock = threading.Lock()
+_jobs = {}
+
+
+class Deletion:
+    """Progress of one cascading case delete, updated from the BulkWriter's threads"""
+
+    def __init__(self, case_id, counts):
+        self.id = uuid.uuid4().hex
+        self.case_id = case_id
+        self.counts = counts
+        self.total = sum(counts.values())
+        self.deleted = 0
+        self.failed = 0
+        self.status = RUNNING
+        self.error = None
+        self.started_at = datetime.now()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def on_result(self, reference, result, bulk_writer):
+        with self._lock:
+            self.deleted += 1
+
+    def on_error(self, failure, bulk_writer):
+        if failure.attempts < MAX_ATTEMPTS:
+            return True
+        with self._lock:
+            self.failed += 1
+        print(f"Giving up deleting {failure.operation.reference.path}: {failure.message}", flush=True)
+        return False
+
+    def finish(self, error=None):
+        with self._lock:
+            if error is None and self.failed:
+                error = f"{self.failed} documents could not be deleted"
+            self.status = FAILED if error else SUCCEEDED
+            self.error = error
+            self.finished_at = datetime.now()
+        metrics.increment("case_delete_total", status=self.status)
+        metrics.increment("case_delete_documents_total", self.deleted)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "jobId": self.id,
+                "caseId": self.case_id,
+                "status": self.status,
+                "counts": dict(self.counts),
+                "total": self.total,
+                "deleted": self.deleted,
+                "failed": self.failed,
+                "error": self.error,
+                "startedAt": self.started_at.isoformat(),
+                "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+            }
+
+
+def find_dependents(case_id):
+    """
+    References to every document pointing at a case
+
+    Returns:
+        dict: collection -> list of document references
+    """
+    dependents = {}
+    for collection, field in DEPENDENTS:
+        refs = dependents.setdefault(collection, {})
+        query = db.collection(collection).where(field, '==', case_id).select(['__name__'])
+        for snapshot in query.stream():
+            refs[snapshot.reference.path] = snapshot.reference
+    return {collection: list(refs.values()) for collection, refs in dependents.items()}
+
+
+def count(case_id):
+    """
+    Dry run: how many documents deleting a case would delete
+
+    Returns:
+        dict: collection -> number of dependents, or None if the case does not exist
+    """
+    if not db.collection('cases').document(case_id).get().exists:
+        return None
+    return {collection: len(refs) for collection, refs in find_dependents(case_id).items()}
+
+
+def _run(deletion, dependents, case_ref, user_id):
+    """Delete the dependents, then the case and its entry on the user"""
+    try:
+        bulk_writer = db.bulk_writer(BulkWriterOptions(
+            initial_ops_per_second=CASE_DELETE_OPS_PER_SECOND,
+            max_ops_per_second=CASE_DELETE_MAX_OPS_PER_SECOND,
+        ))
+        bulk_writer.on_write_result(deletion.on_result)
+        bulk_writer.on_write_error(deletion.on_error)
+        for refs in dependents.values():
+            for ref in refs:
+                bulk_writer.delete(ref)
+        bulk_writer.close()
+
+        if deletion.failed:
+            # Keep the case so that the delete can be run again
+            deletion.finish()
+            return deletion
+
+        batch = db.batch()
+        if user_id:
+            batch.update(db.collection('users').document(user_id), {
+                'cases': firestore.ArrayRemove([case_ref.id])
+            })
+        batch.delete(case_ref)
+        batch.commit()
+        deletion.finish()
+    except Exception as e:
+        print(f"Error deleting case {case_ref.id}: {str(e)}", flush=True)
+        deletion.finish(str(e))
+    return deletion
+
+
+def _drop_expired():
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id, deletion in list(_jobs.items()):
+        if deletion.finished_at and deletion.finished_at.timestamp() < cutoff:
+            _jobs.pop(job_id, None)
+
+
+def start(case_id):
+    """
+    Delete a case and its dependents, in the background if there are many
+
+    Returns:
+        tuple: (Deletion, ran_in_background), or (None, False) if the case
+        does not exist. A deletion run in the foreground is finished.
+    """
+    case_ref = db.collection('cases').document(case_id)
+    case = case_ref.get()
+    if not case.exists:
+        return None, False
+
+    dependents = find_dependents(case_id)
+    deletion = Deletion(case_id, {collection: len(refs) for collection, refs in dependents.items()})
+    user_id = case.to_dict().get('userId')
+
+    if deletion.total <= BACKGROUND_THRESHOLD:
+        return _run(deletion, dependents, case_ref, user_id), False
+
+    with _jobs_lock:
+        _drop_expired()
+        _jobs[deletion.id] = deletion
+    _executor.submit(_run, deletion, dependents, case_ref, user_id)
+    print(f"Deleting case {case_id} and {deletion.total} dependents in the background", flush=True)
+    return deletion, True
+
+
+def get_job(job_id):
+    """Progress of a background delete, or None if unknown or expired"""
+    with _jobs_lock:
+        deletion = _jobs.get(job_id)
+    return deletion.to_dict() if deletion else None
@@ -0,0 +1,194 @@
+"""
+Background title generation for new cases.
+
+create_case stores a case right away under a provisional, timestamped title
+with titleStatus "pending" and queues it here. A worker thread then fills in
+the title and description: from the questionnaire's conclusion when it already
+titled the case, otherwise with a generate_case_title call. titleStatus shows
+how it went:
+
+- "pending": the title is still being generated
+- "ready": the title was given by the user or generated
+- "provisional": no title could be generated, the timestamped one stays
+
+The title is only written while the case is still pending, so a title the
+user set in the meantime is never overwritten. Cases left pending by a
+restart are queued again by resume_pending().
+
+Every process runs resume_pending() at startup, so the same case can be
+queued by several workers. Before generating a title, a worker claims the
+case in a transaction. Other workers skip a case while its claim is younger
+than TITLE_CLAIM_SECONDS, so each title costs one GPT call. A claim left by a
+worker that died expires, and the case is then picked up again.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import uuid
+
+from firebase_admin import firestore
+
+from agents.gpt import generate_case_title
+from utils import metrics
+from utils.data_utils import get_questionnaire_data
+
+db = firestore.client()
+
+TITLE_PENDING = "pending"
+TITLE_READY = "ready"
+TITLE_PROVISIONAL = "provisional"
+
+# How long a worker's claim on a pending case keeps the others from titling it
+TITLE_CLAIM_SECONDS = int(os.getenv("CASE_TITLE_CLAIM_SECONDS", 300))
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CASE_ENRICHMENT_WORKERS", 2)),
+    thread_name_prefix="case-enrichment",
+)
+
+
+def provisional_title():
+    return f"Case {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+
+
+def get_conclusion_case_title(questionnaire_id, user_id):
+    """
+    The case title and description generated with a questionnaire's conclusion
+
+    Args:
+        questionnaire_id (str): The ID of the questionnaire
+        user_id (str): The ID of the user
+
+    Returns:
+        tuple: (description, title), or None if the conclusion has none
+    """
+    questionnaire = db.collection('questionnaires').document(questionnaire_id).get()
+    if not questionnaire.exists:
+        return None
+    questionnaire_data = questionnaire.to_dict()
+    if questionnaire_data.get('user_id') != user_id:
+        return None
+
+    analysis = (questionnaire_data.get('result') or {}).get('analysis') or {}
+    if analysis.get('case_title') and analysis.get('case_description'):
+        return analysis['case_description'], analysis['case_title']
+    return None
+
+
+def _generate_title(user_id, questionnaire_id):
+    """(description, title) for a case, or None if none could be generated"""
+    # The conclusion usually titled the case already, saving a GPT call
+    conclusion_title = get_conclusion_case_title(questionnaire_id, user_id)
+    if conclusion_title:
+        metrics.increment("case_title_total", source="conclusion")
+        return conclusion_title
+
+    questionnaire_data = get_questionnaire_data(questionnaire_id, user_id)
+    if not isinstance(questionnaire_data, list):
+        print(f"No questionnaire to title the case from: {questionnaire_data}", flush=True)
+        return None
+
+    generated = generate_case_title(questionnaire_data)
+    if generated:
+        metrics.increment("case_title_total", source="generated")
+    return generated
+
+
+def _claim(case_id):
+    """Claim a pending case for titling, returns the claim or None if it isn't free"""
+    case_ref = db.collection('cases').document(case_id)
+    transaction = db.transaction()
+    claim = uuid.uuid4().hex
+    now = datetime.now()
+
+    @firestore.transactional
+    def _run(transaction):
+        case = case_ref.get(transaction=transaction)
+        if not case.exists:
+            return None
+        case_data = case.to_dict()
+        if case_data.get('titleStatus') != TITLE_PENDING:
+            return None
+        claimed_at = case_data.get('titleClaimedAt')
+        if case_data.get('titleClaim') and claimed_at and claimed_at > now - timedelta(seconds=TITLE_CLAIM_SECONDS):
+            return None
+        transaction.update(case_ref, {'titleClaim': claim, 'titleClaimedAt': now})
+        return claim
+
+    return _run(transaction)
+
+
+def _apply_title(case_id, claim, updates):
+    """Write the title updates if the case is still pending under our claim, True if written"""
+    case_ref = db.collection('cases').document(case_id)
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _run(transaction):
+        case = case_ref.get(transaction=transaction)
+        if not case.exists:
+            return False
+        case_data = case.to_dict()
+        if case_data.get('titleStatus') != TITLE_PENDING or case_data.get('titleClaim') != claim:
+            return False
+        transaction.update(case_ref, {
+            **updates,
+            'titleClaim': firestore.DELETE_FIELD,
+            'titleClaimedAt': firestore.DELETE_FIELD,
+        })
+        return True
+
+    return _run(transaction)
+
+
+def enrich_case(case_id, user_id, questionnaire_id):
+    """
+    Generate and store the title and description of a pending case
+
+    Returns:
+        bool: True if the case was updated
+    """
+    try:
+        claim = _claim(case_id)
+        if claim is None:
+            # Titled already, or another worker is on it
+            return False
+
+        generated = _generate_title(user_id, questionnaire_id)
+        if generated:
+            description, title = generated
+            updates = {'title': title, 'description': description, 'titleStatus': TITLE_READY}
+        else:
+            metrics.increment("case_title_total", source="provisional")
+            updates = {'titleStatus': TITLE_PROVISIONAL}
+        updates['updatedAt'] = datetime.now()
+        return _apply_title(case_id, claim, updates)
+    except Exception as e:
+        print(f"Error enriching case {case_id}: {str(e)}", flush=True)
+        return False
+
+
+def enqueue(case_id, user_id, questionnaire_id):
+    """Generate the title of a new case in the background"""
+    return _executor.submit(enrich_case, case_id, user_id, questionnaire_id)
+
+
+def resume_pending():
+    """Queue every case still waiting for its title, e.g. after a restart"""
+    try:
+        pending = db.collection('cases').where('titleStatus', '==', TITLE_PENDING).stream()
+        count = 0
+        for case in pending:
+            case_data = case.to_dict()
+            enqueue(case.id, case_data.get('userId'), case_data.get('questionnaireId'))
+            count += 1
+        return count
+    except Exception as e:
+        print(f"Error resuming case enrichment: {str(e)}", flush=True)
+        return 0
+
+
+def resume_pending_in_background():
+    """Run resume_pending() on a worker thread, so that startup doesn't wait for its query"""
+    return _executor.submit(resume_pending)
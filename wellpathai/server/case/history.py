@@ -0,0 +1,167 @@
+"""
+Rolling summary of a case's earlier visits for the prompts.
+
+Each case keeps a `history` field: one short digest per visit (the date, the
+conclusion and the first suggestions of its report), oldest first. Recording
+a conclusion folds its digest into the history and drops the oldest digests
+until the rendered text fits CASE_HISTORY_TOKEN_BUDGET, so the history never
+has to be rebuilt from the questionnaires and stays the same size however many
+visits a case has:
+
+    (2 earlier visits not shown)
+    Visit on 2026-09-02: Tension-type headaches linked to poor sleep. Suggested: ...
+    Visit on 2026-10-11: Headaches improved, neck stiffness remains. Suggested: ...
+
+When a questionnaire selects an existing case, the text is copied onto the
+questionnaire as `caseHistory`, and the next-question and conclusion prompts
+include it from there without reading the case again.
+"""
+
+from datetime import datetime
+import os
+
+from firebase_admin import firestore
+
+from agents.prompt_format import PROMPT_TOKEN_BUDGETS, count_tokens, trim_to_tokens
+
+db = firestore.client()
+
+# Most tokens the whole history may take, see PROMPT_TOKEN_BUDGETS
+CASE_HISTORY_TOKEN_BUDGET = PROMPT_TOKEN_BUDGETS["case_history"]
+
+# Most tokens one visit's digest may take before it is trimmed
+VISIT_TOKEN_LIMIT = int(os.getenv("CASE_HISTORY_VISIT_TOKENS", 90))
+
+# Suggestions of the report kept in a visit's digest
+DIGEST_SUGGESTIONS = 2
+
+
+def visit_digest(analysis, date):
+    """One-line summary of a visit's report"""
+    digest = f"Visit on {date}: {' '.join(str(analysis.get('conclusion', '')).split())}"
+    suggestions = [s for s in analysis.get("suggestions") or [] if isinstance(s, str)]
+    if suggestions:
+        digest += " Suggested: " + "; ".join(suggestions[:DIGEST_SUGGESTIONS])
+    return trim_to_tokens(digest, VISIT_TOKEN_LIMIT)
+
+
+def render(visits, omitted=0):
+    lines = [f"({omitted} earlier visits not shown)"] if omitted else []
+    lines.extend(visit["digest"] for visit in visits)
+    return "\n".join(lines)
+
+
+def fold(history, questionnaire_id, analysis, date=None):
+    """
+    Add a visit's report to a history, keeping it within the token budget
+
+    Args:
+        history (dict): The case's current history, or None
+        questionnaire_id (str): The questionnaire of the visit
+        analysis (dict): The questionnaire's conclusion report
+        date (str, optional): Date of the visit, today by default
+
+    Returns:
+        dict: The new history. A questionnaire already in it is replaced, so
+        recording a regenerated conclusion does not add a second visit.
+    """
+    history = history or {}
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    visits = [v for v in history.get("visits", []) if v.get("questionnaireId") != questionnaire_id]
+    visits.append({"questionnaireId": questionnaire_id, "digest": visit_digest(analysis, date)})
+    omitted = history.get("omitted", 0)
+
+    text = render(visits, omitted)
+    while len(visits) > 1 and count_tokens(text) > CASE_HISTORY_TOKEN_BUDGET:
+        visits.pop(0)
+        omitted += 1
+        text = render(visits, omitted)
+
+    return {
+        "visits": visits,
+        "omitted": omitted,
+        "text": trim_to_tokens(text, CASE_HISTORY_TOKEN_BUDGET),
+        "updatedAt": datetime.now(),
+    }
+
+
+def record_conclusion(case_id, questionnaire_id, analysis):
+    """
+    Fold a questionnaire's conclusion into the history of its case
+
+    Returns:
+        bool: True if the history was updated
+    """
+    case_ref = db.collection('cases').document(case_id)
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _run(transaction):
+        case = case_ref.get(transaction=transaction)
+        if not case.exists:
+            return False
+        history = fold(case.to_dict().get('history'), questionnaire_id, analysis)
+        transaction.update(case_ref, {'history': history})
+        return True
+
+    try:
+        return _run(transaction)
+    except Exception as e:
+        print(f"Error updating history of case {case_id}: {str(e)}", flush=True)
+        return False
+
+
+def _first_visit_history(case_data, transaction=None):
+    """History of a case that has none yet, from the questionnaire it was created from"""
+    questionnaire_id = case_data.get('questionnaireId')
+    if not questionnaire_id:
+        return None
+    questionnaire = db.collection('questionnaires').document(questionnaire_id).get(transaction=transaction)
+    if not questionnaire.exists:
+        return None
+    questionnaire_data = questionnaire.to_dict()
+    if questionnaire_data.get('user_id') != case_data.get('userId'):
+        return None
+    analysis = (questionnaire_data.get('result') or {}).get('analysis')
+    if not analysis:
+        return None
+    created_at = questionnaire_data.get('createdAt')
+    date = created_at.strftime("%Y-%m-%d") if hasattr(created_at, "strftime") else None
+    return fold(None, questionnaire_id, analysis, date)
+
+
+def get_history_text(case_id, transaction=None):
+    """
+    The rendered history of a case for the prompts
+
+    Cases created before their first conclusion was folded in get their
+    history from the questionnaire they were created from, once.
+
+    Args:
+        case_id (str): ID of the case
+        transaction (Transaction, optional): Read within this transaction and
+            stage the backfilled history on it, so it is written on its commit
+
+    Returns:
+        str: The history, or None if the case has no recorded visits
+    """
+    try:
+        case_ref = db.collection('cases').document(case_id)
+        case = case_ref.get(transaction=transaction)
+        if not case.exists:
+            return None
+        case_data = case.to_dict()
+
+        history = case_data.get('history')
+        if history is None:
+            history = _first_visit_history(case_data, transaction)
+            if history is None:
+                return None
+            if transaction is not None:
+                transaction.update(case_ref, {'history': history})
+            else:
+                case_ref.update({'history': history})
+        return history.get('text') or None
+    except Exception as e:
+        print(f"Error getting history of case {case_id}: {str(e)}", flush=True)
+        return None
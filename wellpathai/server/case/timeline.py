@@ -0,0 +1,157 @@
+"""
+Everything the case page shows, in one request.
+
+Rendering a case used to take a request for the case, one for its visits, one
+for its questionnaires, one for its appointments and a check_report_exists
+call per visit. get_case_timeline() runs the case read and the queries at the
+same time, then reads the questionnaires, appointments and consultation
+reports the visits refer to with one get_all per collection, again
+concurrently. It joins each visit to its questionnaire, appointment and report
+and returns one payload.
+
+Every read is projected to the *_FIELDS below, so the payload carries neither
+questionnaire answers nor the case's prompt history.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from firebase_admin import firestore
+
+db = firestore.client()
+
+CASE_FIELDS = [
+    'userId', 'title', 'description', 'titleStatus', 'status', 'createdAt', 'updatedAt',
+    'visitCount', 'newReportCount', 'lastVisitDate',
+]
+VISIT_FIELDS = [
+    'caseId', 'visitDate', 'hasNewReport', 'appointmentStatus', 'appointmentId',
+    'consultationID', 'questionnairesID',
+]
+QUESTIONNAIRE_FIELDS = [
+    'createdAt', 'status', 'currentPath', 'result.analysis.conclusion', 'result.generated_at',
+]
+# Appointments linked with add_appointment_to_case and those booked through
+# cal.com name their times differently
+APPOINTMENT_FIELDS = [
+    'status', 'startTime', 'endTime', 'start_time', 'end_time', 'event_name', 'time_zone',
+]
+CONSULTATION_FIELDS = ['pdfUrl', 'uploadedAt']
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CASE_TIMELINE_WORKERS", 8)),
+    thread_name_prefix="case-timeline",
+)
+
+
+def _serializable(value):
+    """`value` with datetimes as ISO strings, for JSON"""
+    if isinstance(value, dict):
+        return {key: _serializable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_serializable(item) for item in value]
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _document(snapshot):
+    data = _serializable(snapshot.to_dict() or {})
+    data['id'] = snapshot.id
+    return data
+
+
+def _query(collection, field, case_id, fields):
+    query = db.collection(collection).where(field, '==', case_id).select(fields)
+    return {snapshot.id: _document(snapshot) for snapshot in query.stream()}
+
+
+def _get_all(collection, doc_ids, fields):
+    if not doc_ids:
+        return {}
+    refs = [db.collection(collection).document(doc_id) for doc_id in doc_ids]
+    return {
+        snapshot.id: _document(snapshot)
+        for snapshot in db.get_all(refs, field_paths=fields)
+        if snapshot.exists
+    }
+
+
+def _report(consultation):
+    if not consultation:
+        return None
+    return {
+        'consultationId': consultation['id'],
+        'pdfUrl': consultation.get('pdfUrl'),
+        'uploadedAt': consultation.get('uploadedAt'),
+    }
+
+
+def get_case_timeline(case_id):
+    """
+    The case with its visits, questionnaires, appointments and reports
+
+    Returns:
+        dict: {"case", "visits", "questionnaires", "appointments"}. Each visit
+        carries its "questionnaire", "appointment" and "report" (consultation
+        PDF), or None for those it has not. "questionnaires" and
+        "appointments" hold the ones of the case no visit refers to. None if
+        the case does not exist.
+    """
+    case_ref = db.collection('cases').document(case_id)
+    case_future = _executor.submit(case_ref.get, field_paths=CASE_FIELDS)
+    visits_future = _executor.submit(_query, 'visits', 'caseId', case_id, VISIT_FIELDS)
+    questionnaires_future = _executor.submit(_query, 'questionnaires', 'caseId', case_id, QUESTIONNAIRE_FIELDS)
+    appointment_futures = [
+        _executor.submit(_query, 'appointments', field, case_id, APPOINTMENT_FIELDS)
+        for field in ('caseId', 'case_id')
+    ]
+
+    case = case_future.result()
+    visits = visits_future.result()
+    questionnaires = questionnaires_future.result()
+    appointments = {}
+    for future in appointment_futures:
+        appointments.update(future.result())
+    if not case.exists:
+        return None
+    case_data = _document(case)
+
+    # Documents the visits refer to that the queries did not find
+    def referenced(field, known):
+        return sorted({visit.get(field) for visit in visits.values() if visit.get(field)} - set(known))
+
+    questionnaires_future = _executor.submit(
+        _get_all, 'questionnaires', referenced('questionnairesID', questionnaires), QUESTIONNAIRE_FIELDS
+    )
+    appointments_future = _executor.submit(
+        _get_all, 'appointments', referenced('appointmentId', appointments), APPOINTMENT_FIELDS
+    )
+    consultations_future = _executor.submit(
+        _get_all, 'consultation', referenced('consultationID', {}), CONSULTATION_FIELDS
+    )
+    questionnaires.update(questionnaires_future.result())
+    appointments.update(appointments_future.result())
+    consultations = consultations_future.result()
+
+    joined_questionnaires, joined_appointments = set(), set()
+    timeline = []
+    for visit in visits.values():
+        questionnaire_id = visit.get('questionnairesID')
+        appointment_id = visit.get('appointmentId')
+        joined_questionnaires.add(questionnaire_id)
+        joined_appointments.add(appointment_id)
+        timeline.append({
+            **visit,
+            'questionnaire': questionnaires.get(questionnaire_id),
+            'appointment': appointments.get(appointment_id),
+            'report': _report(consultations.get(visit.get('consultationID'))),
+        })
+    timeline.sort(key=lambda visit: visit.get('visitDate') or '', reverse=True)
+
+    return {
+        'case': case_data,
+        'visits': timeline,
+        'questionnaires': [q for q_id, q in questionnaires.items() if q_id not in joined_questionnaires],
+        'appointments': [a for a_id, a in appointments.items() if a_id not in joined_appointments],
+    }
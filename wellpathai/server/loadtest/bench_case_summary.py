@@ -0,0 +1,106 @@
+"""
+Benchmark of get_case_summary for users with many cases.
+
+Seeds synthetic users holding 1, 10, 100 and 500 cases with a few visits each
+into the in-memory Firestore of the tests, which sleeps `--rpc-latency`
+seconds per round trip. Times the summary of cases with stored visit counters,
+of cases without them (computed from the visits with chunked "in" queries) and
+the former one-query-per-case loop.
+
+    python -m loadtest.bench_case_summary --rpc-latency 0.02
+"""
+
+import argparse
+import os
+import sys
+import time
+from unittest.mock import patch
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.join(SERVER_DIR, "tests"))
+
+from fake_firestore import FakeFirestore
+
+os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+
+# The server modules create their Firestore client at import time
+with patch("firebase_admin.firestore.client"):
+    from case import case, counters
+
+
+def seed_user(db, user_id, cases, visits_per_case, stored_counters):
+    for i in range(cases):
+        case_id = f"{user_id}-case{i}"
+        visits = [
+            {"caseId": case_id, "hasNewReport": j == 0, "visitDate": f"2026-{(j % 12) + 1:02d}-01"}
+            for j in range(visits_per_case)
+        ]
+        case_data = {"userId": user_id, "title": f"Case {i}"}
+        if stored_counters:
+            case_data.update(counters.rollup(visits))
+        db.seed("cases", case_id, case_data)
+        for j, visit_data in enumerate(visits):
+            db.seed("visits", f"{case_id}-visit{j}", visit_data)
+
+
+def per_case_summary(db, user_id):
+    """The summary as it was computed before, one visits query per case"""
+    summary = []
+    for case_snapshot in db.collection("cases").where("userId", "==", user_id).stream():
+        visits = [v.to_dict() for v in db.collection("visits").where("caseId", "==", case_snapshot.id).stream()]
+        summary.append({
+            "id": case_snapshot.id,
+            "visitCount": len(visits),
+            "newReportCount": sum(1 for v in visits if v.get("hasNewReport")),
+            "lastVisitDate": max((v["visitDate"] for v in visits if v.get("visitDate")), default=None),
+        })
+    return summary
+
+
+def timed(db, fn):
+    db.reset_counts()
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, db.rpc_counts["query"], result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", default="1,10,100,500", help="Cases per synthetic user")
+    parser.add_argument("--visits", type=int, default=3, help="Visits per case")
+    parser.add_argument("--rpc-latency", type=float, default=0.02, help="Seconds per Firestore round trip")
+    args = parser.parse_args()
+
+    db = FakeFirestore(latency=args.rpc_latency)
+    counts = [int(c) for c in args.cases.split(",")]
+    for cases in counts:
+        seed_user(db, f"stored{cases}", cases, args.visits, stored_counters=True)
+        seed_user(db, f"computed{cases}", cases, args.visits, stored_counters=False)
+
+    def check(summary, expected):
+        rollups = {c["id"]: tuple(c[field] for field in counters.COUNTER_FIELDS) for c in summary}
+        assert rollups == {
+            c["id"].replace("computed", "stored"): tuple(c[field] for field in counters.COUNTER_FIELDS)
+            for c in expected
+        }
+
+    print(f"{args.visits} visits per case, {args.rpc_latency * 1000:.0f}ms per round trip, queries / ms")
+    print(f"{'cases':>6} {'stored counters':>16} {'computed':>16} {'per-case loop':>16}")
+    with patch.object(case, "db", db), patch.object(counters, "db", db):
+        for cases in counts:
+            stored_elapsed, stored_queries, stored = timed(db, lambda: case.get_case_summary(f"stored{cases}"))
+            elapsed, queries, computed = timed(db, lambda: case.get_case_summary(f"computed{cases}"))
+            before_elapsed, before_queries, before = timed(db, lambda: per_case_summary(db, f"computed{cases}"))
+
+            assert len(stored) == len(computed) == len(before) == cases
+            check(stored, computed)
+            check(stored, before)
+            print(
+                f"{cases:>6} {stored_queries:>7} {stored_elapsed * 1000:>8.1f} "
+                f"{queries:>7} {elapsed * 1000:>8.1f} {before_queries:>7} {before_elapsed * 1000:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Concurrency benchmark of the pooled OpenAI clients against the local fake server.
+
+Runs a fixed number of next-question generations at increasing concurrency,
+through the async interface on a single thread and through the sync interface
+on one thread per in-flight call, and prints throughput for each.
+
+    python -m loadtest.bench_llm_client --requests 128 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadtest.fake_openai import FakeOpenAIServer
+
+QUESTIONS = [
+    {"id": "q1", "question": "What brings you here today?", "answer": "General Health Advice"},
+    {"id": "q3", "question": "What is your age?", "answer": "34"},
+]
+
+
+async def _run_async(total, concurrency):
+    from agents import gpt
+
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with limit:
+            return await gpt.agenerate_next_question(QUESTIONS)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    assert all("question" in result for result in results)
+    return elapsed
+
+
+def _run_threads(total, concurrency):
+    from agents import gpt
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: gpt.generate_next_question(QUESTIONS), range(total)))
+    elapsed = time.perf_counter() - started
+    assert all("question" in result for result in results)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake server seconds per reply")
+    parser.add_argument("--concurrency", default="1,8,32,64")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=args.latency).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+
+    # Silence the debug prints of the agents
+    stdout = sys.stdout
+    print(f"{args.requests} next-question calls, {args.latency}s fake latency")
+    print(f"{'concurrency':>11} {'async req/s':>12} {'threads req/s':>14}")
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            sys.stdout = open(os.devnull, "w")
+            try:
+                async_elapsed = asyncio.run(_run_async(args.requests, concurrency))
+                thread_elapsed = _run_threads(args.requests, concurrency)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            print(
+                f"{concurrency:>11} {args.requests / async_elapsed:>12.1f} "
+                f"{args.requests / thread_elapsed:>14.1f}"
+            )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
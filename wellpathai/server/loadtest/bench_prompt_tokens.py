@@ -0,0 +1,78 @@
+"""
+Prompt size of a typical questionnaire session, raw repr versus format_answers().
+
+Builds a session from the predefined question bank plus generated follow-ups
+and prints, for each call type, the tokens of the answers block and of the full
+user prompt with the old serialization (the repr of the question list) and the
+new one.
+
+    python -m loadtest.bench_prompt_tokens
+"""
+
+import os
+import sys
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+
+from agents import gpt, prompt_format
+from questionnaire.templates import get_question_bank
+
+GENERATED = [
+    ("I'm sorry to hear you're unwell. Could you tell me a bit more about the main symptom that's bothering you?",
+     "text", "I have had a pounding headache on the right side of my head for about four days now. It gets worse "
+     "in the afternoon, especially after looking at my laptop screen for a long time, and sometimes I feel a bit "
+     "nauseous. Painkillers help for a couple of hours but then it comes back. I have also been sleeping badly "
+     "because of a deadline at work and drinking more coffee than usual to get through the day."),
+    ("How would you rate the intensity of the headache?", "choice", "Moderate: it limits some activities"),
+    ("Have you noticed any of these alongside the headache?", "multiselect", ["Sensitivity to light", "Nausea"]),
+    ("Does anything seem to make it better?", "choice", "Rest in a dark room"),
+    ("How many hours of sleep are you getting most nights?", "choice", "5-6 hours"),
+    ("Roughly how much caffeine do you have per day?", "choice", "3-4 cups of coffee"),
+    ("Has anyone in your family had migraines?", "choice", "Unsure"),
+    ("Is there anything else you'd like to mention about how you've been feeling?", "text",
+     "Just that I've been quite stressed and skipping lunch most days."),
+]
+
+
+def typical_session():
+    questions = get_question_bank("initial")
+    questions[0]["answer"] = "Feeling Unwell"
+    questions[1]["answer"] = "No"
+    for question in get_question_bank("feelingUnwell"):
+        question["answer"] = question.get("options", ["None"])[0]
+        questions.append(question)
+    for index, (text, question_type, answer) in enumerate(GENERATED):
+        question = {"id": f"q{len(questions) + 1}", "question": text, "type": question_type, "answer": answer}
+        if question_type != "text":
+            question["options"] = ["Option A", "Option B", "Option C", "Option D"]
+        questions.append(question)
+    return questions
+
+
+def main():
+    questions = typical_session()
+    builders = {
+        "next_question": gpt._next_question_prompts,
+        "conclusion": gpt._conclusion_prompts,
+        "case_title": gpt._case_title_prompts,
+    }
+
+    tokenizer = "tiktoken" if prompt_format._get_encoding() is not None else "estimated"
+    print(f"{len(questions)} questions, token counts {tokenizer}")
+    print(f"{'call type':>14} {'answers raw':>12} {'compact':>8} {'prompt raw':>11} {'compact':>8} {'saved':>6}")
+    raw_answers = prompt_format.count_tokens(str(questions))
+    for call_type, build in builders.items():
+        compact_answers = prompt_format.count_tokens(prompt_format.format_answers(questions, call_type))
+        with patch.object(gpt, "format_answers", lambda data, _: str(data)):
+            raw = prompt_format.count_tokens(build(questions)[1])
+        compact = prompt_format.count_tokens(build(questions)[1])
+        print(
+            f"{call_type:>14} {raw_answers:>12} {compact_answers:>8} "
+            f"{raw:>11} {compact:>8} {1 - compact / raw:>6.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
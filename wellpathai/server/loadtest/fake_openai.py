@@ -0,0 +1,340 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Answers POST /v1/chat/completions with a canned reply of the right shape for
+the call type (next question, conclusion or case title), so the agents and the
+whole Flask app can be exercised and load-tested without network access or
+token spend. Point the clients at it with OPENAI_BASE_URL=http://host:port/v1.
+
+- Latency is drawn from a distribution: "fixed:0.5", "uniform:0.2,1.5",
+  "normal:0.8,0.2" or "lognormal:-0.5,0.6" (mu and sigma of the log).
+- Requests with "stream": true are answered with server-sent event chunks.
+- Errors can be injected: a share of requests gets `error_status` (e.g. 429 or
+  500) and another share gets no answer for `hang_seconds`, which makes the
+  client time out.
+
+    python -m loadtest.fake_openai --port 8089 --latency lognormal:-0.5,0.6 --error-rate 0.02
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+
+NEXT_QUESTIONS = [
+    {"question": "How would you rate your sleep quality?", "type": "choice", "options": ["Good", "Fair", "Poor"]},
+    {
+        "question": "Have you noticed anything that makes it worse?",
+        "type": "multiselect",
+        "options": ["Stress", "Screen time", "Certain foods", "None of the above"],
+    },
+    {"question": "Could you tell me a bit more about when it started?", "type": "text", "options": []},
+]
+
+CONCLUSION = {
+    "conclusion": "The symptoms are most consistent with tension-type headaches linked to poor sleep and stress.",
+    "suggestions": [
+        "Keep a regular sleep schedule of 7-8 hours",
+        "Take a short screen break every hour",
+        "Track headache episodes and possible triggers in a diary",
+    ],
+    "otc_medications": [
+        {
+            "name": "Ibuprofen 200mg",
+            "medication_type": "Tablet",
+            "purpose": "Relieves headache pain",
+            "price_range": "$5-$10",
+            "considerations": "Take with food, avoid with stomach ulcers",
+        },
+        {
+            "name": "Acetaminophen 500mg",
+            "medication_type": "Tablet",
+            "purpose": "Relieves mild to moderate pain",
+            "price_range": "$4-$9",
+            "considerations": "Do not exceed 3g per day",
+        },
+    ],
+    "clinical_notes": ["Assess sleep hygiene", "Rule out medication overuse headache"],
+}
+
+CASE_TITLE = {
+    "description": "Recurring headaches with pressure around the temples, associated with poor sleep and stress.",
+    "title": "Tension Headache",
+}
+
+# Characters per streamed chunk
+STREAM_CHUNK_SIZE = 8
+
+
+def latency_sampler(spec):
+    """
+    A function returning one latency in seconds per call
+
+    Args:
+        spec (float or str): Fixed seconds, or "kind:params" with kind one of
+            fixed, uniform, normal or lognormal
+    """
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+
+    kind, _, params = str(spec).partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    samplers = {
+        "fixed": lambda: values[0],
+        "uniform": lambda: random.uniform(values[0], values[1]),
+        "normal": lambda: random.gauss(values[0], values[1]),
+        "lognormal": lambda: random.lognormvariate(values[0], values[1]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution: {kind}")
+    sample = samplers[kind]
+    return lambda: max(sample(), 0.0)
+
+
+def call_type_of(request):
+    """The agents' call type a completion request is for"""
+    json_schema = (request.get("response_format") or {}).get("json_schema") or {}
+    if json_schema.get("name"):
+        return json_schema["name"]
+
+    # Without schemas the system prompt tells the call types apart
+    system_prompt = next(
+        (m.get("content", "") for m in request.get("messages", []) if m.get("role") == "system"), ""
+    )
+    if "health reports" in system_prompt:
+        return "conclusion"
+    if "case summaries" in system_prompt:
+        return "case_title"
+    return "next_question"
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering chat completions like the OpenAI API"""
+
+    daemon_threads = True
+    # Room for bursts of new connections, the default backlog of 5 refuses them
+    request_queue_size = 256
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        latency=0.0,
+        reply=None,
+        error_rate=0.0,
+        error_status=500,
+        hang_rate=0.0,
+        hang_seconds=120.0,
+        stream_interval=0.02,
+        seed=None,
+    ):
+        """
+        Args:
+            latency (float or str): Seconds before each reply, or a distribution spec
+            reply (str, optional): Reply text to every request instead of the canned ones
+            error_rate (float): Share of requests answered with `error_status`
+            hang_rate (float): Share of requests left unanswered for `hang_seconds`
+            stream_interval (float): Seconds between streamed chunks
+            seed (int, optional): Seed of the error injection
+        """
+        super().__init__(address, _Handler)
+        self.latency = latency_sampler(latency)
+        self.reply = reply
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.stream_interval = stream_interval
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.counts = {}  # call type or injected failure -> requests
+        self._count_lock = threading.Lock()
+        self._next_questions = itertools.cycle(NEXT_QUESTIONS)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Serve on a background thread and return self"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _count(self, key):
+        with self._count_lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _roll(self):
+        """Count a request and pick its injected failure, "error", "hang" or None"""
+        with self._count_lock:
+            self.requests += 1
+            roll = self.random.random()
+        if roll < self.hang_rate:
+            return "hang"
+        if roll < self.hang_rate + self.error_rate:
+            return "error"
+        return None
+
+    def reply_for(self, call_type, request=None):
+        if self.reply is not None:
+            return self.reply
+        if call_type == "conclusion":
+            # Conclusions that also title the new case ask for these fields
+            schema = ((request or {}).get("response_format") or {}).get("json_schema") or {}
+            if "case_title" in schema.get("schema", {}).get("properties", {}):
+                return json.dumps({
+                    **CONCLUSION,
+                    "case_title": CASE_TITLE["title"],
+                    "case_description": CASE_TITLE["description"],
+                })
+            return json.dumps(CONCLUSION)
+        if call_type == "case_title":
+            return json.dumps(CASE_TITLE)
+        with self._count_lock:
+            return json.dumps(next(self._next_questions))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep connections alive between calls
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        failure = server._roll()
+        if failure == "hang":
+            server._count("hang")
+            time.sleep(server.hang_seconds)
+            self.close_connection = True
+            return
+        if failure == "error":
+            server._count(f"error_{server.error_status}")
+            self._send_json(server.error_status, {
+                "error": {"message": "Injected error", "type": "server_error", "code": None}
+            })
+            return
+
+        call_type = call_type_of(request)
+        server._count(call_type)
+        content = server.reply_for(call_type, request)
+        model = request.get("model", "gpt-4o")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        time.sleep(server.latency())
+
+        if request.get("stream"):
+            self._stream(completion_id, model, content)
+            return
+
+        # Roughly what a tokenizer would count, so usage reports look plausible
+        prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _stream(self, completion_id, model, content):
+        """Send the reply as chat.completion.chunk events, then [DONE]"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        # No Content-Length, the end of the stream is the end of the connection
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        for start in range(0, len(content), STREAM_CHUNK_SIZE):
+            time.sleep(self.server.stream_interval)
+            event({"content": content[start:start + STREAM_CHUNK_SIZE]})
+        event({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="0.5", help="Seconds before each reply, or e.g. uniform:0.2,1.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="Status of injected errors, e.g. 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests left unanswered")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--stream-interval", type=float, default=0.02, help="Seconds between streamed chunks")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        latency = float(args.latency)
+    except ValueError:
+        latency = args.latency
+
+    server = FakeOpenAIServer(
+        (args.host, args.port),
+        latency=latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        stream_interval=args.stream_interval,
+        seed=args.seed,
+    )
+    print(f"Fake OpenAI API on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Throughput test of the questionnaire API, driving whole sessions over HTTP.
+
+Each simulated user initializes a questionnaire, answers every question until
+it is complete and then generates the result. Sessions run concurrently and
+the latency of every endpoint is reported, with the completed sessions per
+second.
+
+Run the app without OpenAI, against either the fake server or replayed
+cassettes (see agents/cassette.py), and ideally the Firestore emulator:
+
+    python -m loadtest.fake_openai --port 8089 --latency lognormal:-0.5,0.6 &
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python app.py &
+    python -m loadtest.questionnaire_load --base-url http://127.0.0.1:5000 --users 50 --concurrency 10
+
+or, with replies recorded earlier with LLM_CASSETTE_MODE=record:
+
+    LLM_CASSETTE_MODE=replay python app.py &
+"""
+
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.router import percentile
+
+# Most questions a session may get before it counts as stuck
+MAX_ANSWERS = 40
+
+TEXT_ANSWERS = {
+    "q3": "34",
+    "q5": "5 feet 9",
+    "q6": "150 lbs",
+}
+
+
+def answer_for(question):
+    """A valid answer to a question, the last option of choice questions"""
+    options = question.get("options") or []
+    if question.get("type") == "choice" and options:
+        return options[-1]
+    if question.get("type") == "multiselect" and options:
+        return [options[0]]
+    return TEXT_ANSWERS.get(question.get("id"), "It has been getting worse over the last few days")
+
+
+class LoadRun:
+    """Latencies and failures of every endpoint over one run"""
+
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.sessions = 0
+
+    def _post(self, http, endpoint, body):
+        started = time.perf_counter()
+        try:
+            response = http.post(f"{self.base_url}{endpoint}", json=body, timeout=self.timeout)
+        except requests.RequestException:
+            response = None
+        elapsed = time.perf_counter() - started
+        ok = response is not None and response.status_code < 400
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.failures[endpoint] += 1
+        return response.json() if ok else None
+
+    def session(self, _=None):
+        """Run one questionnaire from start to result, True if it got a result"""
+        user_id = f"loadtest-{uuid.uuid4().hex[:12]}"
+        with requests.Session() as http:
+            started = self._post(http, "/api/questionnaire/initialize", {"user_id": user_id})
+            if not started:
+                return False
+            questionnaire_id = started["questionnaire_id"]
+            question = (started.get("first_question") or {}).get("data")
+
+            for _ in range(MAX_ANSWERS):
+                if not question:
+                    break
+                reply = self._post(http, "/api/questionnaire/record-answer", {
+                    "questionnaire_id": questionnaire_id,
+                    "user_id": user_id,
+                    "question_id": question["id"],
+                    "answer": answer_for(question),
+                })
+                if not reply:
+                    return False
+                question = reply.get("next_question")
+
+            result = self._post(http, "/api/questionnaire/generate-result", {
+                "questionnaire_id": questionnaire_id,
+                "user_id": user_id,
+            })
+        if result is None:
+            return False
+        with self._lock:
+            self.sessions += 1
+        return True
+
+    def report(self, elapsed):
+        lines = [f"{'endpoint':<40} {'calls':>6} {'failed':>6} {'p50 s':>7} {'p95 s':>7} {'max s':>7}"]
+        for endpoint, latencies in sorted(self.latencies.items()):
+            lines.append(
+                f"{endpoint:<40} {len(latencies):>6} {self.failures[endpoint]:>6} "
+                f"{percentile(latencies, 0.5):>7.3f} {percentile(latencies, 0.95):>7.3f} {max(latencies):>7.3f}"
+            )
+        lines.append(f"{self.sessions} sessions completed in {elapsed:.1f}s, {self.sessions / elapsed:.2f} sessions/s")
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--users", type=int, default=20, help="Questionnaire sessions to run")
+    parser.add_argument("--concurrency", type=int, default=5, help="Sessions in flight at once")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds per request")
+    args = parser.parse_args()
+
+    run = LoadRun(args.base_url, timeout=args.timeout)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run.session, range(args.users)))
+    print(run.report(time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
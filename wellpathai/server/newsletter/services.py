@@ -2,7 +2,9 @@ import smtplib
 import uuid
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from google.api_core.exceptions import NotFound
 from .firebase_init import db, bucket
+from visit.visit import update_visit
 from datetime import datetime
 import os
 
@@ -42,12 +44,14 @@ def upload_pdf(file, user_email, user_id, visit_id):
         "uploadedAt": datetime.now().isoformat()
     })
 
-    # Update visit document with consultation ID
-    db.collection("visits").document(visit_id).update({
+    # Update visit document with consultation ID, and the new report count of its case
+    if not update_visit(visit_id, {
         "consultationID": pdf_id,
         "hasNewReport": True,
         "appointmentStatus": "completed"
-    })
+    }):
+        # Fail like the plain document update did, instead of emailing an unlinked report
+        raise NotFound(f"Visit {visit_id} does not exist, report {pdf_id} is not linked to it")
 
     # Update user document if it exists
     user_ref = db.collection("users").document(user_id)
@@ -0,0 +1,306 @@
+"""
+Background conclusion jobs.
+
+Generating a conclusion takes a gpt-4o call of 15-30 seconds. Instead of holding
+a request worker for that long, /generate-result/jobs records a job and returns
+its id straight away. A bounded thread pool runs record_gpt_conclusion for
+queued jobs and clients poll (or long-poll) the job for its result.
+
+Jobs are kept in a local SQLite file so that queued work and finished results
+survive a restart. The queue is started by the first request that needs it,
+and resume() then picks up the jobs that were queued. A job that was running
+when its process died keeps its status until its lease of JOB_LEASE_SECONDS
+runs out, then resume(), or a submit() or wait() for it, puts it back in the
+queue. Several processes may share the file: claim() lets only one of them run
+a job.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Where jobs are stored
+JOB_STORE_PATH = os.getenv(
+    "CONCLUSION_JOB_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "conclusion_jobs.sqlite3"),
+)
+
+# How many conclusions are generated at the same time
+JOB_WORKERS = int(os.getenv("CONCLUSION_JOB_WORKERS", 4))
+
+# A running job not finished after this many seconds is assumed lost and run again
+JOB_LEASE_SECONDS = int(os.getenv("CONCLUSION_JOB_LEASE", 300))
+
+# Longest a status request may wait for a job to finish
+MAX_WAIT_SECONDS = 30
+
+# How often a waiting request re-reads a job run by another process
+POLL_INTERVAL_SECONDS = 0.5
+
+
+class JobStore:
+    """SQLite-backed store of conclusion jobs, safe to share between threads"""
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conclusion_jobs (
+                    id TEXT PRIMARY KEY,
+                    questionnaire_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS conclusion_jobs_questionnaire "
+                "ON conclusion_jobs (questionnaire_id, status)"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, questionnaire_id, user_id):
+        """
+        Add a queued job, unless the questionnaire already has an active one
+
+        Returns:
+            tuple: (job, created) where created is False if an active job was reused
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM conclusion_jobs WHERE questionnaire_id = ? AND status IN (?, ?) "
+                "ORDER BY created_at DESC LIMIT 1",
+                (questionnaire_id, *ACTIVE_STATUSES),
+            ).fetchone()
+            if row is not None:
+                return self._to_dict(row), False
+
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO conclusion_jobs (id, questionnaire_id, user_id, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, questionnaire_id, user_id, QUEUED, time.time()),
+            )
+            row = conn.execute("SELECT * FROM conclusion_jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._to_dict(row), True
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM conclusion_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def claim(self, job_id):
+        """Mark a queued job as running. Returns False if another worker already has it."""
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE conclusion_jobs SET status = ?, started_at = ?, attempts = attempts + 1 "
+                "WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), job_id, QUEUED),
+            )
+            return cursor.rowcount == 1
+
+    def finish(self, job_id, result=None, error=None):
+        status = FAILED if error else SUCCEEDED
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE conclusion_jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ?",
+                (status, json.dumps(result, default=str) if result is not None else None,
+                 error, time.time(), job_id),
+            )
+
+    def requeue_expired(self, lease_seconds=None):
+        """Put running jobs whose lease ran out back in the queue, returns their ids"""
+        if lease_seconds is None:
+            lease_seconds = JOB_LEASE_SECONDS
+        cutoff = time.time() - lease_seconds
+        with self._lock, self._connect() as conn:
+            # Other processes may share the file, so select and update in one write transaction
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id FROM conclusion_jobs WHERE status = ? AND started_at < ?",
+                (RUNNING, cutoff),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE conclusion_jobs SET status = ? WHERE id = ?",
+                [(QUEUED, row["id"]) for row in rows],
+            )
+        return [row["id"] for row in rows]
+
+    def requeue_stale(self, lease_seconds=None):
+        """Put running jobs whose lease ran out back in the queue, returns all queued ids"""
+        self.requeue_expired(lease_seconds)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM conclusion_jobs WHERE status = ? ORDER BY created_at",
+                (QUEUED,),
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def count_by_status(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS count FROM conclusion_jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+
+class ConclusionJobQueue:
+    """Runs conclusion jobs from a JobStore on a fixed number of worker threads"""
+
+    def __init__(self, store, workers=JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="conclusion-job"
+        )
+        self._finished = threading.Condition()
+
+    def submit(self, questionnaire_id, user_id):
+        """
+        Queue a conclusion for a questionnaire
+
+        A questionnaire with a job that is still queued or running gets that job
+        back instead of a second one.
+
+        Returns:
+            dict: The job
+        """
+        job, created = self.store.create(questionnaire_id, user_id)
+        if created:
+            metrics.increment("conclusion_jobs_total", outcome="submitted")
+            self._executor.submit(self._run, job["id"])
+        else:
+            metrics.increment("conclusion_jobs_total", outcome="deduplicated")
+            if self._lease_expired(job):
+                # Its process died, run it here instead
+                self._requeue_expired()
+                job = self.store.get(job["id"])
+        return job
+
+    @staticmethod
+    def _lease_expired(job):
+        return job["status"] == RUNNING and job["started_at"] < time.time() - JOB_LEASE_SECONDS
+
+    def _requeue_expired(self):
+        job_ids = self.store.requeue_expired()
+        for job_id in job_ids:
+            metrics.increment("conclusion_jobs_total", outcome="requeued")
+            self._executor.submit(self._run, job_id)
+        return job_ids
+
+    def resume(self):
+        """Queue the jobs left over from a previous run. Returns how many were queued."""
+        job_ids = self.store.requeue_stale()
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+        if job_ids:
+            print(f"Resuming {len(job_ids)} conclusion jobs", flush=True)
+        return len(job_ids)
+
+    def _run(self, job_id):
+        from questionnaire.questionnaire import record_gpt_conclusion  # Import here to avoid circular imports
+
+        if not self.store.claim(job_id):
+            return
+
+        job = self.store.get(job_id)
+        try:
+            response = record_gpt_conclusion(job["questionnaire_id"], job["user_id"])
+        except Exception as e:
+            print(f"Conclusion job {job_id} failed: {str(e)}", flush=True)
+            response = {"status": "error", "error": str(e)}
+
+        if response.get("status") == "success":
+            self.store.finish(job_id, result=response)
+            metrics.increment("conclusion_jobs_total", outcome="succeeded")
+        else:
+            self.store.finish(job_id, result=response, error=response.get("error", "Failed to get conclusion"))
+            metrics.increment("conclusion_jobs_total", outcome="failed")
+
+        with self._finished:
+            self._finished.notify_all()
+
+    def wait(self, job_id, timeout=0):
+        """
+        Get a job, waiting up to `timeout` seconds for it to finish
+
+        Returns:
+            dict: The job, or None if it doesn't exist
+        """
+        deadline = time.monotonic() + min(max(timeout, 0), MAX_WAIT_SECONDS)
+        while True:
+            job = self.store.get(job_id)
+            if job is not None and self._lease_expired(job):
+                self._requeue_expired()
+                continue
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] not in ACTIVE_STATUSES or remaining <= 0:
+                return job
+            with self._finished:
+                self._finished.wait(min(remaining, POLL_INTERVAL_SECONDS))
+
+    def get_stats(self):
+        return {"workers": self.workers, "jobs": self.store.count_by_status()}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """The process-wide job queue, created and resumed on first use"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ConclusionJobQueue(JobStore())
+            _queue.resume()
+        return _queue
+
+
+def job_response(job):
+    """Public view of a job for API responses"""
+    response = {
+        "job_id": job["id"],
+        "questionnaire_id": job["questionnaire_id"],
+        "status": job["status"],
+    }
+    if job["status"] == SUCCEEDED:
+        response["result"] = job["result"]
+    elif job["status"] == FAILED:
+        response["error"] = job["error"]
+    return response
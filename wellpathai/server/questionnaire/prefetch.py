@@ -0,0 +1,183 @@
+"""
+Speculative prefetch of the first GPT-generated question.
+
+When the last predefined question is served, the next answer will need GPT.
+With QUESTIONNAIRE_PREFETCH enabled, generation starts in the background as soon
+as that question is served, using the answers known so far. When the answer
+arrives the prefetched question is used only if the earlier answers are unchanged
+and it doesn't simply ask the last question again; otherwise it is discarded and
+a fresh question is generated. The final answer is not checked against the
+prefetched question beyond that.
+
+Prefetches live in the worker process that served the question, so a request
+routed to another process counts as a miss and falls back to a normal GPT call.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from utils import metrics
+
+PREFETCH_ENABLED = os.getenv("QUESTIONNAIRE_PREFETCH", "false").lower() in ("1", "true", "yes")
+
+# Seconds to wait for a prefetch that is still running when the answer arrives
+PREFETCH_WAIT_SECONDS = float(os.getenv("QUESTIONNAIRE_PREFETCH_WAIT", 30))
+
+# Prefetches not consumed within this many seconds are dropped
+PREFETCH_TTL_SECONDS = 600
+
+# Word overlap above which a prefetched question counts as re-asking the last question
+DUPLICATE_OVERLAP = 0.6
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("QUESTIONNAIRE_PREFETCH_WORKERS", 4)),
+    thread_name_prefix="question-prefetch",
+)
+_lock = threading.Lock()
+_pending = {}
+
+
+def is_enabled():
+    return PREFETCH_ENABLED
+
+
+def _fingerprint(questions, question_id):
+    """Hash of everything the prefetch was based on, ignoring the pending answer"""
+    known = [
+        (q.get("id"), q.get("question"), None if q.get("id") == question_id else q.get("answer"))
+        for q in questions
+    ]
+    return hashlib.sha256(json.dumps(known, default=str).encode()).hexdigest()
+
+
+def _words(text):
+    return set(re.findall(r"[a-z']+", (text or "").lower()))
+
+
+def _repeats_question(generated, question):
+    generated_words = _words(generated.get("question"))
+    question_words = _words(question.get("question"))
+    if not generated_words or not question_words:
+        return False
+    overlap = len(generated_words & question_words) / len(generated_words | question_words)
+    return overlap >= DUPLICATE_OVERLAP
+
+
+def _drop_expired():
+    cutoff = time.monotonic() - PREFETCH_TTL_SECONDS
+    for questionnaire_id, entry in list(_pending.items()):
+        if entry["started_at"] < cutoff:
+            _pending.pop(questionnaire_id, None)
+            entry["future"].cancel()
+            metrics.increment("questionnaire_prefetch_total", outcome="expired")
+
+
+def maybe_start(questionnaire_id, served_question, questions, case_history=None):
+    """
+    Start generating the next question if `served_question` is the last predefined one
+
+    Args:
+        questionnaire_id (str): ID of the questionnaire
+        served_question (dict): The question just returned to the user
+        questions (list): All questions of the questionnaire, as stored
+        case_history (str, optional): Summary of the selected case's earlier visits
+
+    Returns:
+        bool: True if a prefetch was started
+    """
+    if not PREFETCH_ENABLED or not served_question.get("initialized"):
+        return False
+
+    unanswered = [q for q in questions if "answer" not in q]
+    if len(unanswered) != 1 or questions[-1].get("id") != served_question.get("id"):
+        return False
+
+    from agents.gpt import generate_next_question  # Import here to avoid circular imports
+
+    question_id = served_question["id"]
+    with _lock:
+        _drop_expired()
+        if questionnaire_id in _pending and _pending[questionnaire_id]["question_id"] == question_id:
+            return False
+
+        _pending[questionnaire_id] = {
+            "question_id": question_id,
+            "fingerprint": _fingerprint(questions, question_id),
+            "future": _executor.submit(generate_next_question, list(questions), case_history),
+            "started_at": time.monotonic(),
+        }
+
+    metrics.increment("questionnaire_prefetch_total", outcome="started")
+    print(f"Prefetching next question for questionnaire {questionnaire_id}", flush=True)
+    return True
+
+
+def take(questionnaire_id, question_id, questions):
+    """
+    Get the prefetched question for the answer to `question_id`, if it is still valid
+
+    It is valid if the earlier answers are unchanged and it doesn't re-ask
+    `question_id`. The final answer itself is not compared with it.
+
+    Args:
+        questionnaire_id (str): ID of the questionnaire
+        question_id (str): The question that was just answered
+        questions (list): All questions, including the final answer
+
+    Returns:
+        dict: The generated question, or None if there is no usable prefetch
+    """
+    answered = next((q for q in questions if q.get("id") == question_id), {})
+    if not PREFETCH_ENABLED or not answered.get("initialized"):
+        # Only the first generated question, after the last predefined one, is prefetched
+        return None
+
+    with _lock:
+        entry = _pending.pop(questionnaire_id, None)
+
+    if entry is None:
+        metrics.increment("questionnaire_prefetch_total", outcome="miss")
+        return None
+
+    def discard(reason):
+        entry["future"].cancel()
+        metrics.increment("questionnaire_prefetch_total", outcome="discard")
+        print(f"Discarded prefetched question for {questionnaire_id}: {reason}", flush=True)
+        return None
+
+    if entry["question_id"] != question_id:
+        return discard("a different question was answered")
+    if entry["fingerprint"] != _fingerprint(questions, question_id):
+        return discard("earlier answers changed")
+
+    try:
+        generated = entry["future"].result(timeout=PREFETCH_WAIT_SECONDS)
+    except Exception as e:
+        return discard(f"generation failed: {str(e)}")
+
+    if not isinstance(generated, dict) or "question" not in generated:
+        return discard("no question in response")
+
+    if _repeats_question(generated, answered):
+        return discard("it repeats the answered question")
+
+    metrics.increment("questionnaire_prefetch_total", outcome="hit")
+    return dict(generated)
+
+
+def get_stats():
+    """Prefetch counters with hit and discard rates over consumed prefetches"""
+    counts = {
+        outcome: metrics.get_counter("questionnaire_prefetch_total", outcome=outcome)
+        for outcome in ("started", "hit", "discard", "miss", "expired")
+    }
+    consumed = counts["hit"] + counts["discard"]
+    counts["hit_rate"] = counts["hit"] / consumed if consumed else None
+    counts["discard_rate"] = counts["discard"] / consumed if consumed else None
+    counts["enabled"] = PREFETCH_ENABLED
+    return counts
@@ -1,129 +1,79 @@
 from firebase_admin import firestore
 from datetime import datetime
+import copy
+import hashlib
+import json
+import os
 from utils.data_utils import get_user_cases_data
+from case import history
+from questionnaire.session import QuestionnaireSession, run_in_transaction
+from questionnaire import prefetch
+from utils import metrics
+from questionnaire.templates import CURRENT_TEMPLATE_VERSION, get_question_bank
+from questionnaire.storage import (
+    initial_storage_fields,
+    migration_updates,
+    to_list_shape,
+)
 from flask import jsonify
 
 db = firestore.client()
 
+# Maximum number of questions asked in one questionnaire, predefined and generated
+MAX_QUESTIONS = 18
 
-def initialize_questionnaire_database(user_id):
+# Have the conclusion of a questionnaire that starts a new case also title the
+# case, so that create_case can skip its own generate_case_title call
+CONCLUSION_CASE_TITLE = os.getenv("CONCLUSION_CASE_TITLE", "true").lower() in ("1", "true", "yes")
+
+# Questionnaires created before the template registry carry their own copy of
+# each question bank in these fields until the banks are added to the questions
+LEGACY_BANK_FIELDS = {
+    "generalDemographic": "generalDemographicQuestions",
+    "generalHealth": "generalHealthQuestions",
+    "feelingUnwell": "feelingUnwellQuestions",
+}
+
+
+def _question_banks_pending(questionnaire_data):
     """
-    user_id: str, ID of the user
-    Return the ID of the newly created questionnaire
+    Check whether the demographic and path questions still have to be added
+    to the questionnaire's question list
     """
+    if LEGACY_BANK_FIELDS["generalDemographic"] in questionnaire_data:
+        return True
 
-    # Define initial questions
-
-    initial_question = [
-        {
-            "id": "q1",
-            "question": "What brought you here today?",
-            "type": "choice",
-            "options": ["General Health Advice", "Feeling Unwell"],
-            "initialized": True,
-        },
-        {
-            "id": "q2",
-            "question": "Have you visited us before for the same reason?",
-            "type": "choice",
-            "options": ["Yes", "No"],
-            "initialized": True
-        }
-    ]
+    return "templateVersion" in questionnaire_data and not questionnaire_data.get(
+        "currentPath"
+    )
 
-    general_demographic_questions = [
-        {
-            "id": "q3",
-            "question": "How old are you?",
-            "type": "text",
-            "initialized": True,
-        },
-        {
-            "id": "q4",
-            "question": "What is your gender?",
-            "type": "choice",
-            "options": ["Male", "Female", "Other", "Prefer not to say"],
-            "initialized": True,
-        },
-        {
-            "id": "q5",
-            "question": "What is your height?",
-            "type": "text",
-            "placeholder": "e.g. 6 feet",
-            "initialized": True,
-        },
-        {
-            "id": "q6",
-            "question": "What is your weight?",
-            "type": "text",
-            "placeholder": "e.g. 140 lbs",
-            "initialized": True,
-        },
-    ]
 
-    # General health advice specific questions
-    general_health_questions = [
-        {
-            "id": "q7",
-            "question": "Did you have any medical conditions before?",
-            "type": "text",
-            "initialized": True,
-        },
-        {
-            "id": "q8",
-            "question": "Are you currently taking any medications?",
-            "type": "text",
-            "initialized": True,
-        },
-        {
-            "id": "q9",
-            "question": "Do you have any allergies?",
-            "type": "text",
-            "initialized": True,
-        },
-    ]
+def _get_question_bank(questionnaire_data, bank):
+    """
+    Get a predefined question bank for a questionnaire, from the document itself
+    for legacy questionnaires or from the template version it was started with
+    """
+    legacy_field = LEGACY_BANK_FIELDS[bank]
+    if legacy_field in questionnaire_data:
+        return questionnaire_data.get(legacy_field, [])
 
-    feeling_unwell_questions = [
-        {
-            "id": "q7",
-            "question": "What symptoms are you experiencing?",
-            "type": "text",
-            "placeholder": "e.g. headache, fever, cough",
-            "initialized": True,
-        },
-        {
-            "id": "q8",
-            "question": "How long have you been experiencing these symptoms?",
-            "type": "choice",
-            "options": [
-                "Less than 24 hours",
-                "1-3 days",
-                "4-7 days",
-                "More than a week",
-            ],
-            "initialized": True,
-        },
-        {
-            "id": "q9",
-            "question": "Rate your discomfort level",
-            "type": "choice",
-            "options": ["1", "2", "3", "4", "5"],
-            "initialized": True,
-        },
-        {
-            "id": "q10",
-            "question": "Do you have any chronic medical conditions?",
-            "type": "multiselect",
-            "options": [
-                "Diabetes",
-                "Hypertension",
-                "Heart Disease",
-                "Asthma",
-                "None of Above",
-            ],
-            "initialized": True,
-        },
-    ]
+    return get_question_bank(bank, questionnaire_data.get("templateVersion"))
+
+
+def _clear_legacy_question_banks(questionnaire_data):
+    """Field deletes for the bank copies a legacy questionnaire still carries"""
+    return {
+        field: firestore.DELETE_FIELD
+        for field in LEGACY_BANK_FIELDS.values()
+        if field in questionnaire_data
+    }
+
+
+def initialize_questionnaire_database(user_id):
+    """
+    user_id: str, ID of the user
+    Return the ID of the newly created questionnaire
+    """
 
     try:
         # Create questions collection
@@ -134,10 +84,9 @@ def initialize_questionnaire_database(user_id):
                 "createdAt": datetime.now(),
                 "updatedAt": datetime.now(),
                 "status": "active",
-                "questions": initial_question,  # Start with just the branching question
-                "generalDemographicQuestions": general_demographic_questions,  # Store these separately
-                "generalHealthQuestions": general_health_questions,  # Store these separately
-                "feelingUnwellQuestions": feeling_unwell_questions,  # Store these separately
+                # Start with just the branching question
+                **initial_storage_fields(get_question_bank("initial")),
+                "templateVersion": CURRENT_TEMPLATE_VERSION,  # Other question banks come from the template registry
                 "currentPath": None,  # Will be set after first answer
                 "caseSelectionMade": False,  # Track if user has made a case selection
             }
@@ -149,11 +98,13 @@ def initialize_questionnaire_database(user_id):
         return False
 
 
-def add_question_to_questionnaire(questionnaire_id, user_id, new_question):
+def add_question_to_questionnaire(questionnaire_id, user_id, new_question, session=None):
     """
     questionnaire_id: str, ID of the questionnaire document\n
     user_id: str, ID of the user\n
-    new_question: dict. Required fields: question, type, options as list if applicable
+    new_question: dict. Required fields: question, type, options as list if applicable\n
+    session: QuestionnaireSession, optional. When given, the change is staged on it
+    and written by the caller's commit(); otherwise it runs in its own transaction
     """
 
     required_fields = ["question", "type"]
@@ -167,27 +118,26 @@ def add_question_to_questionnaire(questionnaire_id, user_id, new_question):
     ):
         return False, "Options required for choice/multiselect questions"
 
-    try:
-        # Get the questionnaire document
-        questionnaire_ref = db.collection("questionnaires").document(questionnaire_id)
-        questionnaire = questionnaire_ref.get()
-
-        # Verify document exists and belongs to user
-        if not questionnaire.exists:
-            return False, "Questionnaire not found"
-
-        questionnaire_data = questionnaire.to_dict()
-        if questionnaire_data["user_id"] != user_id:
-            return False, "Unauthorized access"
+    if session is None:
+        # Question ids come from the question count, so count and append atomically
+        result, error = run_in_transaction(
+            questionnaire_id,
+            user_id,
+            lambda session: add_question_to_questionnaire(
+                questionnaire_id, user_id, new_question, session=session
+            ),
+        )
+        return result if error is None else (False, error)
 
+    try:
         # Get existing questions and add new one
-        current_questions = questionnaire_data.get("questions", [])
+        current_questions = session.questions
         new_question["id"] = f"q{len(current_questions) + 1}"
         new_question["initialized"] = False
         current_questions.append(new_question)
 
         # Update the document
-        questionnaire_ref.update(
+        session.update(
             {"questions": current_questions, "last_updated": datetime.utcnow()}
         )
 
@@ -197,26 +147,33 @@ def add_question_to_questionnaire(questionnaire_id, user_id, new_question):
         return False, str(e)
 
 
-def record_answer_to_question(questionnaire_id, user_id, question_id, answer):
+def record_answer_to_question(questionnaire_id, user_id, question_id, answer, session=None):
     """
     questionnaire_id: str, ID of the questionnaire document\n
     user_id: str, ID of the user\n
     question_id: str, with format 'q1', 'q2', etc.\n
-    answer: str or obj, Answer to the question
+    answer: str or obj, Answer to the question\n
+    session: QuestionnaireSession, optional. When given, the change is staged on it
+    and written by the caller's commit(); otherwise it runs in its own transaction
     """
-    try:
-        questionnaire_ref = db.collection("questionnaires").document(questionnaire_id)
-        questionnaire = questionnaire_ref.get()
-
-        if not questionnaire.exists:
-            return False, "Questionnaire not found"
+    if session is None:
+        result, error = run_in_transaction(
+            questionnaire_id,
+            user_id,
+            lambda session: record_answer_to_question(
+                questionnaire_id, user_id, question_id, answer, session=session
+            ),
+        )
+        return result if error is None else (False, error)
 
-        questionnaire_data = questionnaire.to_dict()
-        if questionnaire_data["user_id"] != user_id:
-            return False, "Unauthorized access"
+    try:
+        questionnaire_data = session.data
 
         # Get questions list
-        questions = questionnaire_data.get("questions", [])
+        questions = session.questions
+
+        # Collect every field change so the whole answer is committed in a single write
+        updates = {}
 
         # Find and update the specific question
         for question in questions:
@@ -234,18 +191,27 @@ def record_answer_to_question(questionnaire_id, user_id, question_id, answer):
 
         # Check if the question was the first question
         if question_id == "q1":
+            # The banks are only added once, even if q1 is answered again
+            banks_pending = _question_banks_pending(questionnaire_data)
+
             # Get the demographic questions that should be added for both paths
-            demographic_questions = questionnaire_data.get(
-                "generalDemographicQuestions", []
+            demographic_questions = (
+                _get_question_bank(questionnaire_data, "generalDemographic")
+                if banks_pending
+                else []
             )
 
             # Add path-specific questions based on the answer
             if answer == "General Health Advice":
                 # Set the current path
-                questionnaire_ref.update({"currentPath": "generalHealth"})
+                updates["currentPath"] = "generalHealth"
 
                 # Get the general health questions
-                health_questions = questionnaire_data.get("generalHealthQuestions", [])
+                health_questions = (
+                    _get_question_bank(questionnaire_data, "generalHealth")
+                    if banks_pending
+                    else []
+                )
 
                 # Add demographic questions first, then health questions
                 questions.extend(demographic_questions)
@@ -253,24 +219,22 @@ def record_answer_to_question(questionnaire_id, user_id, question_id, answer):
 
             elif answer == "Feeling Unwell":
                 # Set the current path
-                questionnaire_ref.update({"currentPath": "feelingUnwell"})
+                updates["currentPath"] = "feelingUnwell"
 
                 # Get the feeling unwell questions
-                unwell_questions = questionnaire_data.get("feelingUnwellQuestions", [])
+                unwell_questions = (
+                    _get_question_bank(questionnaire_data, "feelingUnwell")
+                    if banks_pending
+                    else []
+                )
 
                 # Add demographic questions first, then unwell questions
                 questions.extend(demographic_questions)
                 questions.extend(unwell_questions)
 
-            # Remove the question sets from the document to save space
-            # since they're now added to the questions array
-            questionnaire_ref.update(
-                {
-                    "generalDemographicQuestions": firestore.DELETE_FIELD,
-                    "generalHealthQuestions": firestore.DELETE_FIELD,
-                    "feelingUnwellQuestions": firestore.DELETE_FIELD,
-                }
-            )
+            # Legacy questionnaires carry their own copy of the question sets;
+            # remove it since it's now added to the questions array
+            updates.update(_clear_legacy_question_banks(questionnaire_data))
         # Handle case selection question
         elif question_id == 'q2':
             if answer == 'Yes':
@@ -279,9 +243,8 @@ def record_answer_to_question(questionnaire_id, user_id, question_id, answer):
 
                 if not user_cases or len(user_cases) == 0:
                     # No existing cases, fall back to creating a new one
-                    questionnaire_ref.update(
-                        {"caseSelectionMade": True, "selectedAction": "create_new"}
-                    )
+                    updates["caseSelectionMade"] = True
+                    updates["selectedAction"] = "create_new"
                 else:
                     # Add a new question for case selection
                     case_options = []
@@ -307,16 +270,12 @@ def record_answer_to_question(questionnaire_id, user_id, question_id, answer):
 
                     # Add this question after q2
                     questions.insert(questions.index(question) + 1, case_selection_q)
-                    
-                    questionnaire_ref.update({
-                        'caseSelectionMade': False,
-                        'selectedAction': 'select_existing'
-                    })
+
+                    updates["caseSelectionMade"] = False
+                    updates["selectedAction"] = "select_existing"
             else:  # "No"
-                questionnaire_ref.update({
-                    'caseSelectionMade': True,
-                    'selectedAction': 'create_new'
-                })
+                updates["caseSelectionMade"] = True
+                updates["selectedAction"] = "create_new"
 
         # Handle case selection from list
         elif question_id == "q2b":
@@ -342,8 +301,10 @@ def record_answer_to_question(questionnaire_id, user_id, question_id, answer):
                             flush=True,
                         )
 
-                        questionnaire_ref.update(
-                            {"caseSelectionMade": True, "selectedCaseId": case_id}
+                        updates["caseSelectionMade"] = True
+                        updates["selectedCaseId"] = case_id
+                        updates["caseHistory"] = history.get_history_text(
+                            case_id, transaction=session.transaction
                         )
                     else:
                         print(
@@ -365,16 +326,20 @@ def record_answer_to_question(questionnaire_id, user_id, question_id, answer):
                                 f"Fallback: Found case ID using string mapping",
                                 flush=True,
                             )
-                            questionnaire_ref.update(
-                                {"caseSelectionMade": True, "selectedCaseId": case_id}
+                            updates["caseSelectionMade"] = True
+                            updates["selectedCaseId"] = case_id
+                            updates["caseHistory"] = history.get_history_text(
+                                case_id, transaction=session.transaction
                             )
                         else:
                             print(
                                 f"Fallback failed: No matching case found", flush=True
                             )
 
-        # Update the questions
-        questionnaire_ref.update({"questions": questions, "updatedAt": datetime.now()})
+        # Commit the questions together with any path/case changes in one update
+        updates["questions"] = questions
+        updates["updatedAt"] = datetime.now()
+        session.update(updates)
 
         return True, "Answer recorded successfully"
 
@@ -382,22 +347,20 @@ def record_answer_to_question(questionnaire_id, user_id, question_id, answer):
         return False, str(e)
 
 
-def record_result_to_questionnaire(questionnaire_id, user_id, result_text):
+def record_result_to_questionnaire(questionnaire_id, user_id, result_text, content_hash=None, session=None):
     """
     questionnaire_id: str, ID of the questionnaire document
     user_id: str, ID of the user
     result_text: str, Textual result of the questionnaire analysis
+    content_hash: str, optional. conclusion_content_hash() of the answers it was generated from
+    session: QuestionnaireSession, optional. Session the questionnaire was already
+    loaded into, so that it is not read again
     """
     try:
-        questionnaire_ref = db.collection("questionnaires").document(questionnaire_id)
-        questionnaire = questionnaire_ref.get()
-
-        if not questionnaire.exists:
-            return False, "Questionnaire not found"
-
-        questionnaire_data = questionnaire.to_dict()
-        if questionnaire_data["user_id"] != user_id:
-            return False, "Unauthorized access"
+        if session is None:
+            session, error = QuestionnaireSession.load(questionnaire_id, user_id)
+            if error:
+                return False, error
 
         # Structure the result
         result = {
@@ -405,9 +368,11 @@ def record_result_to_questionnaire(questionnaire_id, user_id, result_text):
             "generated_at": datetime.utcnow(),
         }
         # Update the document with the result
-        questionnaire_ref.update(
-            {"result": result, "last_updated": datetime.utcnow(), "status": "completed"}
-        )
+        updates = {"result": result, "last_updated": datetime.utcnow(), "status": "completed"}
+        if content_hash is not None:
+            updates["resultContentHash"] = content_hash
+        session.update(updates)
+        session.commit()
 
         return True, "Result added successfully"
 
@@ -415,23 +380,19 @@ def record_result_to_questionnaire(questionnaire_id, user_id, result_text):
         return False, str(e)
 
 
-def get_all_questions_in_questionnaire(questionnaire_id, user_id):
+def get_all_questions_in_questionnaire(questionnaire_id, user_id, session=None):
     """
     questionnaire_id: str, ID of the questionnaire document
     user_id: str, ID of the user
+    session: QuestionnaireSession, optional. Read from it instead of Firestore
     """
     try:
-        questionnaire_ref = db.collection("questionnaires").document(questionnaire_id)
-        questionnaire = questionnaire_ref.get()
+        if session is None:
+            session, error = QuestionnaireSession.load(questionnaire_id, user_id)
+            if error:
+                return False, error
 
-        if not questionnaire.exists:
-            return False, "Questionnaire not found"
-
-        questionnaire_data = questionnaire.to_dict()
-        if questionnaire_data["user_id"] != user_id:
-            return False, "Unauthorized access"
-
-        questions = questionnaire_data.get("questions", [])
+        questions = session.questions
 
         return questions
 
@@ -439,23 +400,25 @@ def get_all_questions_in_questionnaire(questionnaire_id, user_id):
         return False, str(e)
 
 
-def get_most_recent_question(questionnaire_id, user_id):
+def get_most_recent_question(questionnaire_id, user_id, session=None):
     """
     questionnaire_id: str, ID of the questionnaire document
     user_id: str, ID of the user
+    session: QuestionnaireSession, optional. When given, any change is staged on it
+    and written by the caller's commit()
     """
     try:
-        questionnaire_ref = db.collection("questionnaires").document(questionnaire_id)
-        questionnaire = questionnaire_ref.get()
-
-        if not questionnaire.exists:
-            return {"success": False, "data": None, "error": "Questionnaire not found"}
+        owns_session = session is None
+        if owns_session:
+            session, error = QuestionnaireSession.load(questionnaire_id, user_id)
+            if error:
+                return {"success": False, "data": None, "error": error}
 
-        questionnaire_data = questionnaire.to_dict()
-        if questionnaire_data["user_id"] != user_id:
-            return {"success": False, "data": None, "error": "Unauthorized access"}
+        questionnaire_data = session.data
+        questions = session.questions
 
-        questions = questionnaire_data.get("questions", [])
+        # Whether the demographic and path-specific questions still have to be added
+        banks_pending = _question_banks_pending(questionnaire_data)
 
         # Check if we need to process case selection
         if (
@@ -464,10 +427,10 @@ def get_most_recent_question(questionnaire_id, user_id):
         ):
             # If we've answered the case selection question and chosen to create a new case
             # Check if we've already added the demographic and path-specific questions
-            if "generalDemographicQuestions" in questionnaire_data:
+            if banks_pending:
                 # We haven't added these questions yet, so we should add them now
-                demographic_questions = questionnaire_data.get(
-                    "generalDemographicQuestions", []
+                demographic_questions = _get_question_bank(
+                    questionnaire_data, "generalDemographic"
                 )
 
                 # Get path-specific questions based on the first question's answer
@@ -475,15 +438,15 @@ def get_most_recent_question(questionnaire_id, user_id):
                 for question in questions:
                     if question["id"] == "q1" and "answer" in question:
                         if question["answer"] == "General Health Advice":
-                            path_questions = questionnaire_data.get(
-                                "generalHealthQuestions", []
+                            path_questions = _get_question_bank(
+                                questionnaire_data, "generalHealth"
                             )
-                            questionnaire_ref.update({"currentPath": "generalHealth"})
+                            session.update({"currentPath": "generalHealth"})
                         elif question["answer"] == "Feeling Unwell":
-                            path_questions = questionnaire_data.get(
-                                "feelingUnwellQuestions", []
+                            path_questions = _get_question_bank(
+                                questionnaire_data, "feelingUnwell"
                             )
-                            questionnaire_ref.update({"currentPath": "feelingUnwell"})
+                            session.update({"currentPath": "feelingUnwell"})
                         break
 
                 # Add demographic questions first, then path-specific questions
@@ -491,12 +454,10 @@ def get_most_recent_question(questionnaire_id, user_id):
                 questions.extend(path_questions)
 
                 # Update the document
-                questionnaire_ref.update(
+                session.update(
                     {
                         "questions": questions,
-                        "generalDemographicQuestions": firestore.DELETE_FIELD,
-                        "generalHealthQuestions": firestore.DELETE_FIELD,
-                        "feelingUnwellQuestions": firestore.DELETE_FIELD,
+                        **_clear_legacy_question_banks(questionnaire_data),
                     }
                 )
         elif (
@@ -516,35 +477,38 @@ def get_most_recent_question(questionnaire_id, user_id):
             for question in questions:
                 if question["id"] == "q1" and "answer" in question:
                     if question["answer"] == "General Health Advice":
-                        path_questions = questionnaire_data.get(
-                            "generalHealthQuestions", []
-                        )
-                        questionnaire_ref.update({"currentPath": "generalHealth"})
+                        if banks_pending:
+                            path_questions = _get_question_bank(
+                                questionnaire_data, "generalHealth"
+                            )
+                        session.update({"currentPath": "generalHealth"})
                     elif question["answer"] == "Feeling Unwell":
-                        path_questions = questionnaire_data.get(
-                            "feelingUnwellQuestions", []
-                        )
-                        questionnaire_ref.update({"currentPath": "feelingUnwell"})
+                        if banks_pending:
+                            path_questions = _get_question_bank(
+                                questionnaire_data, "feelingUnwell"
+                            )
+                        session.update({"currentPath": "feelingUnwell"})
                     break
 
             # If we still have specialized question sets, add them to the questions list
-            if path_questions and "generalDemographicQuestions" in questionnaire_data:
-                demographic_questions = questionnaire_data.get(
-                    "generalDemographicQuestions", []
+            if path_questions:
+                demographic_questions = _get_question_bank(
+                    questionnaire_data, "generalDemographic"
                 )
                 questions.extend(demographic_questions)
                 questions.extend(path_questions)
 
                 # Update the document
-                questionnaire_ref.update(
+                session.update(
                     {
                         "questions": questions,
-                        "generalDemographicQuestions": firestore.DELETE_FIELD,
-                        "generalHealthQuestions": firestore.DELETE_FIELD,
-                        "feelingUnwellQuestions": firestore.DELETE_FIELD,
+                        **_clear_legacy_question_banks(questionnaire_data),
                     }
                 )
 
+        if owns_session:
+            session.commit()
+
         for question in questions:
             if "answer" not in question:
                 print("Unanswered question found", question, flush=True)
@@ -570,20 +534,8 @@ def get_most_recent_question(questionnaire_id, user_id):
         return {"success": False, "data": None, "error": str(e)}
 
 
-def get_next_question(questionnaire_id, user_id):
-    """
-    Get the next question for the user, either from predefined questions or by generating with GPT.
-
-    Args:
-        questionnaire_id (str): ID of the questionnaire
-        user_id (str): ID of the user
-
-    Returns:
-        dict: Response with next question information
-    """
-    # First try to get a predefined question
-    response = get_most_recent_question(questionnaire_id, user_id)
-
+def _predefined_question_result(response):
+    """Build the next-question response from get_most_recent_question's result"""
     if response["success"]:
         # There's a predefined question available
         result = {
@@ -596,48 +548,182 @@ def get_next_question(questionnaire_id, user_id):
             result["selected_case_id"] = response["selectedCaseId"]
         return result
 
-    elif response["error"] == "NO_INITIALIZED_QUESTIONS":
-        # No predefined questions left, check max questions and possibly generate with GPT
+    # Some other error occurred
+    return {
+        "message": "Answer recorded but couldn't get next question",
+        "error": response["error"],
+        "next_question": None,
+    }
+
+
+def _questionnaire_complete_result():
+    return {
+        "message": "Answer recorded successfully. Questionnaire complete.",
+        "next_question": None,
+        "is_complete": True,
+    }
+
+
+def _count_questions(questions):
+    return len([q for q in questions if "question" in q])
+
+
+def _record_answer_step(questionnaire_id, user_id, question_id, answer):
+    """
+    Commit an answer and work out whether GPT is needed for the next question
+
+    Returns:
+        tuple: (error message or None, finished response or None, questions,
+        case history or None). When the first two are None the next question
+        still has to be generated.
+    """
+
+    def record(session):
+        success, message = record_answer_to_question(
+            questionnaire_id, user_id, question_id, answer, session=session
+        )
+        if not success:
+            return False, message
+
+        response = get_most_recent_question(questionnaire_id, user_id, session=session)
+        return True, (response, copy.deepcopy(session.questions), session.data.get("caseHistory"))
+
+    result, error = run_in_transaction(questionnaire_id, user_id, record)
+    if error:
+        return error, None, None, None
+
+    success, outcome = result
+    if not success:
+        return outcome, None, None, None
+
+    response, questions, case_history = outcome
+    if response["success"] or response["error"] != "NO_INITIALIZED_QUESTIONS":
+        if response["success"] and _count_questions(questions) < MAX_QUESTIONS:
+            # Start on the first GPT question while the user answers the last predefined one
+            prefetch.maybe_start(questionnaire_id, response["data"], questions, case_history)
+        return None, _predefined_question_result(response), questions, case_history
+
+    if _count_questions(questions) >= MAX_QUESTIONS:
+        return None, _questionnaire_complete_result(), questions, case_history
+
+    return None, None, questions, case_history
+
+
+def _append_generated_question(questionnaire_id, user_id, generated):
+    """
+    Append a GPT-generated question and build the record-answer response
+
+    Runs in its own transaction and reuses a question a concurrent duplicate
+    request already added instead of appending another one.
+    """
+    if "question" not in generated:
+        # If GPT generation failed, mark as complete
+        return _questionnaire_complete_result()
+
+    def append(session):
+        # A concurrent request may have added the next question while GPT was running
+        pending = next((q for q in session.questions if "answer" not in q), None)
+        if pending is not None:
+            return pending
+
+        success, message = add_question_to_questionnaire(
+            questionnaire_id, user_id, dict(generated), session=session
+        )
+        return session.questions[-1] if success else None
+
+    question, error = run_in_transaction(questionnaire_id, user_id, append)
+    print("GPT response: ", question, flush=True)
+
+    if error or question is None:
+        return _questionnaire_complete_result()
+
+    return {
+        "message": "Answer recorded and new question generated",
+        "next_question": question,
+    }
+
+
+def record_answer_and_get_next_question(questionnaire_id, user_id, question_id, answer):
+    """
+    Record an answer and get the next question, safely under concurrent requests
+
+    The answer and any predefined follow-up changes are committed in one
+    transaction. When GPT has to generate the next question it is called outside
+    any transaction, and the question is appended in a second transaction that
+    reuses a question a concurrent duplicate request already added instead of
+    appending another one.
+
+    Args:
+        questionnaire_id (str): ID of the questionnaire
+        user_id (str): ID of the user
+        question_id (str): ID of the answered question
+        answer (str or list): The answer
+
+    Returns:
+        tuple: (True, next question response) or (False, error message)
+    """
+    from agents.gpt import (
+        generate_next_question,
+    )  # Import here to avoid circular imports
+
+    error, response, questions, case_history = _record_answer_step(
+        questionnaire_id, user_id, question_id, answer
+    )
+    if error:
+        return False, error
+    if response is not None:
+        return True, response
+
+    generated = prefetch.take(questionnaire_id, question_id, questions)
+    if generated is None:
         print("Calling GPT to generate next question", flush=True)
+        generated = generate_next_question(questions, case_history)
 
-        # Set a maximum number of questions (adjust as needed)
-        MAX_QUESTIONS = 18
+    return True, _append_generated_question(questionnaire_id, user_id, generated)
 
-        # Get all questions to check how many we've already asked
-        all_questions = get_all_questions_in_questionnaire(questionnaire_id, user_id)
-        question_count = len([q for q in all_questions if "question" in q])
 
-        # Check if we've reached the maximum number of questions
-        if question_count >= MAX_QUESTIONS:
-            return {
-                "message": "Answer recorded successfully. Questionnaire complete.",
-                "next_question": None,
-                "is_complete": True,
-            }
+def stream_answer_and_next_question(questionnaire_id, user_id, question_id, answer):
+    """
+    Streaming variant of record_answer_and_get_next_question
 
-        # Generate with GPT
-        gpt_response = call_gpt(questionnaire_id, user_id)
-        print("GPT response: ", gpt_response, flush=True)
+    Yields:
+        tuple: (event, data) pairs. ("token", {"text": ...}) while a GPT question
+        is being generated, then one ("question", response) with the same response
+        record-answer returns, or ("error", {"error": ...}) if the answer could not
+        be recorded or generation failed.
+    """
+    from agents.gpt import (
+        stream_next_question,
+    )  # Import here to avoid circular imports
 
-        if gpt_response and "question" in gpt_response:
-            return {
-                "message": "Answer recorded and new question generated",
-                "next_question": gpt_response,
-            }
-        else:
-            # If GPT generation failed, mark as complete
-            return {
-                "message": "Answer recorded successfully. Questionnaire complete.",
-                "next_question": None,
-                "is_complete": True,
-            }
+    error, response, questions, case_history = _record_answer_step(
+        questionnaire_id, user_id, question_id, answer
+    )
+    if error:
+        yield "error", {"error": error}
+        return
+    if response is not None:
+        yield "question", response
+        return
+
+    generated = prefetch.take(questionnaire_id, question_id, questions)
+    if generated is not None:
+        # Already generated in the background, so send the text in one piece
+        yield "token", {"text": generated.get("question", "")}
     else:
-        # Some other error occurred
-        return {
-            "message": "Answer recorded but couldn't get next question",
-            "error": response["error"],
-            "next_question": None,
-        }
+        print("Streaming GPT next question", flush=True)
+        try:
+            for event, data in stream_next_question(questions, case_history):
+                if event == "token":
+                    yield "token", {"text": data}
+                else:
+                    generated = data
+        except Exception as e:
+            print(f"Error streaming next question: {str(e)}", flush=True)
+            yield "error", {"error": "Failed to generate next question"}
+            return
+
+    yield "question", _append_generated_question(questionnaire_id, user_id, generated)
 
 
 def get_most_recent_result(user_id):
@@ -712,7 +798,7 @@ def get_all_results(user_id):
             print(f"Found result: {result.id}", flush=True)
 
             # Convert the result document to a dictionary
-            result_data = result.to_dict()
+            result_data = to_list_shape(result.to_dict())
 
             # Append the result to the list
             results_list.append(result_data)
@@ -725,50 +811,43 @@ def get_all_results(user_id):
         return False, str(e)
 
 
-def call_gpt(questionnaire_id, user_id):
+def conclusion_content_hash(questions):
     """
-    Call GPT to generate the next question, handle recording in database
+    Hash of the answered questions a conclusion is generated from
 
-    Args:
-        questionnaire_id (str): ID of the questionnaire
-        user_id (str): ID of the user
-
-    Returns:
-        dict: Next question data or error information
+    Whitespace in questions and answers is normalized and the order of
+    multiple-choice answers is ignored, so only real changes to the answers
+    produce a different hash.
     """
-    from agents.gpt import (
-        generate_next_question,
-    )  # Import here to avoid circular imports
-
-    # Get the questionnaire data
-    questionnaire_data = get_all_questions_in_questionnaire(questionnaire_id, user_id)
-
-    if not questionnaire_data:
-        return {"status": "error", "error": "Failed to retrieve questionnaire data"}
 
-    # Call GPT to generate the next question
-    response_data = generate_next_question(questionnaire_data)
+    def normalize(value):
+        if isinstance(value, list):
+            return sorted(normalize(item) for item in value)
+        return " ".join(str(value).split())
 
-    if "question" in response_data:
-        # Add the question to the questionnaire
-        success, message = add_question_to_questionnaire(
-            questionnaire_id, user_id, response_data
-        )
-        if success:
-            return response_data
-        else:
-            return {"status": "error", "error": message}
-    else:
-        return {"status": "error", "error": "Unknown response format"}
+    content = [
+        [normalize(q.get("question", "")), normalize(q["answer"])]
+        for q in questions
+        if "answer" in q
+    ]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode()).hexdigest()
 
 
-def record_gpt_conclusion(questionnaire_id, user_id):
+def record_gpt_conclusion(questionnaire_id, user_id, force=False):
     """
     Call GPT to generate a conclusion, handle recording in database
 
+    The stored result is returned instead when the answers hash the same as the
+    ones it was generated from, unless `force` is set. When the questionnaire
+    starts a new case, the conclusion also carries case_title and
+    case_description for create_case to reuse, see CONCLUSION_CASE_TITLE. When
+    it continues an existing case, the prompt includes the case's earlier
+    visits and the new conclusion is folded into them, see case/history.py.
+
     Args:
         questionnaire_id (str): ID of the questionnaire
         user_id (str): ID of the user
+        force (bool): Generate a new conclusion even if the answers are unchanged
 
     Returns:
         dict: Conclusion data or error information
@@ -776,24 +855,61 @@ def record_gpt_conclusion(questionnaire_id, user_id):
     from agents.gpt import generate_conclusion  # Import here to avoid circular imports
 
     # Get the questionnaire data
-    questionnaire_data = get_all_questions_in_questionnaire(questionnaire_id, user_id)
+    session, error = QuestionnaireSession.load(questionnaire_id, user_id)
+    if error:
+        return {"status": "error", "error": error}
 
+    questionnaire_data = session.questions
     if not questionnaire_data:
         return {"status": "error", "error": "Failed to retrieve questionnaire data"}
 
+    content_hash = conclusion_content_hash(questionnaire_data)
+    stored_result = session.data.get("result")
+    if (
+        not force
+        and stored_result
+        and session.data.get("resultContentHash") == content_hash
+    ):
+        metrics.increment("questionnaire_conclusion_total", outcome="cached")
+        return {
+            "status": "success",
+            "message": "Conclusion is up to date",
+            "result": stored_result.get("analysis"),
+            "cached": True,
+        }
+
     # Call GPT to generate the conclusion
-    response_data = generate_conclusion(questionnaire_data)
+    include_case_title = (
+        CONCLUSION_CASE_TITLE and session.data.get("selectedAction") == "create_new"
+    )
+    response_data = generate_conclusion(
+        questionnaire_data,
+        include_case_title=include_case_title,
+        case_history=session.data.get("caseHistory"),
+    )
     print("response_data from record gpt conclusion/generate conclusion", response_data, flush=True)
 
     if "conclusion" in response_data:
+        metrics.increment("questionnaire_conclusion_total", outcome="generated")
         # Record the result in the questionnaire
         success, message = record_result_to_questionnaire(
-            questionnaire_id, user_id, response_data
+            questionnaire_id, user_id, response_data, content_hash=content_hash, session=session
         )
         if success:
-            return {"status": "success", "message": "Conclusion recorded successfully"}
+            case_id = session.data.get("selectedCaseId")
+            if case_id:
+                # Keep the case's summary of earlier visits current for its next questionnaire
+                history.record_conclusion(case_id, questionnaire_id, response_data)
+            return {
+                "status": "success",
+                "message": "Conclusion recorded successfully",
+                "result": response_data,
+            }
         else:
             return {"status": "error", "error": message}
+    elif response_data.get("status") == "error":
+        # e.g. the degraded response while GPT is unavailable
+        return response_data
     else:
         return {"status": "error", "error": "Unknown response format"}
 
@@ -816,7 +932,7 @@ def get_result_by_id(questionnaire_id):
             print(f"Found result: {result.id}", flush=True)
 
             # Convert the result document to a dictionary
-            result_data = result.to_dict()
+            result_data = to_list_shape(result.to_dict())
 
             # Return the result data
             return result_data
@@ -850,3 +966,66 @@ def get_result_by_visit(visit_id):
     except Exception as e:
         # Return an error message if an exception occurs
         return str(e)
+
+
+def migrate_questionnaire_storage(questionnaire_id):
+    """
+    Convert a questionnaire stored as a single questions array to per-question entries
+
+    Args:
+        questionnaire_id (str): ID of the questionnaire
+
+    Returns:
+        tuple: (bool, message) - True if the document was converted
+    """
+    try:
+        questionnaire_ref = db.collection("questionnaires").document(questionnaire_id)
+        questionnaire = questionnaire_ref.get()
+
+        if not questionnaire.exists:
+            return False, "Questionnaire not found"
+
+        updates = migration_updates(questionnaire.to_dict())
+        if updates is None:
+            return False, "Questionnaire already migrated"
+
+        questionnaire_ref.update(updates)
+        return True, "Questionnaire migrated successfully"
+
+    except Exception as e:
+        return False, str(e)
+
+
+def migrate_all_questionnaires(batch_size=400):
+    """
+    Convert every list-mode questionnaire to per-question entries
+
+    Args:
+        batch_size (int): Number of documents written per batch (Firestore allows 500)
+
+    Returns:
+        int: Number of questionnaires migrated
+    """
+    migrated = 0
+    batch = db.batch()
+    pending = 0
+
+    for questionnaire in db.collection("questionnaires").stream():
+        updates = migration_updates(questionnaire.to_dict())
+        if updates is None:
+            continue
+
+        batch.update(questionnaire.reference, updates)
+        pending += 1
+        migrated += 1
+
+        if pending >= batch_size:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+
+    print(f"Migrated {migrated} questionnaires to entries storage", flush=True)
+    return migrated
@@ -1,15 +1,22 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+import json
+from questionnaire import prefetch
+from questionnaire.jobs import get_job_queue, job_response
+from utils.auth import admin_required
+from utils.single_flight import IdempotencyCache, SingleFlight, content_hash
 from questionnaire.questionnaire import (
     initialize_questionnaire_database,
     record_gpt_conclusion,
-    record_answer_to_question,
-    get_next_question,
+    record_answer_and_get_next_question,
+    stream_answer_and_next_question,
     get_most_recent_question,
     get_most_recent_result,
     get_all_questions_in_questionnaire,
     get_all_results,
     get_result_by_id,
     get_result_by_visit,
+    migrate_questionnaire_storage,
+    migrate_all_questionnaires,
 )
 
 """
@@ -19,6 +26,54 @@ from questionnaire.questionnaire import (
 
 questionnaire_blueprint = Blueprint("questionnaire", __name__)
 
+# Identical concurrent GPT-backed requests share one call, and retries sent with
+# the same Idempotency-Key within the window get the first response replayed
+_single_flight = SingleFlight("questionnaire")
+_idempotency_cache = IdempotencyCache()
+
+
+def _deduplicated(operation, questionnaire_id, user_id, payload, compute):
+    """
+    Run `compute` once for identical concurrent requests and replay it for retries
+
+    Args:
+        operation (str): Name of the route, part of the de-duplication key
+        questionnaire_id (str): ID of the questionnaire
+        user_id (str): ID of the user
+        payload (dict): The request content that determines the response
+        compute (callable): Returns (response body, status code)
+
+    Returns:
+        Response: The JSON response
+    """
+    # The questionnaire is part of the request, so a key reused on another one is rejected
+    fingerprint = content_hash({"questionnaire_id": questionnaire_id, **payload})
+    idempotency_key = request.headers.get("Idempotency-Key")
+    cache_key = (user_id, operation, idempotency_key)
+
+    if idempotency_key:
+        outcome, cached = _idempotency_cache.get(cache_key, fingerprint)
+        if outcome == "mismatch":
+            return (
+                jsonify({"error": "Idempotency-Key was already used for a different request"}),
+                422,
+            )
+        if outcome == "hit":
+            body, status = cached
+            response = jsonify(body)
+            response.headers["Idempotent-Replayed"] = "true"
+            return response, status
+
+    (body, status), shared = _single_flight.do(
+        (questionnaire_id, operation, fingerprint), compute
+    )
+
+    # Server errors are not cached so that a retry runs the request again
+    if idempotency_key and status < 500:
+        _idempotency_cache.put(cache_key, fingerprint, (body, status))
+
+    return jsonify(body), status
+
 
 # Initialize the questionnaire database for a user
 @questionnaire_blueprint.route("/api/questionnaire/initialize", methods=["POST"])
@@ -76,21 +131,71 @@ def record_answer():
             400,
         )
 
-    success, message = record_answer_to_question(
-        questionnaire_id, user_id, question_id, answer
+    def compute():
+        # Record the answer and get the next question in transactions, so duplicate
+        # submissions can't lose answers or add the same generated question twice
+        success, next_question = record_answer_and_get_next_question(
+            questionnaire_id, user_id, question_id, answer
+        )
+
+        if not success:
+            return {"error": "Failed to record answer"}, 500
+
+        # Print the response for debugging purposes
+        print("Response from get_newest_question: ", next_question, flush=True)
+
+        # 4. Return the appropriate response based on the result
+        return next_question, 200
+
+    return _deduplicated(
+        "record-answer",
+        questionnaire_id,
+        user_id,
+        {"user_id": user_id, "question_id": question_id, "answer": answer},
+        compute,
     )
 
-    if not success:
-        return jsonify({"error": "Failed to record answer"}), 500
 
-    # Get the next question (reusing logic from get_newest_question)
-    next_question = get_next_question(questionnaire_id, user_id)
+# Record an answer and stream the next question as server-sent events
+@questionnaire_blueprint.route("/api/questionnaire/record-answer/stream", methods=["POST"])
+def record_answer_stream():
+    """
+    Same as record-answer, but the response is a text/event-stream.
+
+    A generated question's text arrives as "token" events while GPT writes it,
+    followed by one "question" event with the same body record-answer returns
+    (id, type and options included). Failures are sent as an "error" event.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Content-Type must be application/json"}), 415
+
+    data = request.get_json()
+    questionnaire_id = data.get("questionnaire_id")
+    user_id = data.get("user_id")
+    question_id = data.get("question_id")
+    answer = data.get("answer")
+
+    if not all([questionnaire_id, user_id, question_id, answer]):
+        return (
+            jsonify(
+                {
+                    "error": "questionnaire_id, user_id, question_id, and answer are required"
+                }
+            ),
+            400,
+        )
 
-    # Print the response for debugging purposes
-    print("Response from get_newest_question: ", next_question, flush=True)
+    def events():
+        for event, payload in stream_answer_and_next_question(
+            questionnaire_id, user_id, question_id, answer
+        ):
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
-    # 4. Return the appropriate response based on the result
-    return jsonify(next_question), 200
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # get questions in questionnaire
@@ -123,18 +228,78 @@ def get_conclusion():
     if not all([questionnaire_id, user_id]):
         return jsonify({"error": "questionnaire_id and user_id are required"}), 400
 
-    # Call the function to get the GPT conclusion for the questionnaire
-    response = record_gpt_conclusion(questionnaire_id, user_id)
+    force = bool(data.get("force", False))
+
+    def compute():
+        # Call the function to get the GPT conclusion for the questionnaire.
+        # The stored conclusion is reused if the answers haven't changed, unless forced
+        response = record_gpt_conclusion(questionnaire_id, user_id, force=force)
 
-    # Print the response for debugging purposes
-    print("Response from get_gpt_conclusion: ", response, flush=True)
+        # Print the response for debugging purposes
+        print("Response from get_gpt_conclusion: ", response, flush=True)
 
-    # If the response is successful, return the response data
-    if response:
-        return jsonify(response), 200
+        # If the response is successful, return the response data
+        if response:
+            return response, 200
 
-    # If the response is not successful, return an error message
-    return jsonify({"error": "Failed to get conclusion"}), 404
+        # If the response is not successful, return an error message
+        return {"error": "Failed to get conclusion"}, 404
+
+    return _deduplicated(
+        "generate-result",
+        questionnaire_id,
+        user_id,
+        {"user_id": user_id, "force": force},
+        compute,
+    )
+
+
+# Queue a conclusion to be generated in the background
+@questionnaire_blueprint.route("/api/questionnaire/generate-result/jobs", methods=["POST"])
+def submit_conclusion_job():
+    if not request.is_json:
+        return jsonify({"error": "Content-Type must be application/json"}), 415
+
+    data = request.get_json()
+    questionnaire_id = data.get("questionnaire_id")
+    user_id = data.get("user_id")
+
+    if not all([questionnaire_id, user_id]):
+        return jsonify({"error": "questionnaire_id and user_id are required"}), 400
+
+    job = get_job_queue().submit(questionnaire_id, user_id)
+    if job["user_id"] != user_id:
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    return jsonify(job_response(job)), 202
+
+
+# Get a conclusion job, optionally waiting up to `wait` seconds for it to finish
+@questionnaire_blueprint.route(
+    "/api/questionnaire/generate-result/jobs/<job_id>", methods=["GET"]
+)
+def get_conclusion_job(job_id):
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+
+    job = get_job_queue().wait(job_id, timeout=wait)
+    if job is None or job["user_id"] != user_id:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job_response(job)), 200
+
+
+# Worker count and job counts by status
+@questionnaire_blueprint.route("/api/questionnaire/generate-result/job-stats", methods=["GET"])
+@admin_required
+def api_conclusion_job_stats():
+    return jsonify(get_job_queue().get_stats()), 200
 
 
 # Get the most recent result for a user
@@ -207,3 +372,32 @@ def api_get_questionnaire_by_visit():
         return jsonify(result), 200
 
     return jsonify({"error": "Failed to get result"}), 500
+
+
+# Move questionnaires stored as a single questions array to per-question entries
+@questionnaire_blueprint.route("/api/questionnaire/migrate-storage", methods=["POST"])
+@admin_required
+def api_migrate_storage():
+    if not request.is_json:
+        return jsonify({"error": "Content-Type must be application/json"}), 415
+
+    data = request.get_json()
+    questionnaire_id = data.get("questionnaire_id")
+
+    if data.get("all"):
+        migrated = migrate_all_questionnaires()
+        return jsonify({"message": "Migration complete", "migrated": migrated}), 200
+
+    if not questionnaire_id:
+        return jsonify({"error": "questionnaire_id or all is required"}), 400
+
+    success, message = migrate_questionnaire_storage(questionnaire_id)
+
+    return jsonify({"message": message, "migrated": 1 if success else 0}), 200
+
+
+# Hit and discard rates of the speculative first-GPT-question prefetch
+@questionnaire_blueprint.route("/api/questionnaire/prefetch-stats", methods=["GET"])
+@admin_required
+def api_prefetch_stats():
+    return jsonify(prefetch.get_stats()), 200
@@ -0,0 +1,171 @@
+from firebase_admin import firestore
+import copy
+import os
+import random
+import time
+from questionnaire.storage import (
+    DEFAULT_STORAGE_MODE,
+    ENTRIES_FIELD,
+    ENTRIES_MODE,
+    entry_updates,
+    get_storage_mode,
+    migration_updates,
+    rebuild_questions,
+)
+
+db = firestore.client()
+
+# How many times a contended questionnaire transaction is attempted before giving up
+TRANSACTION_MAX_ATTEMPTS = int(os.getenv("QUESTIONNAIRE_TRANSACTION_ATTEMPTS", 8))
+
+# Base and cap (seconds) of the jittered exponential backoff between attempts
+TRANSACTION_BACKOFF_BASE = float(os.getenv("QUESTIONNAIRE_TRANSACTION_BACKOFF", 0.01))
+TRANSACTION_BACKOFF_CAP = 1.0
+
+
+class QuestionnaireSession:
+    """
+    Per-request view of a questionnaire document.
+
+    The document is read once when the session is loaded. Changes are applied to
+    the in-memory copy straight away, so later steps of the same request see them,
+    and are written back to Firestore in a single update on commit().
+
+    `questions` is always the ordered list, whatever the document's storage mode.
+    For entries-mode documents commit() only writes the entries that changed.
+    """
+
+    def __init__(self, questionnaire_ref, data, transaction=None):
+        self.ref = questionnaire_ref
+        self.transaction = transaction
+        self.id = questionnaire_ref.id
+        self.storage_mode = get_storage_mode(data)
+        self._original_entries = copy.deepcopy(data.pop(ENTRIES_FIELD, {}))
+        data["questions"] = rebuild_questions(
+            {**data, ENTRIES_FIELD: self._original_entries}
+        )
+        self.data = data
+        self._pending = {}
+
+    @classmethod
+    def load(cls, questionnaire_id, user_id, transaction=None):
+        """
+        Read the questionnaire and check it belongs to the user
+
+        Args:
+            transaction (Transaction, optional): Read within this transaction,
+                and write through it on commit()
+
+        Returns:
+            tuple: (session, None) on success, (None, error message) otherwise
+        """
+        questionnaire_ref = db.collection("questionnaires").document(questionnaire_id)
+        if transaction is not None:
+            questionnaire = questionnaire_ref.get(transaction=transaction)
+        else:
+            questionnaire = questionnaire_ref.get()
+
+        if not questionnaire.exists:
+            return None, "Questionnaire not found"
+
+        questionnaire_data = questionnaire.to_dict()
+        if questionnaire_data["user_id"] != user_id:
+            return None, "Unauthorized access"
+
+        return cls(questionnaire_ref, questionnaire_data, transaction), None
+
+    @property
+    def questions(self):
+        return self.data.setdefault("questions", [])
+
+    def update(self, fields):
+        """Stage field changes and apply them to the in-memory document"""
+        for field, value in fields.items():
+            if value is firestore.DELETE_FIELD:
+                self.data.pop(field, None)
+            else:
+                self.data[field] = value
+            self._pending[field] = value
+
+    @property
+    def has_changes(self):
+        return bool(self._pending)
+
+    def commit(self):
+        """Write all staged changes in one update. Does nothing if nothing changed."""
+        if not self._pending:
+            return False
+
+        if "questions" in self._pending:
+            # The questions list may have been changed in place after it was staged
+            self._pending["questions"] = self.questions
+
+            if self.storage_mode == ENTRIES_MODE:
+                questions = self._pending.pop("questions")
+                updates, entries = entry_updates(self._original_entries, questions)
+                self._pending.update(updates)
+                self._original_entries = copy.deepcopy(entries)
+            elif DEFAULT_STORAGE_MODE == ENTRIES_MODE:
+                # Move legacy list documents over the first time they are written
+                updates = migration_updates(self.data)
+                self._pending.update(updates)
+                self._original_entries = copy.deepcopy(updates[ENTRIES_FIELD])
+                self.storage_mode = ENTRIES_MODE
+
+        if self.transaction is not None:
+            self.transaction.update(self.ref, self._pending)
+        else:
+            self.ref.update(self._pending)
+        self._pending = {}
+        return True
+
+
+def run_in_transaction(questionnaire_id, user_id, mutate, max_attempts=None):
+    """
+    Apply a change to a questionnaire inside a Firestore transaction
+
+    The questionnaire is loaded into a session within the transaction, `mutate`
+    stages its changes on that session and they are committed atomically. If a
+    concurrent write gets in first the whole function is run again on fresh data,
+    up to `max_attempts` times, so `mutate` must only change the session it is given.
+    Retries wait a random, exponentially growing delay first so that a burst of
+    duplicate submissions spreads out instead of colliding again. Keep slow work
+    such as GPT calls outside `mutate`.
+
+    Args:
+        questionnaire_id (str): ID of the questionnaire
+        user_id (str): ID of the user
+        mutate (callable): Called with the session, its return value is passed back
+        max_attempts (int, optional): Defaults to TRANSACTION_MAX_ATTEMPTS
+
+    Returns:
+        tuple: (result of mutate, None) on success, (None, error message) otherwise
+    """
+    transaction = db.transaction(max_attempts=max_attempts or TRANSACTION_MAX_ATTEMPTS)
+    attempt = 0
+
+    @firestore.transactional
+    def _run(transaction):
+        nonlocal attempt
+        if attempt:
+            # Full jitter backoff; nothing has been read yet, so no locks are held
+            delay = min(TRANSACTION_BACKOFF_CAP, TRANSACTION_BACKOFF_BASE * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+        attempt += 1
+
+        session, error = QuestionnaireSession.load(
+            questionnaire_id, user_id, transaction=transaction
+        )
+        if error:
+            return None, error
+
+        result = mutate(session)
+        session.commit()
+        return result, None
+
+    try:
+        return _run(transaction)
+    except ValueError as e:
+        # Raised once every attempt lost to a concurrent write
+        print(f"Questionnaire transaction failed: {str(e)}", flush=True)
+        return None, "Questionnaire is busy, please try again"
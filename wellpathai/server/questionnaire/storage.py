@@ -0,0 +1,145 @@
+"""
+Storage layout of the questions on a questionnaire document.
+
+"list" documents keep every question in one `questions` array, which has to be
+rewritten whole on every change. "entries" documents keep each question as its
+own entry of the `questionEntries` map, keyed by question id and carrying an
+`order` field, so an answer or a new question only writes that one entry.
+
+Readers always get the list shape back through rebuild_questions() and
+to_list_shape(), so API responses look the same in both modes.
+"""
+
+from firebase_admin import firestore
+import os
+
+LIST_MODE = "list"
+ENTRIES_MODE = "entries"
+
+# Storage mode for newly created questionnaires
+DEFAULT_STORAGE_MODE = os.getenv("QUESTIONNAIRE_STORAGE_MODE", ENTRIES_MODE)
+
+ENTRIES_FIELD = "questionEntries"
+
+
+def get_storage_mode(questionnaire_data):
+    return questionnaire_data.get("storageMode", LIST_MODE)
+
+
+def rebuild_questions(questionnaire_data):
+    """
+    Get the ordered question list of a questionnaire in either storage mode
+
+    Returns:
+        list: Questions in display order, without the internal `order` field
+    """
+    if get_storage_mode(questionnaire_data) != ENTRIES_MODE:
+        return questionnaire_data.get("questions", [])
+
+    entries = questionnaire_data.get(ENTRIES_FIELD, {})
+    ordered = sorted(entries.values(), key=lambda entry: entry.get("order", 0))
+
+    questions = []
+    for entry in ordered:
+        question = dict(entry)
+        question.pop("order", None)
+        questions.append(question)
+    return questions
+
+
+def to_list_shape(questionnaire_data):
+    """Return a copy of a questionnaire document with its questions as a list"""
+    if get_storage_mode(questionnaire_data) != ENTRIES_MODE:
+        return questionnaire_data
+
+    data = dict(questionnaire_data)
+    data["questions"] = rebuild_questions(questionnaire_data)
+    data.pop(ENTRIES_FIELD, None)
+    return data
+
+
+def entries_from_questions(questions):
+    """Build the `questionEntries` map for a question list, keeping its order"""
+    return {
+        question["id"]: {**question, "order": index}
+        for index, question in enumerate(questions)
+    }
+
+
+def initial_storage_fields(questions, storage_mode=None):
+    """Fields holding the initial questions of a new questionnaire"""
+    storage_mode = storage_mode or DEFAULT_STORAGE_MODE
+
+    if storage_mode == ENTRIES_MODE:
+        return {
+            "storageMode": ENTRIES_MODE,
+            ENTRIES_FIELD: entries_from_questions(questions),
+        }
+    return {"storageMode": LIST_MODE, "questions": questions}
+
+
+def entry_updates(original_entries, questions):
+    """
+    Field-path updates that bring the stored entries in line with a question list
+
+    Only questions that are new or were changed get an update, and for a changed
+    question only the changed keys are written. A new question gets an order
+    between its neighbours, so existing entries never need to be renumbered.
+
+    Args:
+        original_entries (dict): The `questionEntries` map as it was read
+        questions (list): The current question list
+
+    Returns:
+        tuple: (updates keyed by field path such as "questionEntries.q3.answer",
+        the full entries map as it is stored once the updates are applied)
+    """
+    updates = {}
+    entries = {}
+    orders = {qid: entry.get("order", 0) for qid, entry in original_entries.items()}
+
+    for index, question in enumerate(questions):
+        question_id = question["id"]
+        original = original_entries.get(question_id)
+
+        if original is None:
+            previous_order = orders[questions[index - 1]["id"]] if index > 0 else -1
+            next_order = next(
+                (orders[q["id"]] for q in questions[index + 1:] if q["id"] in original_entries),
+                None,
+            )
+            if next_order is None:
+                order = previous_order + 1
+            else:
+                order = (previous_order + next_order) / 2
+
+            orders[question_id] = order
+            entries[question_id] = {**question, "order": order}
+            updates[f"{ENTRIES_FIELD}.{question_id}"] = entries[question_id]
+            continue
+
+        entries[question_id] = {**question, "order": orders[question_id]}
+
+        for key, value in question.items():
+            if original.get(key) != value:
+                updates[f"{ENTRIES_FIELD}.{question_id}.{key}"] = value
+        for key in original:
+            if key != "order" and key not in question:
+                updates[f"{ENTRIES_FIELD}.{question_id}.{key}"] = firestore.DELETE_FIELD
+
+    return updates, entries
+
+
+def migration_updates(questionnaire_data):
+    """
+    Updates that convert a list-mode questionnaire to entries mode,
+    or None if it is already in entries mode
+    """
+    if get_storage_mode(questionnaire_data) == ENTRIES_MODE:
+        return None
+
+    return {
+        "storageMode": ENTRIES_MODE,
+        ENTRIES_FIELD: entries_from_questions(questionnaire_data.get("questions", [])),
+        "questions": firestore.DELETE_FIELD,
+    }
@@ -0,0 +1,153 @@
+"""
+Versioned registry of the predefined questionnaire question banks.
+
+The banks are built once when the module is imported. A questionnaire document
+only stores the template version it was started with, and the banks are copied
+into its question list from here once the first question is answered.
+"""
+
+import copy
+
+# Version 1 question banks
+INITIAL_QUESTIONS = [
+    {
+        "id": "q1",
+        "question": "What brought you here today?",
+        "type": "choice",
+        "options": ["General Health Advice", "Feeling Unwell"],
+        "initialized": True,
+    },
+    {
+        "id": "q2",
+        "question": "Have you visited us before for the same reason?",
+        "type": "choice",
+        "options": ["Yes", "No"],
+        "initialized": True
+    }
+]
+
+GENERAL_DEMOGRAPHIC_QUESTIONS = [
+    {
+        "id": "q3",
+        "question": "How old are you?",
+        "type": "text",
+        "initialized": True,
+    },
+    {
+        "id": "q4",
+        "question": "What is your gender?",
+        "type": "choice",
+        "options": ["Male", "Female", "Other", "Prefer not to say"],
+        "initialized": True,
+    },
+    {
+        "id": "q5",
+        "question": "What is your height?",
+        "type": "text",
+        "placeholder": "e.g. 6 feet",
+        "initialized": True,
+    },
+    {
+        "id": "q6",
+        "question": "What is your weight?",
+        "type": "text",
+        "placeholder": "e.g. 140 lbs",
+        "initialized": True,
+    },
+]
+
+# General health advice specific questions
+GENERAL_HEALTH_QUESTIONS = [
+    {
+        "id": "q7",
+        "question": "Did you have any medical conditions before?",
+        "type": "text",
+        "initialized": True,
+    },
+    {
+        "id": "q8",
+        "question": "Are you currently taking any medications?",
+        "type": "text",
+        "initialized": True,
+    },
+    {
+        "id": "q9",
+        "question": "Do you have any allergies?",
+        "type": "text",
+        "initialized": True,
+    },
+]
+
+FEELING_UNWELL_QUESTIONS = [
+    {
+        "id": "q7",
+        "question": "What symptoms are you experiencing?",
+        "type": "text",
+        "placeholder": "e.g. headache, fever, cough",
+        "initialized": True,
+    },
+    {
+        "id": "q8",
+        "question": "How long have you been experiencing these symptoms?",
+        "type": "choice",
+        "options": [
+            "Less than 24 hours",
+            "1-3 days",
+            "4-7 days",
+            "More than a week",
+        ],
+        "initialized": True,
+    },
+    {
+        "id": "q9",
+        "question": "Rate your discomfort level",
+        "type": "choice",
+        "options": ["1", "2", "3", "4", "5"],
+        "initialized": True,
+    },
+    {
+        "id": "q10",
+        "question": "Do you have any chronic medical conditions?",
+        "type": "multiselect",
+        "options": [
+            "Diabetes",
+            "Hypertension",
+            "Heart Disease",
+            "Asthma",
+            "None of Above",
+        ],
+        "initialized": True,
+    },
+]
+
+
+CURRENT_TEMPLATE_VERSION = "v1"
+
+# Registry of every template version still referenced by stored questionnaires.
+# Never edit a published version in place; add a new one and bump CURRENT_TEMPLATE_VERSION.
+QUESTION_TEMPLATES = {
+    "v1": {
+        "initial": INITIAL_QUESTIONS,
+        "generalDemographic": GENERAL_DEMOGRAPHIC_QUESTIONS,
+        "generalHealth": GENERAL_HEALTH_QUESTIONS,
+        "feelingUnwell": FEELING_UNWELL_QUESTIONS,
+    },
+}
+
+
+def get_question_bank(bank, version=None):
+    """
+    Get a copy of a predefined question bank
+
+    Args:
+        bank (str): One of "initial", "generalDemographic", "generalHealth", "feelingUnwell"
+        version (str, optional): Template version, defaults to the current one
+
+    Returns:
+        list: Fresh copies of the bank's questions, safe to modify and store
+    """
+    template = QUESTION_TEMPLATES.get(version or CURRENT_TEMPLATE_VERSION)
+    if template is None:
+        raise KeyError(f"Unknown question template version: {version}")
+
+    return copy.deepcopy(template[bank])
@@ -0,0 +1,394 @@
+"""
+In-memory stand-in for the Firestore client used by the server modules.
+
+Only the calls the server actually makes are implemented. Every call that
+would be a network round trip in production is counted in ``rpc_counts`` so
+tests can assert how many reads and writes a code path costs.
+"""
+
+import copy
+import threading
+import time
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data, reference=None):
+        self.id = doc_id
+        self._data = data
+        self.reference = reference
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return _get_path(self._data or {}, field)
+
+
+def _get_path(data, path):
+    for part in path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+def _project(data, field_paths):
+    """`data` with only the given (dotted) field paths, like a Firestore projection"""
+    if data is None or field_paths is None:
+        return copy.deepcopy(data)
+    projected = {}
+    for path in field_paths:
+        parent, _, key = path.rpartition(".")
+        container = _get_path(data, parent) if parent else data
+        if not isinstance(container, dict) or key not in container:
+            continue
+        value = container[key]
+        parts = path.split(".")
+        target = projected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = copy.deepcopy(value)
+    return projected
+
+
+def _apply_updates(data, updates):
+    for path, value in updates.items():
+        parts = path.split(".")
+        target = data
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        key = parts[-1]
+
+        if value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, transforms.ArrayUnion):
+            current = list(target.get(key, []))
+            current.extend(v for v in value.values if v not in current)
+            target[key] = current
+        elif isinstance(value, transforms.ArrayRemove):
+            target[key] = [v for v in target.get(key, []) if v not in value.values]
+        elif isinstance(value, transforms.Increment):
+            target[key] = target.get(key, 0) + value.value
+        elif isinstance(value, transforms.Maximum):
+            current = target.get(key)
+            target[key] = value.value if current is None else max(current, value.value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self.id = doc_id
+        self._collection = collection
+        self.path = f"{collection}/{doc_id}"
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._count("read")
+        snapshot, version = self._client._read(self)
+        if transaction is not None:
+            transaction._track(self, version)
+        if field_paths is not None and snapshot.exists:
+            snapshot = FakeSnapshot(snapshot.id, _project(snapshot._data, field_paths), self)
+        return snapshot
+
+    def set(self, data):
+        self._client._count("write")
+        self._client._write(self, copy.deepcopy(data))
+
+    def update(self, updates):
+        self._client._count("write")
+        self._client._update(self, updates)
+
+    def delete(self):
+        self._client._count("write")
+        self._client._delete(self)
+
+
+class FakeQuery:
+    def __init__(self, client, collection, filters=None, fields=None):
+        self._client = client
+        self._collection = collection
+        self._filters = filters or []
+        self._fields = fields
+
+    def where(self, field, op, value):
+        if op == "in" and len(value) > 30:
+            raise exceptions.InvalidArgument("'IN' supports up to 30 comparison values.")
+        return FakeQuery(self._client, self._collection, self._filters + [(field, op, value)], self._fields)
+
+    def select(self, field_paths):
+        return FakeQuery(self._client, self._collection, self._filters, list(field_paths))
+
+    def _project(self, data):
+        return _project(data, self._fields)
+
+    def _matches(self, data):
+        for field, op, value in self._filters:
+            current = _get_path(data, field)
+            if op == "==" and current != value:
+                return False
+            if op == "in" and current not in value:
+                return False
+        return True
+
+    def stream(self):
+        self._client._count("query")
+        with self._client._lock:
+            docs = self._client._collections.get(self._collection, {})
+            results = [
+                FakeSnapshot(doc_id, self._project(data), self._client.collection(self._collection).document(doc_id))
+                for doc_id, data in docs.items()
+                if self._matches(data)
+            ]
+        return iter(results)
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeTransaction:
+    """
+    Optimistic transaction compatible with ``firestore.transactional``.
+
+    Writes are buffered until commit. Commit fails with ``Aborted`` when a document
+    read in the transaction changed in the meantime, which makes the decorator retry.
+    """
+
+    def __init__(self, client, max_attempts=5):
+        self._client = client
+        self._max_attempts = max_attempts
+        self._read_only = False
+        self._id = None
+        self._reads = {}
+        self._writes = []
+
+    def _clean_up(self):
+        self._id = None
+        self._reads = {}
+        self._writes = []
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().hex
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _track(self, ref, version):
+        self._reads.setdefault(ref.path, version)
+
+    def set(self, ref, data):
+        self._writes.append((ref, "set", copy.deepcopy(data)))
+
+    def update(self, ref, updates):
+        self._writes.append((ref, "update", updates))
+
+    def delete(self, ref):
+        self._writes.append((ref, "delete", None))
+
+    def _commit(self):
+        client = self._client
+        client._count("write")
+        with client._lock:
+            for path, version in self._reads.items():
+                if client._versions[path] != version:
+                    self._clean_up()
+                    raise exceptions.Aborted(f"Contention on {path}")
+            client._apply_writes(self._writes)
+        self._clean_up()
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref, data):
+        self._writes.append((ref, "set", copy.deepcopy(data)))
+
+    def update(self, ref, updates):
+        self._writes.append((ref, "update", updates))
+
+    def delete(self, ref):
+        self._writes.append((ref, "delete", None))
+
+    def commit(self):
+        self._client._count("write")
+        with self._client._lock:
+            self._client._apply_writes(self._writes)
+        self._writes = []
+
+
+class FakeBulkWriter:
+    """
+    BulkWriter sending its operations in batches of 20 on flush or close.
+
+    Paths in ``fail_paths`` fail every attempt, to exercise the error callback.
+    """
+
+    batch_size = 20
+
+    def __init__(self, client, options=None, fail_paths=()):
+        self._client = client
+        self.options = options
+        self._fail_paths = set(fail_paths)
+        self._operations = []
+        self._on_result = lambda reference, result, bulk_writer: None
+        self._on_error = lambda failure, bulk_writer: failure.attempts < 15
+
+    def on_write_result(self, callback):
+        self._on_result = callback
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def delete(self, ref):
+        self._operations.append((ref, "delete", None))
+
+    def update(self, ref, updates):
+        self._operations.append((ref, "update", updates))
+
+    def flush(self):
+        operations, self._operations = self._operations, []
+        for start in range(0, len(operations), self.batch_size):
+            self._client._count("write")
+            for ref, kind, payload in operations[start:start + self.batch_size]:
+                self._send(ref, kind, payload)
+
+    def _send(self, ref, kind, payload):
+        attempts = 0
+        while True:
+            attempts += 1
+            if ref.path not in self._fail_paths:
+                with self._client._lock:
+                    self._client._apply_writes([(ref, kind, payload)])
+                self._on_result(ref, None, self)
+                return
+            failure = SimpleNamespace(
+                operation=SimpleNamespace(reference=ref, attempts=attempts),
+                attempts=attempts,
+                code=14,
+                message="Injected failure",
+            )
+            if not self._on_error(failure, self):
+                return
+
+    def close(self):
+        self.flush()
+
+
+class FakeFirestore:
+    """
+    Thread-safe in-memory document store with per-RPC counters.
+
+    ``latency`` (seconds) is slept on every RPC, which lets concurrency tests
+    interleave threads and benchmarks model network round trips.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self._collections = {}
+        self._versions = Counter()
+        self._lock = threading.RLock()
+        self.rpc_counts = Counter()
+        self.update_log = []
+        # Documents bulk writers fail to write, and the bulk writers handed out
+        self.failing_paths = set()
+        self.bulk_writers = []
+
+    def reset_counts(self):
+        self.rpc_counts.clear()
+        self.update_log.clear()
+
+    def _count(self, kind):
+        with self._lock:
+            self.rpc_counts[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def transaction(self, max_attempts=5, **kwargs):
+        return FakeTransaction(self, max_attempts=max_attempts)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def bulk_writer(self, options=None):
+        writer = FakeBulkWriter(self, options, self.failing_paths)
+        self.bulk_writers.append(writer)
+        return writer
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        """All documents in one read RPC, in no particular order like Firestore"""
+        self._count("read")
+        snapshots = []
+        for ref in reversed(list(references)):
+            snapshot, version = self._read(ref)
+            if transaction is not None:
+                transaction._track(ref, version)
+            if field_paths is not None and snapshot.exists:
+                snapshot = FakeSnapshot(snapshot.id, _project(snapshot._data, field_paths), ref)
+            snapshots.append(snapshot)
+        return iter(snapshots)
+
+    def _read(self, ref):
+        with self._lock:
+            data = self._collections.get(ref._collection, {}).get(ref.id)
+            return FakeSnapshot(ref.id, copy.deepcopy(data), ref), self._versions[ref.path]
+
+    def _apply_writes(self, writes):
+        for ref, kind, payload in writes:
+            if kind == "set":
+                self._write(ref, payload)
+            elif kind == "update":
+                self._update(ref, payload)
+            else:
+                self._delete(ref)
+
+    def _write(self, ref, data):
+        with self._lock:
+            self._collections.setdefault(ref._collection, {})[ref.id] = data
+            self._versions[ref.path] += 1
+
+    def _update(self, ref, updates):
+        with self._lock:
+            data = self._collections.get(ref._collection, {}).get(ref.id)
+            if data is None:
+                raise ValueError(f"No document to update: {ref.path}")
+            _apply_updates(data, updates)
+            self._versions[ref.path] += 1
+            self.update_log.append((ref.path, dict(updates)))
+
+    def _delete(self, ref):
+        with self._lock:
+            self._collections.get(ref._collection, {}).pop(ref.id, None)
+            self._versions[ref.path] += 1
+
+    # Helpers for arranging test data without touching the RPC counters
+    def seed(self, collection, doc_id, data):
+        with self._lock:
+            self._collections.setdefault(collection, {})[doc_id] = copy.deepcopy(data)
+
+    def dump(self, collection, doc_id):
+        with self._lock:
+            return copy.deepcopy(self._collections.get(collection, {}).get(doc_id))
@@ -0,0 +1,566 @@
+import os
+import sys
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from flask import Flask
+from fake_firestore import FakeFirestore
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+# The server modules create their Firestore client at import time
+with patch("firebase_admin.firestore.client"):
+    from case import case, counters, deletion, enrichment, timeline
+    from case.case_api import case_blueprint
+    from utils import data_utils
+    from visit import visit
+
+ANSWERS = [{"id": "q1", "question": "What brought you here today?", "answer": "Feeling Unwell"}]
+
+
+class CaseTestCase(unittest.TestCase):
+    user_id = "user123"
+
+    def setUp(self):
+        self.db = FakeFirestore()
+        for patcher in (
+            patch.object(case, "db", self.db),
+            patch.object(enrichment, "db", self.db),
+            patch.object(counters, "db", self.db),
+            patch.object(deletion, "db", self.db),
+            patch.object(timeline, "db", self.db),
+            patch.object(data_utils, "db", self.db),
+            patch.object(visit, "db", self.db),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.db.seed("users", self.user_id, {"cases": []})
+
+    def seed_questionnaire(self, analysis=None):
+        data = {"user_id": self.user_id, "questions": ANSWERS}
+        if analysis is not None:
+            data["result"] = {"analysis": analysis}
+        self.db.seed("questionnaires", "questionnaire1", data)
+
+
+class TestCreateCase(CaseTestCase):
+    def setUp(self):
+        super().setUp()
+        # Enrichment is run by the tests themselves
+        patcher = patch.object(enrichment, "enqueue")
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stores_a_pending_case_in_one_write(self):
+        self.seed_questionnaire()
+        self.db.reset_counts()
+
+        with patch.object(enrichment, "generate_case_title") as mock_gpt:
+            case_id = case.create_case(self.user_id, "questionnaire1")
+
+        mock_gpt.assert_not_called()
+        self.assertEqual(self.db.rpc_counts["read"], 0)
+        stored = self.db.dump("cases", case_id)
+        self.assertTrue(stored["title"].startswith("Case "))
+        self.assertEqual(stored["titleStatus"], enrichment.TITLE_PENDING)
+        self.assertEqual(self.db.dump("users", self.user_id)["cases"], [case_id])
+        self.enqueue.assert_called_once_with(case_id, self.user_id, "questionnaire1")
+
+    def test_given_title_is_kept(self):
+        case_id = case.create_case(self.user_id, "questionnaire1", "Back Pain", "Lower back pain.")
+
+        stored = self.db.dump("cases", case_id)
+        self.assertEqual((stored["title"], stored["titleStatus"]), ("Back Pain", enrichment.TITLE_READY))
+        self.enqueue.assert_not_called()
+
+    def test_without_questionnaire_the_title_stays_provisional(self):
+        case_id = case.create_case(self.user_id, None)
+
+        self.assertEqual(self.db.dump("cases", case_id)["titleStatus"], enrichment.TITLE_PROVISIONAL)
+        self.enqueue.assert_not_called()
+
+    def test_route_answers_before_the_title_is_generated(self):
+        self.seed_questionnaire()
+        app = Flask(__name__)
+        app.register_blueprint(case_blueprint)
+
+        response = app.test_client().post(
+            "/api/cases/create", json={"userId": self.user_id, "questionnaireId": "questionnaire1"}
+        )
+
+        self.assertEqual(response.status_code, 201)
+        case_id = response.get_json()["caseId"]
+        self.assertEqual(self.db.dump("cases", case_id)["titleStatus"], enrichment.TITLE_PENDING)
+
+
+class TestEnrichCase(CaseTestCase):
+    def create_pending(self):
+        with patch.object(enrichment, "enqueue"):
+            return case.create_case(self.user_id, "questionnaire1")
+
+    def test_reuses_the_title_of_the_conclusion(self):
+        self.seed_questionnaire({
+            "conclusion": "Likely tension headache",
+            "case_title": "Tension Headache",
+            "case_description": "Recurring pressure around the temples.",
+        })
+        case_id = self.create_pending()
+
+        with patch.object(enrichment, "generate_case_title") as mock_gpt:
+            self.assertTrue(enrichment.enrich_case(case_id, self.user_id, "questionnaire1"))
+
+        mock_gpt.assert_not_called()
+        stored = self.db.dump("cases", case_id)
+        self.assertEqual(stored["title"], "Tension Headache")
+        self.assertEqual(stored["description"], "Recurring pressure around the temples.")
+        self.assertEqual(stored["titleStatus"], enrichment.TITLE_READY)
+
+    def test_generates_a_title_without_one_in_the_conclusion(self):
+        self.seed_questionnaire({"conclusion": "Likely tension headache"})
+        case_id = self.create_pending()
+
+        with patch.object(enrichment, "generate_case_title", return_value=("Headaches.", "Headache")) as mock_gpt:
+            enrichment.enrich_case(case_id, self.user_id, "questionnaire1")
+
+        mock_gpt.assert_called_once_with(ANSWERS)
+        self.assertEqual(self.db.dump("cases", case_id)["title"], "Headache")
+
+    def test_failed_generation_keeps_the_provisional_title(self):
+        self.seed_questionnaire()
+        case_id = self.create_pending()
+        provisional = self.db.dump("cases", case_id)["title"]
+
+        # generate_case_title returns None when GPT fails
+        with patch.object(enrichment, "generate_case_title", return_value=None):
+            enrichment.enrich_case(case_id, self.user_id, "questionnaire1")
+
+        stored = self.db.dump("cases", case_id)
+        self.assertEqual(stored["title"], provisional)
+        self.assertEqual(stored["titleStatus"], enrichment.TITLE_PROVISIONAL)
+
+    def test_title_set_by_the_user_is_not_overwritten(self):
+        self.seed_questionnaire()
+        case_id = self.create_pending()
+        case.update_case(case_id, {"title": "My Headaches"})
+
+        with patch.object(enrichment, "generate_case_title", return_value=("Headaches.", "Headache")):
+            self.assertFalse(enrichment.enrich_case(case_id, self.user_id, "questionnaire1"))
+
+        self.assertEqual(self.db.dump("cases", case_id)["title"], "My Headaches")
+
+    def test_pending_cases_are_resumed(self):
+        self.seed_questionnaire()
+        case_id = self.create_pending()
+        case.create_case(self.user_id, "questionnaire1", "Back Pain")
+
+        with patch.object(enrichment, "enqueue") as mock_enqueue:
+            self.assertEqual(enrichment.resume_pending(), 1)
+
+        mock_enqueue.assert_called_once_with(case_id, self.user_id, "questionnaire1")
+
+    def test_case_queued_by_several_workers_is_titled_once(self):
+        self.seed_questionnaire()
+        case_id = self.create_pending()
+        nested = []
+
+        def generate(questions):
+            # Another worker resumes the same case while this one is generating
+            nested.append(enrichment.enrich_case(case_id, self.user_id, "questionnaire1"))
+            return "Headaches.", "Headache"
+
+        with patch.object(enrichment, "generate_case_title", side_effect=generate) as mock_gpt:
+            self.assertTrue(enrichment.enrich_case(case_id, self.user_id, "questionnaire1"))
+
+        mock_gpt.assert_called_once()
+        self.assertEqual(nested, [False])
+        stored = self.db.dump("cases", case_id)
+        self.assertEqual((stored["title"], stored["titleStatus"]), ("Headache", enrichment.TITLE_READY))
+        self.assertNotIn("titleClaim", stored)
+
+    def test_expired_claim_is_taken_over(self):
+        self.seed_questionnaire()
+        case_id = self.create_pending()
+        self.db.collection("cases").document(case_id).update({
+            "titleClaim": "dead-worker",
+            "titleClaimedAt": datetime.now() - timedelta(seconds=enrichment.TITLE_CLAIM_SECONDS + 1),
+        })
+
+        with patch.object(enrichment, "generate_case_title", return_value=("Headaches.", "Headache")):
+            self.assertTrue(enrichment.enrich_case(case_id, self.user_id, "questionnaire1"))
+
+        self.assertEqual(self.db.dump("cases", case_id)["title"], "Headache")
+
+    def test_enqueue_runs_in_the_background(self):
+        self.seed_questionnaire()
+        case_id = self.create_pending()
+
+        with patch.object(enrichment, "generate_case_title", return_value=("Headaches.", "Headache")):
+            enrichment.enqueue(case_id, self.user_id, "questionnaire1").result(timeout=5)
+
+        self.assertEqual(self.db.dump("cases", case_id)["titleStatus"], enrichment.TITLE_READY)
+
+    def test_conclusion_title_of_another_user_is_ignored(self):
+        self.seed_questionnaire({"case_title": "Tension Headache", "case_description": "Pressure."})
+
+        self.assertIsNone(enrichment.get_conclusion_case_title("questionnaire1", "someone-else"))
+        self.assertIsNone(enrichment.get_conclusion_case_title("missing", self.user_id))
+
+
+class TestCaseSummary(CaseTestCase):
+    """Cases without stored counters, from before they were introduced"""
+
+    def seed_cases(self, count, user_id=None):
+        for i in range(count):
+            self.db.seed("cases", f"{user_id or self.user_id}-case{i}", {"userId": user_id or self.user_id, "title": f"Case {i}"})
+
+    def test_counts_visits_reports_and_last_visit(self):
+        self.seed_cases(2)
+        self.seed_cases(1, "someone-else")
+        visits = [
+            ("user123-case0", True, "2026-09-01"),
+            ("user123-case0", False, "2026-10-03"),
+            ("user123-case0", True, None),
+            ("someone-else-case0", True, "2026-10-09"),
+        ]
+        for i, (case_id, has_new_report, visit_date) in enumerate(visits):
+            self.db.seed("visits", f"visit{i}", {"caseId": case_id, "hasNewReport": has_new_report, "visitDate": visit_date})
+
+        summary = {case_data["id"]: case_data for case_data in case.get_case_summary(self.user_id)}
+
+        self.assertEqual(set(summary), {"user123-case0", "user123-case1"})
+        first = summary["user123-case0"]
+        self.assertEqual((first["visitCount"], first["newReportCount"], first["lastVisitDate"]), (3, 2, "2026-10-03"))
+        second = summary["user123-case1"]
+        self.assertEqual((second["visitCount"], second["newReportCount"], second["lastVisitDate"]), (0, 0, None))
+        self.assertEqual(second["title"], "Case 1")
+
+    def test_visits_are_read_in_chunks_of_the_in_limit(self):
+        self.seed_cases(65)
+        for i in range(65):
+            self.db.seed("visits", f"visit{i}", {"caseId": f"user123-case{i}", "hasNewReport": True, "visitDate": "2026-10-01"})
+        self.db.reset_counts()
+
+        summary = case.get_case_summary(self.user_id)
+
+        # The cases query, then three "in" queries instead of one per case
+        self.assertEqual(self.db.rpc_counts["query"], 1 + 3)
+        self.assertEqual(len(summary), 65)
+        self.assertTrue(all(case_data["visitCount"] == 1 for case_data in summary))
+
+    def test_user_without_cases(self):
+        self.db.reset_counts()
+
+        self.assertEqual(case.get_case_summary(self.user_id), [])
+        self.assertEqual(self.db.rpc_counts["query"], 1)
+
+
+class TestLinkToCase(CaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db.seed("cases", "case1", {"userId": self.user_id, "appointments": [], "results": [], "reports": []})
+        self.db.seed("appointments", "appointment1", {"userId": self.user_id})
+
+    def test_links_both_documents_in_one_read_and_one_commit(self):
+        self.db.reset_counts()
+
+        self.assertTrue(case.add_appointment_to_case("case1", "appointment1"))
+
+        self.assertEqual((self.db.rpc_counts["read"], self.db.rpc_counts["write"]), (1, 1))
+        self.assertEqual(self.db.dump("cases", "case1")["appointments"], ["appointment1"])
+        self.assertEqual(self.db.dump("appointments", "appointment1")["caseId"], "case1")
+
+    def test_missing_document_leaves_the_case_untouched(self):
+        stored = self.db.dump("cases", "case1")
+
+        self.assertFalse(case.add_result_to_case("case1", "missing"))
+        self.assertFalse(case.add_report_to_case("case1", "missing"))
+        self.assertFalse(case.add_appointment_to_case("missing", "appointment1"))
+
+        self.assertEqual(self.db.dump("cases", "case1"), stored)
+        self.assertNotIn("caseId", self.db.dump("appointments", "appointment1"))
+        self.assertFalse(any(path.startswith("cases/") for path, _ in self.db.update_log))
+
+
+class TestVisitCounters(CaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with patch.object(enrichment, "enqueue"):
+            self.case_id = case.create_case(self.user_id, None, "Headache")
+            self.other_case_id = case.create_case(self.user_id, None, "Back Pain")
+
+    def counters_of(self, case_id):
+        stored = self.db.dump("cases", case_id)
+        return tuple(stored[field] for field in counters.COUNTER_FIELDS)
+
+    def create_visit(self, case_id=None):
+        return visit.create_visit(self.user_id, case_id or self.case_id, "questionnaire1")["visit_id"]
+
+    def test_new_case_starts_at_zero(self):
+        self.assertEqual(self.counters_of(self.case_id), (0, 0, None))
+
+    def test_create_visit_counts_it_in_one_commit(self):
+        self.db.reset_counts()
+        visit_id = self.create_visit()
+
+        self.assertEqual(self.db.rpc_counts["write"], 1)
+        today = self.db.dump("visits", visit_id)["visitDate"]
+        self.assertEqual(self.counters_of(self.case_id), (1, 1, today))
+        self.assertEqual(self.db.dump("cases", self.case_id)["visits"], [visit_id])
+
+    def test_visit_for_a_missing_case_is_still_created(self):
+        created = visit.create_visit(self.user_id, "missing", "questionnaire1")
+
+        self.assertFalse(created["add_to_case"])
+        self.assertIsNotNone(self.db.dump("visits", created["visit_id"]))
+
+    def test_report_status_and_date_changes(self):
+        visit_id = self.create_visit()
+        self.create_visit()
+
+        visit.update_new_report_status(visit_id, False)
+        visit.update_new_report_status(visit_id, False)
+        self.assertEqual(self.counters_of(self.case_id)[:2], (2, 1))
+
+        visit.update_consultation_id(visit_id, "consultation1")
+        self.assertEqual(self.counters_of(self.case_id)[:2], (2, 2))
+
+        visit.update_visit_date(visit_id, "2099-01-01")
+        self.assertEqual(self.counters_of(self.case_id)[2], "2099-01-01")
+
+    def test_moving_a_visit_moves_its_counts(self):
+        visit_id = self.create_visit()
+
+        self.assertTrue(case.add_visit_to_case(self.other_case_id, visit_id))
+
+        self.assertEqual(self.counters_of(self.case_id)[:2], (0, 0))
+        self.assertEqual(self.counters_of(self.other_case_id)[:2], (1, 1))
+        self.assertEqual(self.db.dump("cases", self.case_id)["visits"], [])
+        self.assertEqual(self.db.dump("cases", self.other_case_id)["visits"], [visit_id])
+        # Linking it again changes nothing
+        case.add_visit_to_case(self.other_case_id, visit_id)
+        self.assertEqual(self.counters_of(self.other_case_id)[:2], (1, 1))
+
+    def test_linking_to_a_missing_case_or_visit_changes_nothing(self):
+        visit_id = self.create_visit()
+        stored_case, stored_visit = self.db.dump("cases", self.case_id), self.db.dump("visits", visit_id)
+
+        self.assertFalse(case.add_visit_to_case("missing", visit_id))
+        self.assertFalse(case.add_visit_to_case(self.case_id, "missing"))
+        self.assertEqual(self.db.dump("cases", self.case_id), stored_case)
+        self.assertEqual(self.db.dump("visits", visit_id), stored_visit)
+
+    def test_summary_is_one_query_with_stored_counters(self):
+        self.create_visit()
+        self.db.reset_counts()
+
+        summary = {case_data["id"]: case_data for case_data in case.get_case_summary(self.user_id)}
+
+        self.assertEqual(self.db.rpc_counts["query"], 1)
+        self.assertEqual(summary[self.case_id]["visitCount"], 1)
+        self.assertEqual(summary[self.other_case_id]["visitCount"], 0)
+
+    def test_reconcile_repairs_drift_and_backfills_old_cases(self):
+        visit_id = self.create_visit()
+        # Drift, e.g. from a write that bypassed the counters
+        self.db.collection("visits").document(visit_id).update({"hasNewReport": False})
+        self.db.seed("cases", "old-case", {"userId": self.user_id, "title": "Old"})
+        self.db.seed("visits", "old-visit", {"caseId": "old-case", "hasNewReport": True, "visitDate": "2025-05-05"})
+
+        self.assertEqual(counters.reconcile(self.user_id), {"checked": 3, "repaired": 2})
+
+        self.assertEqual(self.counters_of(self.case_id)[:2], (1, 0))
+        self.assertEqual(self.counters_of("old-case"), (1, 1, "2025-05-05"))
+        self.assertEqual(counters.reconcile(self.user_id)["repaired"], 0)
+
+    def test_reconcile_route_is_admin_only(self):
+        app = Flask(__name__)
+        app.register_blueprint(case_blueprint)
+        client = app.test_client()
+
+        self.assertEqual(client.post("/api/admin/cases/reconcile-counters").status_code, 401)
+        with patch("utils.auth.auth.verify_id_token", return_value={"isAdmin": True}):
+            response = client.post(
+                "/api/admin/cases/reconcile-counters",
+                json={"userId": self.user_id},
+                headers={"Authorization": "Bearer token"},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["checked"], 2)
+
+
+class TestCascadingDelete(CaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with patch.object(enrichment, "enqueue"):
+            self.case_id = case.create_case(self.user_id, None, "Headache")
+        app = Flask(__name__)
+        app.register_blueprint(case_blueprint)
+        self.client = app.test_client()
+
+    def seed_dependents(self, visits=2, case_id=None):
+        case_id = case_id or self.case_id
+        for i in range(visits):
+            self.db.seed("visits", f"{case_id}-visit{i}", {"caseId": case_id})
+        self.db.seed("questionnaires", f"{case_id}-questionnaire", {"caseId": case_id})
+        self.db.seed("appointments", f"{case_id}-appointment", {"caseId": case_id})
+        # Booked through cal.com
+        self.db.seed("appointments", f"{case_id}-booking", {"case_id": case_id})
+
+    def test_dry_run_counts_without_deleting(self):
+        self.seed_dependents()
+
+        response = self.client.delete(f"/api/cases/{self.case_id}?dryRun=true")
+
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body["counts"], {"visits": 2, "questionnaires": 1, "appointments": 2})
+        self.assertEqual(body["total"], 5)
+        self.assertIsNotNone(self.db.dump("cases", self.case_id))
+        self.assertIsNotNone(self.db.dump("visits", f"{self.case_id}-visit0"))
+
+    def test_deletes_dependents_then_the_case(self):
+        self.seed_dependents()
+        self.db.seed("visits", "other-visit", {"caseId": "other-case"})
+
+        response = self.client.delete(f"/api/cases/{self.case_id}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["deleted"], 5)
+        self.assertIsNone(self.db.dump("cases", self.case_id))
+        self.assertEqual(self.db.dump("users", self.user_id)["cases"], [])
+        for collection, doc_id in (
+            ("visits", f"{self.case_id}-visit1"),
+            ("questionnaires", f"{self.case_id}-questionnaire"),
+            ("appointments", f"{self.case_id}-booking"),
+        ):
+            self.assertIsNone(self.db.dump(collection, doc_id))
+        self.assertIsNotNone(self.db.dump("visits", "other-visit"))
+
+        options = self.db.bulk_writers[0].options
+        self.assertEqual(options.initial_ops_per_second, deletion.CASE_DELETE_OPS_PER_SECOND)
+        self.assertEqual(options.max_ops_per_second, deletion.CASE_DELETE_MAX_OPS_PER_SECOND)
+
+    def test_large_case_is_deleted_in_the_background(self):
+        self.seed_dependents(visits=30)
+
+        with patch.object(deletion, "BACKGROUND_THRESHOLD", 10):
+            response = self.client.delete(f"/api/cases/{self.case_id}")
+
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()["jobId"]
+        deadline = time.monotonic() + 5
+        while True:
+            progress = self.client.get(f"/api/cases/deletions/{job_id}").get_json()
+            if progress["status"] != deletion.RUNNING or time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(progress["status"], deletion.SUCCEEDED)
+        self.assertEqual((progress["total"], progress["deleted"]), (33, 33))
+        self.assertIsNone(self.db.dump("cases", self.case_id))
+        self.assertEqual(self.client.get("/api/cases/deletions/unknown").status_code, 404)
+
+    def test_failed_dependent_keeps_the_case_for_a_retry(self):
+        self.seed_dependents()
+        self.db.failing_paths.add(f"visits/{self.case_id}-visit0")
+
+        response = self.client.delete(f"/api/cases/{self.case_id}")
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()["failed"], 1)
+        self.assertIsNotNone(self.db.dump("cases", self.case_id))
+
+        self.db.failing_paths.clear()
+        self.assertTrue(case.delete_case(self.case_id))
+        self.assertIsNone(self.db.dump("cases", self.case_id))
+
+    def test_missing_case(self):
+        self.assertEqual(self.client.delete("/api/cases/missing").status_code, 404)
+        self.assertEqual(self.client.delete("/api/cases/missing?dryRun=true").status_code, 404)
+        self.assertFalse(case.delete_case("missing"))
+
+
+class TestCaseTimeline(CaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db.seed("cases", "case1", {
+            "userId": self.user_id,
+            "title": "Headache",
+            "createdAt": datetime(2026, 9, 1, 8, 30),
+            "visitCount": 2,
+            "history": {"text": "Visit on 2026-09-01: Tension headache", "visits": []},
+        })
+        self.db.seed("questionnaires", "questionnaire1", {
+            "user_id": self.user_id,
+            "questions": ANSWERS,
+            "status": "completed",
+            "result": {"analysis": {"conclusion": "Tension headache", "suggestions": ["Rest"]}},
+        })
+        self.db.seed("questionnaires", "questionnaire2", {"caseId": "case1", "status": "active", "questions": ANSWERS})
+        # Booked through cal.com, which stores the case as case_id
+        self.db.seed("appointments", "booking1", {"case_id": "case1", "start_time": "2026-09-03 10:00", "email": "a@b.c"})
+        self.db.seed("consultation", "consultation1", {"pdfUrl": "https://example.com/1.pdf", "email": "a@b.c"})
+        self.db.seed("visits", "visit1", {
+            "caseId": "case1",
+            "visitDate": "2026-09-01",
+            "questionnairesID": "questionnaire1",
+            "appointmentId": "booking1",
+            "consultationID": "consultation1",
+            "hasNewReport": True,
+        })
+        self.db.seed("visits", "visit2", {"caseId": "case1", "visitDate": "2026-10-01", "appointmentId": ""})
+        app = Flask(__name__)
+        app.register_blueprint(case_blueprint)
+        self.client = app.test_client()
+
+    def test_joins_visits_to_their_documents(self):
+        response = self.client.get("/api/cases/case1/timeline")
+
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body["case"]["title"], "Headache")
+        self.assertEqual(body["case"]["createdAt"], "2026-09-01T08:30:00")
+        self.assertEqual([v["id"] for v in body["visits"]], ["visit2", "visit1"])
+
+        visit = body["visits"][1]
+        self.assertEqual(visit["questionnaire"]["result"], {"analysis": {"conclusion": "Tension headache"}})
+        self.assertEqual(visit["appointment"]["start_time"], "2026-09-03 10:00")
+        self.assertEqual(visit["report"], {
+            "consultationId": "consultation1", "pdfUrl": "https://example.com/1.pdf", "uploadedAt": None,
+        })
+        self.assertIsNone(body["visits"][0]["questionnaire"])
+        self.assertIsNone(body["visits"][0]["report"])
+        # The case's questionnaire no visit refers to
+        self.assertEqual([q["id"] for q in body["questionnaires"]], ["questionnaire2"])
+        self.assertEqual(body["appointments"], [])
+
+    def test_reads_are_projected(self):
+        body = timeline.get_case_timeline("case1")
+
+        self.assertNotIn("history", body["case"])
+        self.assertNotIn("questions", body["visits"][1]["questionnaire"])
+        self.assertNotIn("questions", body["questionnaires"][0])
+        self.assertNotIn("email", body["visits"][1]["appointment"])
+
+    def test_one_round_of_queries_and_one_get_all_per_collection(self):
+        self.db.reset_counts()
+
+        timeline.get_case_timeline("case1")
+
+        # Visits, questionnaires and appointments by caseId and case_id
+        self.assertEqual(self.db.rpc_counts["query"], 4)
+        # The case, then the questionnaire and consultation the visit refers to
+        self.assertEqual(self.db.rpc_counts["read"], 3)
+
+    def test_missing_case(self):
+        self.assertEqual(self.client.get("/api/cases/missing/timeline").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
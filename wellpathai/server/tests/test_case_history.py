@@ -0,0 +1,151 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from fake_firestore import FakeFirestore
+from firebase_admin import firestore
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+# The server modules create their Firestore client at import time
+with patch("firebase_admin.firestore.client"):
+    from agents import gpt
+    from agents.prompt_format import count_tokens
+    from case import history
+
+ANSWERS = [{"id": "q1", "question": "What brought you here today?", "answer": "Feeling Unwell"}]
+
+
+def report(visit):
+    return {
+        "conclusion": f"Visit {visit}: recurring headaches around the temples, worse after poor sleep and long screen time.",
+        "suggestions": ["Keep a regular sleep schedule", "Take screen breaks every hour", "Keep a headache diary"],
+    }
+
+
+def history_of(visits):
+    folded = None
+    for visit in range(visits):
+        folded = history.fold(folded, f"questionnaire{visit}", report(visit), "2026-10-01")
+    return folded
+
+
+class TestFold(unittest.TestCase):
+    def test_digest_keeps_the_conclusion_and_first_suggestions(self):
+        folded = history_of(1)
+
+        self.assertEqual(
+            folded["text"],
+            "Visit on 2026-10-01: Visit 0: recurring headaches around the temples, worse after poor sleep "
+            "and long screen time. Suggested: Keep a regular sleep schedule; Take screen breaks every hour",
+        )
+        self.assertEqual(folded["omitted"], 0)
+
+    def test_stays_within_budget_as_visits_grow(self):
+        folded = history_of(200)
+
+        self.assertLessEqual(count_tokens(folded["text"]), history.CASE_HISTORY_TOKEN_BUDGET)
+        self.assertEqual(folded["omitted"] + len(folded["visits"]), 200)
+        self.assertTrue(folded["text"].startswith(f"({folded['omitted']} earlier visits not shown)"))
+        # The newest visits are the ones kept
+        self.assertEqual(folded["visits"][-1]["questionnaireId"], "questionnaire199")
+
+    def test_refolding_a_questionnaire_replaces_its_visit(self):
+        folded = history_of(2)
+        folded = history.fold(folded, "questionnaire0", {"conclusion": "Regenerated"}, "2026-10-02")
+
+        self.assertEqual([v["questionnaireId"] for v in folded["visits"]], ["questionnaire1", "questionnaire0"])
+        self.assertTrue(folded["text"].endswith("Visit on 2026-10-02: Regenerated"))
+
+    def test_prompts_stay_the_same_size_however_many_visits(self):
+        sizes = {}
+        for visits in (10, 50, 500):
+            text = history_of(visits)["text"]
+            sizes[visits] = [
+                count_tokens(gpt._next_question_prompts(ANSWERS, text)[1]),
+                count_tokens(gpt._conclusion_prompts(ANSWERS, case_history=text)[1]),
+            ]
+
+        for next_question, conclusion in sizes.values():
+            self.assertLessEqual(abs(next_question - sizes[10][0]), 5)
+            self.assertLessEqual(abs(conclusion - sizes[10][1]), 5)
+
+    def test_prompts_without_history_have_no_section(self):
+        self.assertNotIn("Earlier Visits", gpt._next_question_prompts(ANSWERS)[1])
+        self.assertIn("Earlier Visits", gpt._next_question_prompts(ANSWERS, "Visit on 2026-10-01: Migraine")[1])
+
+
+class TestStoredHistory(unittest.TestCase):
+    user_id = "user123"
+
+    def setUp(self):
+        self.db = FakeFirestore()
+        patcher = patch.object(history, "db", self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_record_conclusion_folds_into_the_case(self):
+        self.db.seed("cases", "case1", {"userId": self.user_id})
+
+        self.assertTrue(history.record_conclusion("case1", "questionnaire1", report(1)))
+        self.assertTrue(history.record_conclusion("case1", "questionnaire2", report(2)))
+
+        stored = self.db.dump("cases", "case1")["history"]
+        self.assertEqual([v["questionnaireId"] for v in stored["visits"]], ["questionnaire1", "questionnaire2"])
+        self.assertEqual(history.get_history_text("case1"), stored["text"])
+        self.assertFalse(history.record_conclusion("missing", "questionnaire1", report(1)))
+
+    def test_first_visit_comes_from_the_questionnaire_of_the_case(self):
+        self.db.seed("questionnaires", "questionnaire1", {
+            "user_id": self.user_id,
+            "createdAt": datetime(2026, 9, 30),
+            "result": {"analysis": {"conclusion": "Likely tension headache"}},
+        })
+        self.db.seed("cases", "case1", {"userId": self.user_id, "questionnaireId": "questionnaire1"})
+
+        self.assertEqual(history.get_history_text("case1"), "Visit on 2026-09-30: Likely tension headache")
+        self.assertIn("history", self.db.dump("cases", "case1"))
+
+        self.db.reset_counts()
+        history.get_history_text("case1")
+        self.assertEqual(self.db.rpc_counts["read"], 1)
+
+    def test_first_visit_backfill_is_written_with_the_transaction(self):
+        self.db.seed("questionnaires", "questionnaire1", {
+            "user_id": self.user_id,
+            "createdAt": datetime(2026, 9, 30),
+            "result": {"analysis": {"conclusion": "Likely tension headache"}},
+        })
+        self.db.seed("cases", "case1", {"userId": self.user_id, "questionnaireId": "questionnaire1"})
+        attempts = []
+
+        @firestore.transactional
+        def read(transaction):
+            text = history.get_history_text("case1", transaction=transaction)
+            self.assertNotIn("history", self.db.dump("cases", "case1"))
+            attempts.append(text)
+            if len(attempts) == 1:
+                # Another writer changes the case before the first attempt commits
+                self.db.collection("cases").document("case1").update({"title": "Headache"})
+            return text
+
+        self.assertEqual(read(self.db.transaction()), "Visit on 2026-09-30: Likely tension headache")
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(self.db.dump("cases", "case1")["history"]["text"], "Visit on 2026-09-30: Likely tension headache")
+        self.assertEqual(self.db.dump("cases", "case1")["title"], "Headache")
+
+    def test_case_without_visits_has_no_history(self):
+        self.db.seed("cases", "case1", {"userId": self.user_id})
+
+        self.assertIsNone(history.get_history_text("case1"))
+        self.assertIsNone(history.get_history_text("missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from agents import cassette, client, gpt, resilience
+from loadtest.fake_openai import FakeOpenAIServer
+
+QUESTIONS = [{"id": "q1", "question": "What brings you here today?", "answer": "Feeling Unwell"}]
+OTHER_QUESTIONS = [{"id": "q1", "question": "What brings you here today?", "answer": "General Health Advice"}]
+
+
+class TestCassette(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeOpenAIServer(stream_interval=0).start()
+        self.addCleanup(self.server.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for patcher in (
+            patch.object(client, "BASE_URL", self.server.base_url),
+            patch.object(client, "MAX_RETRIES", 0),
+            patch.object(client, "_client", None),
+            patch.object(cassette, "CASSETTE_DIR", self.directory),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(gpt, "client", client.get_client())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cassette.reset()
+        self.addCleanup(cassette.reset)
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+
+    def mode(self, mode):
+        patcher = patch.object(cassette, "MODE", mode)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_replays_recorded_replies_without_requests(self):
+        self.mode(cassette.RECORD)
+        question = gpt.generate_next_question(QUESTIONS)
+        conclusion = gpt.generate_conclusion(QUESTIONS)
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, "next_question"))), 1)
+
+        self.mode(cassette.REPLAY)
+        self.assertEqual(gpt.generate_next_question(QUESTIONS), question)
+        self.assertEqual(gpt.generate_conclusion(QUESTIONS), conclusion)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_other_prompts_get_the_recordings_in_turn(self):
+        self.mode(cassette.RECORD)
+        recorded = [gpt.generate_next_question(QUESTIONS), gpt.generate_next_question(OTHER_QUESTIONS)]
+
+        self.mode(cassette.REPLAY)
+        unseen = [{"id": "q1", "question": "What brings you here today?", "answer": str(i)} for i in range(4)]
+        replayed = [gpt.generate_next_question(questions) for questions in unseen]
+
+        self.assertEqual(self.server.requests, 2)
+        self.assertCountEqual(replayed[:2], recorded)
+        self.assertEqual(replayed[2:], replayed[:2])
+
+    def test_replay_without_recordings_fails(self):
+        self.mode(cassette.REPLAY)
+        with self.assertRaises(cassette.CassetteMiss):
+            gpt.generate_conclusion(QUESTIONS)
+        self.assertEqual(self.server.requests, 0)
+
+    def test_streamed_questions_are_recorded_and_replayed(self):
+        self.mode(cassette.RECORD)
+        recorded = list(gpt.stream_next_question(QUESTIONS))
+
+        self.mode(cassette.REPLAY)
+        replayed = list(gpt.stream_next_question(QUESTIONS))
+
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(replayed[-1], recorded[-1])
+        self.assertEqual(
+            "".join(text for kind, text in replayed if kind == "token"),
+            recorded[-1][1]["question"],
+        )
+
+    def test_off_by_default(self):
+        self.mode(cassette.OFF)
+        gpt.generate_next_question(QUESTIONS)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from flask import Flask
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+with patch("firebase_admin.firestore.client"):
+    from questionnaire import jobs, questionnaire
+    from questionnaire.questionnaire_api import questionnaire_blueprint
+
+
+SUCCESS = {"status": "success", "message": "Conclusion recorded successfully", "result": {"conclusion": "Rest"}}
+
+
+class JobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.store = jobs.JobStore(os.path.join(self.tmp, "jobs.sqlite3"))
+
+    def make_queue(self, workers=2):
+        queue = jobs.ConclusionJobQueue(self.store, workers=workers)
+        self.addCleanup(queue._executor.shutdown)
+        return queue
+
+
+class TestConclusionJobQueue(JobTestCase):
+    def test_job_runs_and_stores_result(self):
+        queue = self.make_queue()
+        with patch.object(questionnaire, "record_gpt_conclusion", return_value=SUCCESS) as mock_conclusion:
+            job = queue.submit("qn1", "user1")
+            self.assertEqual(job["status"], jobs.QUEUED)
+            finished = queue.wait(job["id"], timeout=5)
+
+        mock_conclusion.assert_called_once_with("qn1", "user1")
+        self.assertEqual(finished["status"], jobs.SUCCEEDED)
+        self.assertEqual(jobs.job_response(finished)["result"], SUCCESS)
+
+    def test_failed_conclusion_fails_the_job(self):
+        queue = self.make_queue()
+        error = {"status": "error", "error": "Unknown response format"}
+        with patch.object(questionnaire, "record_gpt_conclusion", return_value=error):
+            finished = queue.wait(queue.submit("qn1", "user1")["id"], timeout=5)
+
+        self.assertEqual(finished["status"], jobs.FAILED)
+        self.assertEqual(jobs.job_response(finished)["error"], "Unknown response format")
+
+    def test_active_job_is_reused(self):
+        queue = self.make_queue()
+        release = threading.Event()
+
+        def slow_conclusion(questionnaire_id, user_id):
+            release.wait(5)
+            return SUCCESS
+
+        with patch.object(questionnaire, "record_gpt_conclusion", side_effect=slow_conclusion) as mock_conclusion:
+            first = queue.submit("qn1", "user1")
+            second = queue.submit("qn1", "user1")
+            release.set()
+            queue.wait(first["id"], timeout=5)
+
+        self.assertEqual(first["id"], second["id"])
+        mock_conclusion.assert_called_once()
+
+    def test_queued_and_stale_jobs_resume_after_restart(self):
+        queued, _ = self.store.create("qn1", "user1")
+        stale, _ = self.store.create("qn2", "user1")
+        self.store.claim(stale["id"])
+
+        # A new store on the same file, as after a restart
+        self.store = jobs.JobStore(self.store.path)
+        queue = self.make_queue()
+        with patch.object(jobs, "JOB_LEASE_SECONDS", -1), \
+                patch.object(questionnaire, "record_gpt_conclusion", return_value=SUCCESS):
+            self.assertEqual(queue.resume(), 2)
+            results = [queue.wait(job["id"], timeout=5) for job in (queued, stale)]
+
+        self.assertEqual([job["status"] for job in results], [jobs.SUCCEEDED, jobs.SUCCEEDED])
+
+    def test_job_running_at_a_restart_within_its_lease_is_run_again(self):
+        running, _ = self.store.create("qn1", "user1")
+        self.store.claim(running["id"])
+
+        # Restarted before the lease ran out, so the job is still assumed to be running
+        self.store = jobs.JobStore(self.store.path)
+        queue = self.make_queue()
+        self.assertEqual(queue.resume(), 0)
+        self.assertEqual(queue.submit("qn1", "user1")["status"], jobs.RUNNING)
+
+        with patch.object(jobs, "JOB_LEASE_SECONDS", -1), \
+                patch.object(questionnaire, "record_gpt_conclusion", return_value=SUCCESS) as mock_conclusion:
+            resubmitted = queue.submit("qn1", "user1")
+            finished = queue.wait(running["id"], timeout=5)
+
+        self.assertEqual(resubmitted["id"], running["id"])
+        self.assertEqual(finished["status"], jobs.SUCCEEDED)
+        self.assertEqual(finished["attempts"], 2)
+        mock_conclusion.assert_called_once_with("qn1", "user1")
+
+    def test_waiting_on_a_lost_job_runs_it_again(self):
+        running, _ = self.store.create("qn1", "user1")
+        self.store.claim(running["id"])
+        queue = self.make_queue()
+
+        with patch.object(jobs, "JOB_LEASE_SECONDS", -1), \
+                patch.object(questionnaire, "record_gpt_conclusion", return_value=SUCCESS):
+            finished = queue.wait(running["id"], timeout=5)
+
+        self.assertEqual(finished["status"], jobs.SUCCEEDED)
+
+
+class TestConclusionJobRoutes(JobTestCase):
+    def setUp(self):
+        super().setUp()
+        queue = self.make_queue()
+        patcher = patch.object(jobs, "_queue", queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        app = Flask(__name__)
+        app.register_blueprint(questionnaire_blueprint)
+        self.client = app.test_client()
+
+    def test_submit_then_long_poll(self):
+        with patch.object(questionnaire, "record_gpt_conclusion", return_value=SUCCESS):
+            response = self.client.post(
+                "/api/questionnaire/generate-result/jobs",
+                json={"questionnaire_id": "qn1", "user_id": "user1"},
+            )
+            self.assertEqual(response.status_code, 202)
+            job_id = response.get_json()["job_id"]
+
+            response = self.client.get(
+                f"/api/questionnaire/generate-result/jobs/{job_id}?user_id=user1&wait=5"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["status"], jobs.SUCCEEDED)
+        self.assertEqual(response.get_json()["result"], SUCCESS)
+
+    def test_stats_route_is_admin_only(self):
+        self.assertEqual(self.client.get("/api/questionnaire/generate-result/job-stats").status_code, 401)
+
+        with patch("utils.auth.auth.verify_id_token", return_value={"isAdmin": True}):
+            response = self.client.get(
+                "/api/questionnaire/generate-result/job-stats", headers={"Authorization": "Bearer token"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["workers"], 2)
+
+    def test_other_users_job_is_not_found(self):
+        job, _ = self.store.create("qn1", "user1")
+
+        response = self.client.get(f"/api/questionnaire/generate-result/jobs/{job['id']}?user_id=user2")
+
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from agents import client, gpt, resilience, router
+from loadtest.fake_openai import FakeOpenAIServer, latency_sampler
+
+QUESTIONS = [{"id": "q1", "question": "What brings you here today?", "answer": "General Health Advice"}]
+
+
+class TestAsyncClient(unittest.TestCase):
+    latency = 0.3
+
+    def setUp(self):
+        self.server = FakeOpenAIServer(latency=self.latency).start()
+        self.addCleanup(self.server.stop)
+        for patcher in (
+            patch.object(client, "BASE_URL", self.server.base_url),
+            patch.object(client, "MAX_RETRIES", 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_calls_run_concurrently_on_one_loop(self):
+        async def run():
+            return await asyncio.gather(*(gpt.agenerate_next_question(QUESTIONS) for _ in range(10)))
+
+        started = time.perf_counter()
+        results = asyncio.run(run())
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(self.server.requests, 10)
+        self.assertTrue(all("question" in result for result in results))
+        # Sequential calls would take 10 x latency
+        self.assertLess(elapsed, self.latency * 4)
+
+    def test_client_is_shared_within_a_loop(self):
+        async def clients():
+            return client.get_async_client(), client.get_async_client()
+
+        first, second = asyncio.run(clients())
+        self.assertIs(first, second)
+
+    def test_call_type_timeout_applies(self):
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+        with patch.object(router.router.get_route("next_question"), "timeout", 0.05), \
+                patch.object(resilience, "MAX_RETRIES", 0):
+            result = asyncio.run(gpt.agenerate_next_question(QUESTIONS))
+
+        # The timed out call is answered with a degraded question
+        self.assertTrue(result["degraded"])
+        self.assertEqual(self.server.requests, 1)
+
+
+class TestFakeServer(unittest.TestCase):
+    def start(self, **kwargs):
+        server = FakeOpenAIServer(**kwargs).start()
+        self.addCleanup(server.stop)
+        for patcher in (
+            patch.object(client, "BASE_URL", server.base_url),
+            patch.object(client, "MAX_RETRIES", 0),
+            patch.object(client, "_client", None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # A sync client of its own, pointed at this server
+        patcher = patch.object(gpt, "client", client.get_client())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+        return server
+
+    def test_replies_match_the_call_type(self):
+        server = self.start()
+
+        question = gpt.generate_next_question(QUESTIONS)
+        conclusion = gpt.generate_conclusion(QUESTIONS)
+        title = gpt.generate_case_title(QUESTIONS)
+
+        self.assertIn("question", question)
+        self.assertEqual(len(conclusion["otc_medications"]), 2)
+        self.assertEqual(title[1], "Tension Headache")
+        self.assertEqual(server.counts, {"next_question": 1, "conclusion": 1, "case_title": 1})
+
+    def test_streams_the_reply(self):
+        self.start(stream_interval=0)
+
+        events = list(gpt.stream_next_question(QUESTIONS))
+
+        tokens = "".join(text for kind, text in events if kind == "token")
+        self.assertGreater(len([kind for kind, _ in events if kind == "token"]), 1)
+        self.assertEqual(events[-1], ("question", {
+            "question": tokens, "type": "choice", "options": ["Good", "Fair", "Poor"],
+        }))
+
+    def test_injected_errors_are_retried_then_degraded(self):
+        server = self.start(error_rate=1.0, error_status=429)
+
+        with patch.object(resilience, "MAX_RETRIES", 1), patch.object(resilience, "BACKOFF_BASE_SECONDS", 0):
+            result = gpt.generate_next_question(QUESTIONS)
+
+        self.assertTrue(result["degraded"])
+        self.assertEqual(server.counts, {"error_429": 2})
+
+    def test_latency_distributions(self):
+        self.assertEqual(latency_sampler(0.25)(), 0.25)
+        self.assertEqual(latency_sampler("fixed:0.5")(), 0.5)
+        uniform = [latency_sampler("uniform:0.1,0.2")() for _ in range(100)]
+        self.assertTrue(all(0.1 <= value <= 0.2 for value in uniform))
+        # Never negative, even when the normal distribution would be
+        self.assertTrue(all(latency_sampler("normal:0,1")() >= 0 for _ in range(100)))
+        self.assertGreater(latency_sampler("lognormal:-1,0.5")(), 0)
+        with self.assertRaises(ValueError):
+            latency_sampler("pareto:1")
+
+
+if __name__ == "__main__":
+    unittest.main()
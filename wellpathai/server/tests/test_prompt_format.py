@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from agents import prompt_format
+
+
+class TestFormatAnswers(unittest.TestCase):
+    def setUp(self):
+        # Count with the length estimate so results don't depend on a downloaded encoding
+        patcher = patch.object(prompt_format, "_get_encoding", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_question_and_answer_are_kept(self):
+        questions = [
+            {"id": "q1", "question": "What brings you here?", "type": "choice",
+             "options": ["General Health Advice", "Feeling Unwell"], "initialized": True,
+             "answer": "Feeling Unwell"},
+            {"id": "q2b", "question": "Which case?", "type": "choice", "options": ["Headache"],
+             "case_ids": ["case123"], "answer": "Headache"},
+            {"id": "q3", "question": "Symptoms?", "type": "multiselect", "answer": ["Cough", "Fever"]},
+            {"id": "q4", "question": "Not answered yet", "type": "text", "placeholder": "..."},
+        ]
+
+        text = prompt_format.format_answers(questions, "next_question")
+
+        self.assertEqual(
+            text,
+            "Q: What brings you here?\nA: Feeling Unwell\n"
+            "Q: Which case?\nA: Headache\n"
+            "Q: Symptoms?\nA: Cough, Fever",
+        )
+
+    def test_long_answers_are_trimmed_per_call_type(self):
+        long_answer = "word " * 500
+        questions = [{"question": "Describe it", "answer": long_answer}]
+
+        with patch.dict(prompt_format.ANSWER_TOKEN_LIMITS, {"case_title": 20}):
+            text = prompt_format.format_answers(questions, "case_title")
+
+        answer = text.split("A: ", 1)[1]
+        self.assertTrue(answer.endswith(prompt_format.TRIM_MARKER))
+        self.assertLessEqual(prompt_format.count_tokens(answer), 20)
+
+    def test_budget_lowers_answer_limit(self):
+        questions = [{"question": f"Question {i}", "answer": "detail " * 100} for i in range(10)]
+
+        with patch.dict(prompt_format.PROMPT_TOKEN_BUDGETS, {"conclusion": 400}):
+            text = prompt_format.format_answers(questions, "conclusion")
+
+        self.assertLessEqual(prompt_format.count_tokens(text), 400)
+        self.assertEqual(text.count("Q: "), 10)
+
+    def test_non_list_input_passes_through(self):
+        self.assertEqual(prompt_format.format_answers((False, "Not found"), "conclusion"), "(False, 'Not found')")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,721 @@
+import os
+import sys
+import json
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from flask import Flask
+from fake_firestore import FakeFirestore
+
+# agents.gpt builds its OpenAI client at import time; no request is ever sent
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+# The server modules create their Firestore client at import time
+with patch("firebase_admin.firestore.client"):
+    from agents import gpt
+    from case import history
+    from questionnaire import prefetch, questionnaire, session, storage, templates
+    from questionnaire import questionnaire_api
+    from questionnaire.questionnaire_api import questionnaire_blueprint
+    from utils import data_utils, metrics, single_flight
+
+
+class QuestionnaireTestCase(unittest.TestCase):
+    user_id = "user123"
+
+    def setUp(self):
+        self.db = FakeFirestore()
+        patchers = [
+            patch.object(questionnaire, "db", self.db),
+            patch.object(session, "db", self.db),
+            patch.object(data_utils, "db", self.db),
+            patch.object(history, "db", self.db),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.questionnaire_id = questionnaire.initialize_questionnaire_database(self.user_id)
+
+    def answer(self, question_id, answer):
+        return questionnaire.record_answer_to_question(
+            self.questionnaire_id, self.user_id, question_id, answer
+        )
+
+    def stored(self, questionnaire_id=None):
+        """The stored questionnaire in list shape, whatever its storage mode"""
+        data = self.db.dump("questionnaires", questionnaire_id or self.questionnaire_id)
+        return storage.to_list_shape(data)
+
+
+class TestRecordAnswerRoundTrips(QuestionnaireTestCase):
+    """Each answer should cost one document read and one document write"""
+
+    def assert_single_round_trip(self):
+        self.assertEqual(self.db.rpc_counts["read"], 1)
+        self.assertEqual(self.db.rpc_counts["write"], 1)
+
+    def test_q1_general_health(self):
+        self.db.reset_counts()
+        self.assertEqual(self.answer("q1", "General Health Advice")[0], True)
+        self.assert_single_round_trip()
+
+        data = self.stored()
+        self.assertEqual(data["currentPath"], "generalHealth")
+        self.assertNotIn("generalDemographicQuestions", data)
+        self.assertNotIn("feelingUnwellQuestions", data)
+        self.assertEqual(data["questions"][2]["id"], "q3")
+
+    def test_q1_feeling_unwell(self):
+        self.db.reset_counts()
+        self.answer("q1", "Feeling Unwell")
+        self.assert_single_round_trip()
+        self.assertEqual(self.stored()["currentPath"], "feelingUnwell")
+
+    def test_q2_no(self):
+        self.answer("q1", "Feeling Unwell")
+        self.db.reset_counts()
+        self.answer("q2", "No")
+        self.assert_single_round_trip()
+
+        data = self.stored()
+        self.assertTrue(data["caseSelectionMade"])
+        self.assertEqual(data["selectedAction"], "create_new")
+
+    def test_q2_yes_without_cases(self):
+        self.answer("q1", "Feeling Unwell")
+        self.db.reset_counts()
+        self.answer("q2", "Yes")
+        self.assert_single_round_trip()
+        self.assertEqual(self.db.rpc_counts["query"], 1)
+        self.assertEqual(self.stored()["selectedAction"], "create_new")
+
+    def test_q2_yes_then_q2b(self):
+        self.db.seed("cases", "case1", {"userId": self.user_id, "title": "Migraine"})
+        self.answer("q1", "Feeling Unwell")
+
+        self.db.reset_counts()
+        self.answer("q2", "Yes")
+        self.assert_single_round_trip()
+        data = self.stored()
+        self.assertEqual(data["selectedAction"], "select_existing")
+        self.assertEqual(data["questions"][2]["id"], "q2b")
+
+        self.db.reset_counts()
+        self.answer("q2b", "1. Migraine")
+        # Plus one read of the selected case for its history, copied onto the questionnaire
+        self.assertEqual(self.db.rpc_counts["read"], 2)
+        self.assertEqual(self.db.rpc_counts["write"], 1)
+        data = self.stored()
+        self.assertTrue(data["caseSelectionMade"])
+        self.assertEqual(data["selectedCaseId"], "case1")
+        self.assertIsNone(data["caseHistory"])
+
+    def test_plain_answer(self):
+        self.answer("q1", "General Health Advice")
+        self.db.reset_counts()
+        self.answer("q3", "34")
+        self.assert_single_round_trip()
+        self.assertEqual(self.stored()["questions"][2]["answer"], "34")
+
+
+class TestQuestionTemplates(QuestionnaireTestCase):
+    def test_initialize_stores_template_version_only(self):
+        data = self.stored()
+        self.assertEqual(data["templateVersion"], templates.CURRENT_TEMPLATE_VERSION)
+        self.assertEqual([q["id"] for q in data["questions"]], ["q1", "q2"])
+        for field in questionnaire.LEGACY_BANK_FIELDS.values():
+            self.assertNotIn(field, data)
+
+    def test_q1_adds_banks_from_registry(self):
+        self.answer("q1", "Feeling Unwell")
+        questions = self.stored()["questions"]
+        expected = templates.get_question_bank("generalDemographic") + templates.get_question_bank(
+            "feelingUnwell"
+        )
+        self.assertEqual(questions[2:], expected)
+
+        # Answering q1 again must not add the banks a second time
+        self.answer("q1", "Feeling Unwell")
+        self.assertEqual(len(self.stored()["questions"]), len(questions))
+
+    def test_registry_returns_copies(self):
+        bank = templates.get_question_bank("generalHealth")
+        bank[0]["answer"] = "None"
+        self.assertNotIn("answer", templates.get_question_bank("generalHealth")[0])
+
+    def test_legacy_questionnaire_uses_stored_banks(self):
+        legacy_health = [{"id": "q7", "question": "Legacy question?", "type": "text", "initialized": True}]
+        self.db.seed(
+            "questionnaires",
+            "legacy",
+            {
+                "user_id": self.user_id,
+                "questions": templates.get_question_bank("initial"),
+                "generalDemographicQuestions": [],
+                "generalHealthQuestions": legacy_health,
+                "feelingUnwellQuestions": [],
+                "currentPath": None,
+            },
+        )
+
+        questionnaire.record_answer_to_question("legacy", self.user_id, "q1", "General Health Advice")
+
+        data = self.stored("legacy")
+        self.assertEqual(data["questions"][2:], legacy_health)
+        for field in questionnaire.LEGACY_BANK_FIELDS.values():
+            self.assertNotIn(field, data)
+
+
+class TestEntriesStorage(QuestionnaireTestCase):
+    def last_update_fields(self):
+        return set(self.db.update_log[-1][1])
+
+    def test_answer_writes_only_its_entry(self):
+        self.answer("q1", "General Health Advice")
+        self.db.reset_counts()
+
+        self.answer("q3", "34")
+
+        fields = self.last_update_fields()
+        self.assertIn("questionEntries.q3.answer", fields)
+        self.assertNotIn("questions", fields)
+        self.assertFalse(any(f.startswith("questionEntries.q4") for f in fields))
+
+    def test_inserted_question_keeps_its_position(self):
+        self.db.seed("cases", "case1", {"userId": self.user_id, "title": "Migraine"})
+        self.answer("q1", "Feeling Unwell")
+        self.answer("q2", "Yes")
+
+        entries = self.db.dump("questionnaires", self.questionnaire_id)["questionEntries"]
+        self.assertLess(entries["q2"]["order"], entries["q2b"]["order"])
+        self.assertLess(entries["q2b"]["order"], entries["q3"]["order"])
+        self.assertEqual([q["id"] for q in self.stored()["questions"][:4]], ["q1", "q2", "q2b", "q3"])
+
+    def test_concurrent_answers_to_different_questions_are_kept(self):
+        self.answer("q1", "General Health Advice")
+        first, _ = session.QuestionnaireSession.load(self.questionnaire_id, self.user_id)
+        second, _ = session.QuestionnaireSession.load(self.questionnaire_id, self.user_id)
+
+        questionnaire.record_answer_to_question(self.questionnaire_id, self.user_id, "q3", "34", session=first)
+        questionnaire.record_answer_to_question(self.questionnaire_id, self.user_id, "q5", "6 feet", session=second)
+        first.commit()
+        second.commit()
+
+        answers = {q["id"]: q.get("answer") for q in self.stored()["questions"]}
+        self.assertEqual(answers["q3"], "34")
+        self.assertEqual(answers["q5"], "6 feet")
+
+    def test_list_documents_migrate(self):
+        questions = templates.get_question_bank("initial")
+        self.db.seed("questionnaires", "old", {"user_id": self.user_id, "questions": questions})
+
+        self.assertEqual(questionnaire.migrate_questionnaire_storage("old")[0], True)
+        self.assertEqual(questionnaire.migrate_questionnaire_storage("old")[0], False)
+
+        data = self.db.dump("questionnaires", "old")
+        self.assertEqual(data["storageMode"], storage.ENTRIES_MODE)
+        self.assertNotIn("questions", data)
+        self.assertEqual(self.stored("old")["questions"], questions)
+        self.assertEqual(questionnaire.get_result_by_id("old")["questions"], questions)
+
+    def test_migrate_route_is_admin_only(self):
+        self.db.seed("questionnaires", "old", {"user_id": self.user_id, "questions": templates.get_question_bank("initial")})
+        app = Flask(__name__)
+        app.register_blueprint(questionnaire_blueprint)
+        client = app.test_client()
+
+        self.assertEqual(client.post("/api/questionnaire/migrate-storage", json={"all": True}).status_code, 401)
+        with patch("utils.auth.auth.verify_id_token", return_value={"isAdmin": False}):
+            response = client.post(
+                "/api/questionnaire/migrate-storage", json={"all": True}, headers={"Authorization": "Bearer token"}
+            )
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("questions", self.db.dump("questionnaires", "old"))
+
+        with patch("utils.auth.auth.verify_id_token", return_value={"isAdmin": True}):
+            response = client.post(
+                "/api/questionnaire/migrate-storage",
+                json={"questionnaire_id": "old"},
+                headers={"Authorization": "Bearer token"},
+            )
+        self.assertEqual(response.get_json()["migrated"], 1)
+
+
+class TestConclusionMemoization(QuestionnaireTestCase):
+    conclusion = {"conclusion": "Likely tension headache", "suggestions": ["Rest"]}
+
+    def setUp(self):
+        super().setUp()
+        self.answer("q1", "General Health Advice")
+        self.answer("q2", "No")
+
+    def conclude(self, **kwargs):
+        return questionnaire.record_gpt_conclusion(self.questionnaire_id, self.user_id, **kwargs)
+
+    def test_unchanged_answers_reuse_stored_result(self):
+        with patch.object(gpt, "generate_conclusion", return_value=dict(self.conclusion)) as mock_gpt:
+            first = self.conclude()
+            second = self.conclude()
+
+        mock_gpt.assert_called_once()
+        self.assertEqual(first["result"], self.conclusion)
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["result"], self.conclusion)
+
+    def test_changed_answers_or_force_regenerate(self):
+        with patch.object(gpt, "generate_conclusion", return_value=dict(self.conclusion)) as mock_gpt:
+            self.conclude()
+            self.answer("q3", "  25 ")
+            self.assertNotIn("cached", self.conclude())
+            self.assertNotIn("cached", self.conclude(force=True))
+
+        self.assertEqual(mock_gpt.call_count, 3)
+
+    def test_conclusion_reads_and_writes_the_questionnaire_once(self):
+        self.db.reset_counts()
+        with patch.object(gpt, "generate_conclusion", return_value=dict(self.conclusion)):
+            self.conclude()
+
+        self.assertEqual(self.db.rpc_counts["read"], 1)
+        self.assertEqual(self.db.rpc_counts["write"], 1)
+        self.assertEqual(self.stored()["result"]["analysis"], self.conclusion)
+
+    def test_new_case_conclusion_titles_the_case(self):
+        with patch.object(gpt, "generate_conclusion", return_value=dict(self.conclusion)) as mock_gpt:
+            self.conclude()
+        self.assertEqual(self.stored()["selectedAction"], "create_new")
+        self.assertTrue(mock_gpt.call_args.kwargs["include_case_title"])
+
+        with patch.object(questionnaire, "CONCLUSION_CASE_TITLE", False), \
+                patch.object(gpt, "generate_conclusion", return_value=dict(self.conclusion)) as mock_gpt:
+            self.conclude(force=True)
+        self.assertFalse(mock_gpt.call_args.kwargs["include_case_title"])
+
+    def test_existing_case_conclusion_uses_and_updates_its_history(self):
+        self.db.seed("cases", "case1", {
+            "userId": self.user_id,
+            "title": "Migraine",
+            "history": history.fold(None, "earlier", {"conclusion": "Migraine with aura"}, "2026-01-05"),
+        })
+        questionnaire_id = questionnaire.initialize_questionnaire_database(self.user_id)
+        for question_id, answer in (("q1", "General Health Advice"), ("q2", "Yes"), ("q2b", "1. Migraine")):
+            questionnaire.record_answer_to_question(questionnaire_id, self.user_id, question_id, answer)
+
+        with patch.object(gpt, "generate_conclusion", return_value=dict(self.conclusion)) as mock_gpt:
+            questionnaire.record_gpt_conclusion(questionnaire_id, self.user_id)
+
+        self.assertIn("Migraine with aura", mock_gpt.call_args.kwargs["case_history"])
+        self.assertFalse(mock_gpt.call_args.kwargs["include_case_title"])
+        visits = self.db.dump("cases", "case1")["history"]["visits"]
+        self.assertEqual([v["questionnaireId"] for v in visits], ["earlier", questionnaire_id])
+
+    def test_hash_ignores_whitespace_and_option_order(self):
+        questions = [{"question": "Symptoms?", "answer": ["Cough", "Fever"]}]
+        same = [{"question": "Symptoms? ", "answer": ["Fever", " Cough"]}]
+        self.assertEqual(
+            questionnaire.conclusion_content_hash(questions),
+            questionnaire.conclusion_content_hash(same),
+        )
+
+
+class TestRecordAnswerRoute(QuestionnaireTestCase):
+    """One /record-answer request should read and write the questionnaire once"""
+
+    def setUp(self):
+        super().setUp()
+        app = Flask(__name__)
+        app.register_blueprint(questionnaire_blueprint)
+        self.client = app.test_client()
+
+    def post_answer(self, question_id, answer):
+        return self.client.post(
+            "/api/questionnaire/record-answer",
+            json={
+                "questionnaire_id": self.questionnaire_id,
+                "user_id": self.user_id,
+                "question_id": question_id,
+                "answer": answer,
+            },
+        )
+
+    def answer_all_predefined(self):
+        data = self.stored()
+        for question in data["questions"]:
+            if "answer" not in question:
+                self.answer(question["id"], question.get("options", ["text"])[0])
+
+    def test_predefined_question_path(self):
+        self.answer("q1", "General Health Advice")
+        self.db.reset_counts()
+
+        response = self.post_answer("q2", "No")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["next_question"]["id"], "q3")
+        self.assertEqual(self.db.rpc_counts["read"], 1)
+        self.assertEqual(self.db.rpc_counts["write"], 1)
+
+    def test_gpt_question_path(self):
+        self.answer("q1", "General Health Advice")
+        self.answer("q2", "No")
+        self.answer_all_predefined()
+        last = self.stored()["questions"][-1]
+        self.db.reset_counts()
+
+        generated = {"question": "How is your sleep?", "type": "text"}
+        with patch.object(gpt, "generate_next_question", return_value=dict(generated)) as mock_gpt:
+            response = self.post_answer(last["id"], last["answer"])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["next_question"]["question"], "How is your sleep?")
+        mock_gpt.assert_called_once()
+        # One transaction records the answer, a second appends the generated question
+        self.assertEqual(self.db.rpc_counts["read"], 2)
+        self.assertEqual(self.db.rpc_counts["write"], 2)
+
+        questions = self.stored()["questions"]
+        self.assertEqual(questions[-1]["question"], "How is your sleep?")
+        self.assertEqual(questions[-1]["id"], f"q{len(questions)}")
+
+
+def stream_chunks(text, size=3):
+    """Fake streamed chat completion chunks carrying `text` a few characters at a time"""
+    return [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + size]))])
+        for i in range(0, len(text), size)
+    ]
+
+
+def parse_events(body):
+    """Split a text/event-stream body into (event, data) pairs"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class TestQuestionTextExtractor(unittest.TestCase):
+    def test_extracts_question_across_chunks(self):
+        reply = '```json\n{"question": "Any \\"chest\\" pain?\\nSince when \\u00e9", "type": "text", "options": []}\n```'
+        extractor = gpt.QuestionTextExtractor()
+        text = "".join(extractor.feed(reply[i]) for i in range(len(reply)))
+
+        self.assertEqual(text, 'Any "chest" pain?\nSince when \u00e9')
+        self.assertEqual(gpt._parse_next_question(extractor.buffer)["question"], text)
+
+
+class TestRecordAnswerStreamRoute(TestRecordAnswerRoute):
+    def post_stream(self, question_id, answer):
+        response = self.client.post(
+            "/api/questionnaire/record-answer/stream",
+            json={
+                "questionnaire_id": self.questionnaire_id,
+                "user_id": self.user_id,
+                "question_id": question_id,
+                "answer": answer,
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        return parse_events(response.get_data(as_text=True))
+
+    def test_predefined_question_is_one_event(self):
+        self.answer("q1", "General Health Advice")
+
+        events = self.post_stream("q2", "No")
+
+        self.assertEqual([event for event, _ in events], ["question"])
+        self.assertEqual(events[0][1]["next_question"]["id"], "q3")
+
+    def test_generated_question_streams_tokens(self):
+        self.answer("q1", "General Health Advice")
+        self.answer("q2", "No")
+        self.answer_all_predefined()
+        last = self.stored()["questions"][-1]
+
+        reply = json.dumps({"question": "How is your sleep?", "type": "choice", "options": ["Good", "Poor"]})
+        with patch.object(gpt.client.chat.completions, "create", return_value=stream_chunks(reply)) as mock_create:
+            events = self.post_stream(last["id"], last["answer"])
+
+        self.assertTrue(mock_create.call_args.kwargs["stream"])
+        tokens = [data["text"] for event, data in events if event == "token"]
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual("".join(tokens), "How is your sleep?")
+
+        event, final = events[-1]
+        self.assertEqual(event, "question")
+        self.assertEqual(final["next_question"]["type"], "choice")
+        self.assertEqual(final["next_question"]["options"], ["Good", "Poor"])
+        self.assertEqual(self.stored()["questions"][-1]["id"], final["next_question"]["id"])
+
+    def test_unknown_questionnaire_sends_error_event(self):
+        self.questionnaire_id = "missing"
+
+        events = self.post_stream("q1", "General Health Advice")
+
+        self.assertEqual(events, [("error", {"error": "Questionnaire not found"})])
+
+
+class TestRequestDeduplication(QuestionnaireTestCase):
+    generated = {"question": "How is your sleep?", "type": "text"}
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        questionnaire_api._idempotency_cache.clear()
+        self.addCleanup(questionnaire_api._idempotency_cache.clear)
+        app = Flask(__name__)
+        app.register_blueprint(questionnaire_blueprint)
+        self.app = app
+
+        self.answer("q1", "General Health Advice")
+        self.answer("q2", "No")
+        for question in self.stored()["questions"]:
+            if "answer" not in question:
+                self.answer(question["id"], question.get("options", ["text"])[0])
+        self.last = self.stored()["questions"][-1]
+
+    def post_answer(self, headers=None, answer=None):
+        return self.app.test_client().post(
+            "/api/questionnaire/record-answer",
+            json={
+                "questionnaire_id": self.questionnaire_id,
+                "user_id": self.user_id,
+                "question_id": self.last["id"],
+                "answer": answer or self.last["answer"],
+            },
+            headers=headers or {},
+        )
+
+    def test_concurrent_duplicates_share_one_gpt_call(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_generate(questions, case_history=None):
+            started.set()
+            release.wait(5)
+            return dict(self.generated)
+
+        responses = []
+        with patch.object(gpt, "generate_next_question", side_effect=slow_generate) as mock_gpt:
+            threads = [threading.Thread(target=lambda: responses.append(self.post_answer())) for _ in range(5)]
+            threads[0].start()
+            started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            # Give the duplicates time to join the in-flight call
+            deadline = time.monotonic() + 5
+            while metrics.get_counter("single_flight_total", operation="questionnaire", outcome="shared") < 4:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        mock_gpt.assert_called_once()
+        ids = {response.get_json()["next_question"]["id"] for response in responses}
+        self.assertEqual(len(ids), 1)
+
+    def test_idempotency_key_replays_response(self):
+        headers = {"Idempotency-Key": "retry-1"}
+        with patch.object(gpt, "generate_next_question", return_value=dict(self.generated)) as mock_gpt:
+            first = self.post_answer(headers)
+            self.db.reset_counts()
+            retry = self.post_answer(headers)
+
+        mock_gpt.assert_called_once()
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(self.db.rpc_counts["read"], 0)
+
+    def test_idempotency_key_reused_for_other_request_is_rejected(self):
+        headers = {"Idempotency-Key": "retry-1"}
+        with patch.object(gpt, "generate_next_question", return_value=dict(self.generated)):
+            self.post_answer(headers)
+            response = self.post_answer(headers, answer="Something else")
+
+        self.assertEqual(response.status_code, 422)
+
+    def test_idempotency_key_reused_on_another_questionnaire_is_rejected(self):
+        other_id = questionnaire.initialize_questionnaire_database(self.user_id)
+        conclusion = {"conclusion": "Likely tension headache", "suggestions": ["Rest"]}
+        headers = {"Idempotency-Key": "conclude-1"}
+
+        def conclude(questionnaire_id):
+            return self.app.test_client().post(
+                "/api/questionnaire/generate-result",
+                json={"questionnaire_id": questionnaire_id, "user_id": self.user_id},
+                headers=headers,
+            )
+
+        with patch.object(gpt, "generate_conclusion", return_value=dict(conclusion)):
+            self.assertEqual(conclude(self.questionnaire_id).status_code, 200)
+            response = conclude(other_id)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertNotIn("Idempotent-Replayed", response.headers)
+
+    def test_single_flight_shares_errors(self):
+        flight = single_flight.SingleFlight("test")
+        release = threading.Event()
+        errors = []
+
+        def fail():
+            release.wait(5)
+            raise RuntimeError("boom")
+
+        def call():
+            try:
+                flight.do("key", fail)
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 3)
+
+
+class TestConcurrentWriters(QuestionnaireTestCase):
+    """Parallel writers against the fake must neither lose updates nor reuse ids"""
+
+    writers = 50
+
+    def setUp(self):
+        super().setUp()
+        # Give every RPC some latency so the writers really interleave
+        self.db.latency = 0.001
+        self.answer("q1", "General Health Advice")
+        self.answer("q2", "No")
+
+    def run_in_parallel(self, target):
+        barrier = threading.Barrier(self.writers)
+        results = [None] * self.writers
+
+        def worker(index):
+            barrier.wait()
+            results[index] = target(index)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_parallel_generated_questions_get_unique_ids(self):
+        before = len(self.stored()["questions"])
+
+        results = self.run_in_parallel(
+            lambda i: questionnaire.add_question_to_questionnaire(
+                self.questionnaire_id,
+                self.user_id,
+                {"question": f"Generated question {i}?", "type": "text"},
+                session=None,
+            )
+        )
+
+        self.assertTrue(all(success for success, _ in results), results)
+        questions = self.stored()["questions"]
+        self.assertEqual(len(questions), before + self.writers)
+        ids = [q["id"] for q in questions]
+        self.assertEqual(len(ids), len(set(ids)))
+        texts = {q["question"] for q in questions}
+        for i in range(self.writers):
+            self.assertIn(f"Generated question {i}?", texts)
+
+    def test_duplicate_submissions_add_one_generated_question(self):
+        for question in self.stored()["questions"]:
+            if "answer" not in question and question["id"] != "q9":
+                self.answer(question["id"], question.get("options", ["answer"])[0])
+        before = len(self.stored()["questions"])
+
+        generated = {"question": "How is your sleep?", "type": "text"}
+        with patch.object(gpt, "generate_next_question", side_effect=lambda *_: dict(generated)):
+            results = self.run_in_parallel(
+                lambda i: questionnaire.record_answer_and_get_next_question(
+                    self.questionnaire_id, self.user_id, "q9", "No allergies"
+                )
+            )
+
+        self.assertTrue(all(success for success, _ in results), results)
+        questions = self.stored()["questions"]
+        self.assertEqual(len(questions), before + 1)
+        self.assertEqual(questions[-1]["question"], "How is your sleep?")
+        next_ids = {response["next_question"]["id"] for _, response in results}
+        self.assertEqual(next_ids, {questions[-1]["id"]})
+
+
+class TestQuestionPrefetch(QuestionnaireTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        enabled = patch.object(prefetch, "PREFETCH_ENABLED", True)
+        enabled.start()
+        self.addCleanup(enabled.stop)
+
+        self.answer("q1", "General Health Advice")
+        self.answer("q2", "No")
+        for question_id in ("q3", "q4", "q5", "q6", "q7"):
+            question = next(q for q in self.stored()["questions"] if q["id"] == question_id)
+            self.answer(question_id, question.get("options", ["answer"])[0])
+
+    def record(self, question_id, answer):
+        success, response = questionnaire.record_answer_and_get_next_question(
+            self.questionnaire_id, self.user_id, question_id, answer
+        )
+        self.assertTrue(success)
+        return response
+
+    def test_prefetched_question_is_used(self):
+        generated = {"question": "How is your sleep lately?", "type": "text"}
+        with patch.object(gpt, "generate_next_question", return_value=dict(generated)) as mock_gpt:
+            # Answering q8 serves q9, the last predefined question
+            self.assertEqual(self.record("q8", "None")["next_question"]["id"], "q9")
+            response = self.record("q9", "No allergies")
+
+        mock_gpt.assert_called_once()
+        self.assertEqual(response["next_question"]["question"], generated["question"])
+        self.assertEqual(prefetch.get_stats()["hit"], 1)
+
+    def test_prefetch_repeating_the_last_question_is_discarded(self):
+        repeated = {"question": "Do you have any allergies?", "type": "text"}
+        fresh = {"question": "How is your sleep lately?", "type": "text"}
+        with patch.object(gpt, "generate_next_question", side_effect=[repeated, fresh]) as mock_gpt:
+            self.record("q8", "None")
+            response = self.record("q9", "No allergies")
+
+        self.assertEqual(mock_gpt.call_count, 2)
+        self.assertEqual(response["next_question"]["question"], fresh["question"])
+        stats = prefetch.get_stats()
+        self.assertEqual(stats["discard"], 1)
+        self.assertEqual(stats["discard_rate"], 1)
+
+    def test_stats_route_is_admin_only(self):
+        app = Flask(__name__)
+        app.register_blueprint(questionnaire_blueprint)
+        client = app.test_client()
+
+        self.assertEqual(client.get("/api/questionnaire/prefetch-stats").status_code, 401)
+        with patch("utils.auth.auth.verify_id_token", return_value={"isAdmin": True}):
+            response = client.get("/api/questionnaire/prefetch-stats", headers={"Authorization": "Bearer token"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()["enabled"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import httpx
+import openai
+
+from agents import gpt, resilience
+from utils import metrics
+
+
+def timeout_error():
+    return openai.APITimeoutError(request=httpx.Request("POST", "http://test/v1/chat/completions"))
+
+
+
+def stream_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+class ResilienceTestCase(unittest.TestCase):
+    def setUp(self):
+        resilience.reset()
+        metrics.reset()
+        self.addCleanup(resilience.reset)
+        for patcher in (
+            patch.object(resilience, "BACKOFF_BASE_SECONDS", 0.001),
+            patch.object(resilience, "FAILURE_THRESHOLD", 3),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestRetriesAndDeadline(ResilienceTestCase):
+    def test_retryable_errors_are_retried(self):
+        results = [timeout_error(), timeout_error(), "ok"]
+
+        def attempt(timeout):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.assertEqual(resilience.call("next_question", attempt, 5), "ok")
+        self.assertEqual(metrics.get_counter("llm_retries_total", call_type="next_question"), 2)
+
+    def test_attempt_timeout_is_capped_by_deadline(self):
+        timeouts = []
+
+        def attempt(timeout):
+            timeouts.append(timeout)
+            return "ok"
+
+        with patch.dict(resilience.DEADLINES, {"conclusion": 2}):
+            resilience.call("conclusion", attempt, 90)
+
+        self.assertLessEqual(timeouts[0], 2)
+
+    def test_non_retryable_errors_are_raised_at_once(self):
+        calls = []
+
+        def attempt(timeout):
+            calls.append(timeout)
+            raise ValueError("bad request")
+
+        with self.assertRaises(ValueError):
+            resilience.call("next_question", attempt, 5)
+        self.assertEqual(len(calls), 1)
+
+
+class TestCircuitBreaker(ResilienceTestCase):
+    def test_breaker_opens_and_recovers(self):
+        def failing(timeout):
+            raise timeout_error()
+
+        with patch.object(resilience, "MAX_RETRIES", 0):
+            for _ in range(3):
+                with self.assertRaises(resilience.LLMUnavailable):
+                    resilience.call("conclusion", failing, 5)
+
+            with self.assertRaises(resilience.CircuitOpenError):
+                resilience.call("conclusion", lambda timeout: "ok", 5)
+
+        stats = resilience.get_stats()["conclusion"]
+        self.assertEqual((stats["state"], stats["trips"]), (resilience.OPEN, 1))
+        self.assertEqual(metrics.get_gauge("llm_circuit_state", call_type="conclusion"), 2)
+        self.assertEqual(metrics.get_counter("llm_circuit_trips_total", call_type="conclusion"), 1)
+
+        breaker = resilience.get_breaker("conclusion")
+        breaker.opened_at -= breaker.reset_timeout
+        self.assertEqual(resilience.call("conclusion", lambda timeout: "ok", 5), "ok")
+        self.assertEqual(resilience.get_stats()["conclusion"]["state"], resilience.CLOSED)
+
+    def test_open_breaker_serves_degraded_responses(self):
+        breaker = resilience.get_breaker("next_question")
+        for _ in range(3):
+            breaker.record_failure()
+        asked = [{"question": gpt.DEGRADED_QUESTIONS[0]["question"], "answer": "Headache"}]
+
+        with patch.object(gpt.client.chat.completions, "create") as mock_create:
+            question = gpt.generate_next_question(asked)
+            resilience.get_breaker("conclusion").state = resilience.OPEN
+            resilience.get_breaker("conclusion").opened_at = time.monotonic()
+            conclusion = gpt.generate_conclusion(asked)
+
+        mock_create.assert_not_called()
+        self.assertTrue(question["degraded"])
+        self.assertEqual(question["question"], gpt.DEGRADED_QUESTIONS[1]["question"])
+        self.assertEqual(conclusion["status"], "error")
+        self.assertTrue(conclusion["degraded"])
+
+    def half_open_breaker(self):
+        breaker = resilience.get_breaker("next_question")
+        for _ in range(3):
+            breaker.record_failure()
+        breaker.opened_at -= breaker.reset_timeout
+        return breaker
+
+    def test_only_api_errors_close_a_half_open_breaker(self):
+        breaker = self.half_open_breaker()
+
+        def buggy(timeout):
+            raise KeyError("choices")
+
+        with self.assertRaises(KeyError):
+            resilience.call("next_question", buggy, 5)
+        self.assertEqual(breaker.state, resilience.HALF_OPEN)
+
+        def bad_request(timeout):
+            response = httpx.Response(400, request=httpx.Request("POST", "http://test/v1/chat/completions"))
+            raise openai.BadRequestError("bad request", response=response, body=None)
+
+        with self.assertRaises(openai.BadRequestError):
+            resilience.call("next_question", bad_request, 5)
+        self.assertEqual(breaker.state, resilience.CLOSED)
+
+    def test_disconnected_stream_frees_the_half_open_trial(self):
+        breaker = self.half_open_breaker()
+        chunks = [stream_chunk('{"question": "How'), stream_chunk(' long?"}')]
+
+        with patch.object(gpt.client.chat.completions, "create", return_value=iter(chunks)):
+            stream = gpt.stream_next_question([])
+            self.assertEqual(next(stream), ("token", "How"))
+            # What Flask does when the SSE client goes away
+            stream.close()
+
+        self.assertEqual(breaker.state, resilience.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_non_retryable_stream_error_is_no_success(self):
+        breaker = self.half_open_breaker()
+
+        with patch.object(gpt.client.chat.completions, "create", side_effect=ValueError("bad request")):
+            with self.assertRaises(ValueError):
+                list(gpt.stream_next_question([]))
+
+        self.assertEqual(breaker.state, resilience.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+class TestHedging(ResilienceTestCase):
+    def test_slow_request_is_hedged(self):
+        release = threading.Event()
+        calls = []
+
+        def attempt(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        with patch.object(resilience, "HEDGE_DELAY_SECONDS", 0.05):
+            result = resilience.call("next_question", attempt, 5, hedge=True)
+        release.set()
+
+        self.assertEqual(result, "fast")
+        self.assertEqual(metrics.get_counter("llm_hedges_total", call_type="next_question", outcome="won"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from flask import Flask
+
+from agents import gpt, router
+from agents.llm_api import llm_blueprint
+from utils import auth
+
+QUESTION_REPLY = json.dumps({"question": "How is your sleep?", "type": "text", "options": []})
+
+
+def completion(content, prompt_tokens=100, completion_tokens=20):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens),
+    )
+
+
+class TestLoadRoutes(unittest.TestCase):
+    def test_env_overrides_config_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"conclusion": {"model": "gpt-4o-mini", "timeout": 45}}, f)
+        self.addCleanup(os.unlink, f.name)
+
+        routes = router.load_routes(
+            environ={"LLM_ROUTE_CONCLUSION_TIMEOUT": "30", "LLM_ROUTE_CASE_TITLE_MAX_TOKENS": "80"},
+            config_path=f.name,
+        )
+
+        self.assertEqual(routes["conclusion"].model, "gpt-4o-mini")
+        self.assertEqual(routes["conclusion"].timeout, 30.0)
+        self.assertEqual(routes["case_title"].max_tokens, 80)
+        self.assertEqual(routes["next_question"], router.DEFAULT_ROUTES["next_question"])
+
+
+class TestModelRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = router.ModelRouter(routes=router.load_routes(environ={}))
+
+    def test_falls_back_when_p95_is_over_slo(self):
+        route = self.router.get_route("next_question")
+        for _ in range(router.MIN_SAMPLES - 1):
+            self.router.record("next_question", route.model, route.slo_p95 * 2)
+        self.assertEqual(self.router.choose_model("next_question"), route.model)
+
+        self.router.record("next_question", route.model, route.slo_p95 * 2)
+        self.assertEqual(self.router.choose_model("next_question"), route.fallback_model)
+
+    def test_primary_is_retried_once_samples_age_out(self):
+        route = self.router.get_route("next_question")
+        for _ in range(router.MIN_SAMPLES):
+            self.router.record("next_question", route.model, route.slo_p95 * 2)
+
+        with patch.object(router, "LATENCY_WINDOW_SECONDS", -1):
+            self.assertEqual(self.router.choose_model("next_question"), route.model)
+
+    def test_report_sums_usage_and_cost(self):
+        usage = SimpleNamespace(prompt_tokens=1_000_000, completion_tokens=100_000)
+        self.router.record("conclusion", "gpt-4o", 12.0, usage)
+        self.router.record("conclusion", "gpt-4o", 3.0, error=True)
+
+        row = self.router.report()["models"][0]
+
+        self.assertEqual((row["call_type"], row["model"], row["calls"], row["errors"]), ("conclusion", "gpt-4o", 2, 1))
+        self.assertEqual(row["p95_seconds"], 12.0)
+        self.assertAlmostEqual(row["cost_usd"], 2.50 + 1.00)
+
+
+class TestRoutedCompletions(unittest.TestCase):
+    def setUp(self):
+        self.router = router.ModelRouter(routes=router.load_routes(environ={}))
+        patcher = patch.object(gpt, "router", self.router)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_calls_use_route_settings_and_record_usage(self):
+        with patch.object(gpt.client.chat.completions, "create", return_value=completion(QUESTION_REPLY)) as mock_create:
+            gpt.generate_next_question([])
+
+        route = self.router.get_route("next_question")
+        kwargs = mock_create.call_args.kwargs
+        self.assertEqual((kwargs["model"], kwargs["max_tokens"]), (route.model, route.max_tokens))
+        self.assertEqual(kwargs["timeout"].read, route.timeout)
+        self.assertEqual(self.router.report()["models"][0]["prompt_tokens"], 100)
+
+    def test_slow_model_is_replaced_by_fallback(self):
+        route = self.router.get_route("next_question")
+        for _ in range(router.MIN_SAMPLES):
+            self.router.record("next_question", route.model, route.slo_p95 + 1)
+
+        with patch.object(gpt.client.chat.completions, "create", return_value=completion(QUESTION_REPLY)) as mock_create:
+            gpt.generate_next_question([])
+
+        self.assertEqual(mock_create.call_args.kwargs["model"], route.fallback_model)
+
+
+class TestRoutesEndpoint(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.register_blueprint(llm_blueprint)
+        self.client = app.test_client()
+
+    def get(self, claims):
+        with patch.object(auth.auth, "verify_id_token", return_value=claims):
+            return self.client.get("/api/admin/llm/routes", headers={"Authorization": "Bearer token"})
+
+    def test_requires_admin(self):
+        self.assertEqual(self.client.get("/api/admin/llm/routes").status_code, 401)
+        self.assertEqual(self.get({"uid": "user1"}).status_code, 403)
+
+    def test_admin_gets_report(self):
+        response = self.get({"uid": "admin1", "isAdmin": True})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("next_question", response.get_json()["routes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
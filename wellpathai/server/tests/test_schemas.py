@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from agents import gpt, schemas
+
+CONCLUSION = {
+    "conclusion": "Symptoms are consistent with tension-type headache.",
+    "suggestions": ["Keep a headache diary"],
+    "otc_medications": [{
+        "name": "Ibuprofen 200mg",
+        "medication_type": "Tablet",
+        "purpose": "Relieves headache pain",
+        "price_range": "$5-$10",
+        "considerations": "Take with food",
+    }],
+    "clinical_notes": ["Screen for sleep disorders"],
+}
+
+
+class TestParseReply(unittest.TestCase):
+    def test_conclusion_keeps_every_section(self):
+        data, outcome = schemas.parse_reply("conclusion", json.dumps(CONCLUSION))
+
+        self.assertEqual(outcome, schemas.PARSED)
+        self.assertEqual(data, CONCLUSION)
+
+    def test_fenced_reply_is_repaired(self):
+        reply = "```json\n" + json.dumps({"description": "Recurring headaches.", "title": "Headache"}) + "\n```"
+
+        data, outcome = schemas.parse_reply("case_title", reply)
+
+        self.assertEqual(outcome, schemas.REPAIRED)
+        self.assertEqual(data["title"], "Headache")
+
+    def test_reply_missing_fields_fails(self):
+        data, outcome = schemas.parse_reply("conclusion", json.dumps({"conclusion": "Only this"}))
+
+        self.assertIsNone(data)
+        self.assertEqual(outcome, schemas.FAILED)
+        self.assertEqual(gpt._parse_conclusion(json.dumps({"conclusion": "Only this"}))["status"], "error")
+
+    def test_text_question_is_stored_without_options(self):
+        reply = json.dumps({"question": "Tell me more?", "type": "text", "options": []})
+
+        self.assertEqual(gpt._parse_next_question(reply), {"question": "Tell me more?", "type": "text"})
+
+    def test_response_format_per_mode(self):
+        schema_format = schemas.response_format("next_question")
+        self.assertEqual(schema_format["type"], "json_schema")
+        self.assertTrue(schema_format["json_schema"]["strict"])
+        self.assertFalse(schema_format["json_schema"]["schema"]["additionalProperties"])
+
+        with patch.object(schemas, "STRUCTURED_OUTPUT_MODE", "json_object"):
+            self.assertEqual(schemas.response_format("conclusion"), {"type": "json_object"})
+
+    def test_conclusion_with_case_title(self):
+        schema_format = schemas.response_format("conclusion", schemas.ConclusionWithCase)
+        self.assertEqual(schema_format["json_schema"]["name"], "conclusion")
+        self.assertIn("case_title", schema_format["json_schema"]["schema"]["required"])
+
+        reply = {**CONCLUSION, "case_title": "Headache", "case_description": "Recurring headaches."}
+        data, outcome = schemas.parse_reply("conclusion", json.dumps(reply), schemas.ConclusionWithCase)
+        self.assertEqual((data["case_title"], outcome), ("Headache", schemas.PARSED))
+        # Without the fields the reply doesn't match the larger schema
+        self.assertIsNone(schemas.parse_reply("conclusion", json.dumps(CONCLUSION), schemas.ConclusionWithCase)[0])
+
+
+class TestConclusionWithCaseTitle(unittest.TestCase):
+    def test_asks_for_and_returns_the_case_title(self):
+        reply = {**CONCLUSION, "case_title": "Headache", "case_description": "Recurring headaches."}
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(reply)))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=50),
+        )
+
+        with patch.object(gpt.client.chat.completions, "create", return_value=response) as mock_create:
+            result = gpt.generate_conclusion([], include_case_title=True)
+
+        kwargs = mock_create.call_args.kwargs
+        self.assertIn("case_title", kwargs["response_format"]["json_schema"]["schema"]["properties"])
+        self.assertIn("case_description", kwargs["messages"][1]["content"])
+        self.assertEqual(result, reply)
+
+    def test_plain_conclusion_prompt_is_unchanged(self):
+        _, user_prompt = gpt._conclusion_prompts([])
+        self.assertNotIn("case_title", user_prompt)
+
+
+if __name__ == "__main__":
+    unittest.main()
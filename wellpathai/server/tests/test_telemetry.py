@@ -0,0 +1,185 @@
+import json
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import openai
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from flask import Flask, jsonify
+
+from agents import client, gpt, resilience, router, telemetry
+from agents.llm_api import llm_blueprint
+from loadtest.fake_openai import FakeOpenAIServer
+from utils import auth, metrics
+
+QUESTION_REPLY = json.dumps({"question": "How is your sleep?", "type": "text", "options": []})
+QUESTIONS = [{"id": "q1", "question": "What brings you here today?", "answer": "Feeling Unwell"}]
+
+
+def completion(content, prompt_tokens=300, completion_tokens=40):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens),
+    )
+
+
+class TestHistograms(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_observations_fill_cumulative_buckets(self):
+        for value in (0.05, 0.3, 0.3, 7, 500):
+            metrics.observe("llm_latency_seconds", value, call_type="conclusion")
+
+        histogram = metrics.get_histogram("llm_latency_seconds", call_type="conclusion")
+
+        self.assertEqual(histogram["count"], 5)
+        self.assertAlmostEqual(histogram["sum"], 507.65)
+        self.assertEqual(dict((str(b), c) for b, c in histogram["buckets"])["0.5"], 3)
+        self.assertEqual(histogram["buckets"][-1], ["+Inf", 5])
+        self.assertIsNone(metrics.get_histogram("llm_latency_seconds", call_type="case_title"))
+
+    def test_quantiles_interpolate_within_buckets(self):
+        for _ in range(10):
+            metrics.observe("llm_ttfb_seconds", 0.7, buckets=(0.5, 1.0))
+
+        histogram = metrics.get_histogram("llm_ttfb_seconds")
+
+        self.assertAlmostEqual(metrics.histogram_quantile(histogram, 0.5), 0.75)
+        self.assertIsNone(metrics.histogram_quantile(None, 0.5))
+
+    def test_prometheus_text(self):
+        metrics.increment("llm_completions_total", outcome="parsed", call_type="next_question")
+        metrics.observe("llm_latency_seconds", 0.3, buckets=(0.5,), call_type="next_question")
+        metrics.increment("questionnaire_prefetch_total", outcome="hit")
+
+        text = metrics.prometheus_text(prefix="llm_")
+
+        self.assertIn("# TYPE llm_completions_total counter", text)
+        self.assertIn('llm_completions_total{call_type="next_question",outcome="parsed"} 1', text)
+        self.assertIn('llm_latency_seconds_bucket{call_type="next_question",le="+Inf"} 1', text)
+        self.assertIn('llm_latency_seconds_count{call_type="next_question"} 1', text)
+        self.assertNotIn("prefetch", text)
+
+
+class TestCompletionTelemetry(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+        patcher = patch.object(gpt, "router", router.ModelRouter(routes=router.load_routes(environ={})))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def labels(self, call_type="next_question", route=telemetry.BACKGROUND_ROUTE):
+        return {"call_type": call_type, "route": route, "model": gpt.router.choose_model(call_type)}
+
+    def test_records_tokens_latency_and_outcome(self):
+        with patch.object(gpt.client.chat.completions, "create", return_value=completion(QUESTION_REPLY)):
+            gpt.generate_next_question(QUESTIONS)
+        with patch.object(gpt.client.chat.completions, "create", return_value=completion(f"```json\n{QUESTION_REPLY}\n```")):
+            gpt.generate_next_question(QUESTIONS)
+        with patch.object(gpt.client.chat.completions, "create", return_value=completion("Sorry, I can't")):
+            gpt.generate_next_question(QUESTIONS)
+
+        labels = self.labels()
+        for outcome in ("parsed", "repaired", "failed"):
+            self.assertEqual(metrics.get_counter("llm_completions_total", outcome=outcome, **labels), 1)
+        self.assertEqual(metrics.get_counter("llm_prompt_tokens_total", **labels), 900)
+        self.assertEqual(metrics.get_histogram("llm_completion_tokens", **labels)["count"], 3)
+        self.assertEqual(metrics.get_histogram("llm_latency_seconds", **labels)["count"], 3)
+
+    def test_failed_requests_are_errors(self):
+        error = openai.APIConnectionError(request=None)
+        with patch.object(gpt.client.chat.completions, "create", side_effect=error), \
+                patch.object(resilience, "MAX_RETRIES", 0):
+            gpt.generate_conclusion(QUESTIONS)
+
+        labels = self.labels("conclusion")
+        self.assertEqual(metrics.get_counter("llm_completions_total", outcome="error", **labels), 1)
+        self.assertEqual(metrics.get_counter("llm_prompt_tokens_total", **labels), 0)
+
+    def test_calls_are_tagged_with_the_app_route(self):
+        app = Flask(__name__)
+
+        @app.route("/api/questions/<question_id>")
+        def view(question_id):
+            return jsonify(gpt.generate_next_question(QUESTIONS))
+
+        with patch.object(gpt.client.chat.completions, "create", return_value=completion(QUESTION_REPLY)):
+            app.test_client().get("/api/questions/q1")
+
+        labels = self.labels(route="/api/questions/<question_id>")
+        self.assertEqual(metrics.get_counter("llm_completions_total", outcome="parsed", **labels), 1)
+
+    def test_time_to_first_byte(self):
+        server = FakeOpenAIServer(latency=0.05, stream_interval=0.05).start()
+        self.addCleanup(server.stop)
+        with patch.object(client, "BASE_URL", server.base_url), patch.object(client, "_client", None):
+            sync_client = client.get_client()
+        with patch.object(gpt, "client", sync_client):
+            gpt.generate_next_question(QUESTIONS)
+            list(gpt.stream_next_question(QUESTIONS))
+
+        labels = self.labels()
+        ttfb = metrics.get_histogram("llm_ttfb_seconds", **labels)
+        latency = metrics.get_histogram("llm_latency_seconds", **labels)
+        self.assertEqual(ttfb["count"], 2)
+        # The streamed reply arrives over several chunks after its first byte
+        self.assertLess(ttfb["sum"], latency["sum"] - 0.1)
+        self.assertGreater(metrics.get_counter("llm_completion_tokens_total", **labels), 0)
+
+
+class TestUsageEndpoint(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        app = Flask(__name__)
+        app.register_blueprint(llm_blueprint)
+        self.client = app.test_client()
+
+    def get(self, path, claims):
+        with patch.object(auth.auth, "verify_id_token", return_value=claims):
+            return self.client.get(path, headers={"Authorization": "Bearer token"})
+
+    def test_requires_admin(self):
+        self.assertEqual(self.client.get("/api/admin/llm/usage").status_code, 401)
+        self.assertEqual(self.get("/api/admin/llm/metrics", {"uid": "user1"}).status_code, 403)
+
+    def test_summarizes_per_call_type_route_and_model(self):
+        for latency, outcome in ((2.0, "parsed"), (4.0, "failed"), (9.0, telemetry.ERROR)):
+            record = telemetry.Completion("conclusion", "gpt-4o", "/api/questionnaire/generate-result", latency=latency)
+            record.add_usage(SimpleNamespace(prompt_tokens=1000, completion_tokens=500))
+            telemetry.record(record, outcome)
+
+        response = self.get("/api/admin/llm/usage", {"uid": "admin1", "isAdmin": True})
+
+        self.assertEqual(response.status_code, 200)
+        [row] = response.get_json()["completions"]
+        self.assertEqual(row["route"], "/api/questionnaire/generate-result")
+        self.assertEqual(row["outcomes"], {"parsed": 1, "failed": 1, "error": 1})
+        self.assertEqual((row["prompt_tokens"], row["mean_completion_tokens"]), (2000, 500))
+        self.assertAlmostEqual(row["latency_seconds"]["mean"], 5.0)
+        self.assertIsNone(row["ttfb_seconds"]["p50"])
+
+    def test_exports_prometheus_text(self):
+        telemetry.record(telemetry.Completion("case_title", "gpt-4o-mini", "background", latency=0.4), "parsed")
+
+        response = self.get("/api/admin/llm/metrics", {"uid": "admin1", "isAdmin": True})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        self.assertIn("llm_latency_seconds_bucket", response.get_data(as_text=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+from functools import wraps
+
+from firebase_admin import auth
+from flask import jsonify, request
+
+
+def admin_required(view):
+    """
+    Allow a route only for admins
+
+    The request must carry a Firebase ID token as "Authorization: Bearer <token>"
+    whose user has the isAdmin custom claim set at registration.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get("Authorization", "")
+        if not header.startswith("Bearer "):
+            return jsonify({"error": "Authorization token is required"}), 401
+
+        try:
+            decoded_token = auth.verify_id_token(header[len("Bearer "):])
+        except Exception:
+            return jsonify({"error": "Invalid authorization token"}), 401
+
+        if not decoded_token.get("isAdmin", False):
+            return jsonify({"error": "Admin access required"}), 403
+
+        return view(*args, **kwargs)
+
+    return wrapper
@@ -1,5 +1,6 @@
 from firebase_admin import firestore
 from datetime import datetime
+from questionnaire.storage import rebuild_questions
 
 db = firestore.client()
 
@@ -25,7 +26,7 @@ def get_questionnaire_data(questionnaire_id, user_id):
         if questionnaire_data['user_id'] != user_id:
             return False, "Unauthorized access"
         
-        questions = questionnaire_data.get('questions', [])
+        questions = rebuild_questions(questionnaire_data)
         
         return questions
         
@@ -0,0 +1,181 @@
+"""
+Process-local metrics registry.
+
+Counters, gauges and histograms are keyed by a metric name plus optional
+labels, e.g. increment("questionnaire_prefetch_total", outcome="hit"),
+set_gauge("llm_circuit_state", 2, call_type="conclusion") or
+observe("llm_latency_seconds", 1.7, call_type="conclusion").
+
+prometheus_text() exports them in the Prometheus text format.
+"""
+
+import bisect
+import threading
+from collections import defaultdict
+
+# Default histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}  # key -> {"bounds", "counts" (per bucket, last is +Inf), "sum", "count"}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """Add `value` to the counter `name` with the given labels"""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def get_counter(name, **labels):
+    """Current value of a counter, 0 if it was never incremented"""
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def set_gauge(name, value, **labels):
+    """Set the gauge `name` with the given labels to `value`"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def get_gauge(name, **labels):
+    """Current value of a gauge, None if it was never set"""
+    with _lock:
+        return _gauges.get(_key(name, labels))
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """
+    Add one observation to the histogram `name` with the given labels
+
+    The bucket bounds are fixed by the first observation of each name and labels.
+    """
+    with _lock:
+        key = _key(name, labels)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = {"bounds": tuple(buckets), "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            _histograms[key] = histogram
+        histogram["counts"][bisect.bisect_left(histogram["bounds"], value)] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def _histogram_value(histogram):
+    cumulative = 0
+    buckets = []
+    for bound, count in zip(list(histogram["bounds"]) + ["+Inf"], histogram["counts"]):
+        cumulative += count
+        buckets.append([bound, cumulative])
+    return {"count": histogram["count"], "sum": histogram["sum"], "buckets": buckets}
+
+
+def get_histogram(name, **labels):
+    """
+    Current state of a histogram, None if it was never observed
+
+    Returns:
+        dict: count, sum and buckets as [upper bound, cumulative count] pairs
+    """
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        return _histogram_value(histogram) if histogram else None
+
+
+def histogram_quantile(histogram, fraction):
+    """
+    Estimate a quantile of a histogram from get_histogram(), None if empty
+
+    Interpolates linearly within the bucket the quantile falls in, like
+    Prometheus' histogram_quantile(). Values in the +Inf bucket are reported
+    as the largest finite bound.
+    """
+    if not histogram or not histogram["count"]:
+        return None
+    rank = fraction * histogram["count"]
+    lower, below = 0.0, 0
+    for bound, cumulative in histogram["buckets"]:
+        if cumulative >= rank:
+            if bound == "+Inf":
+                return lower
+            in_bucket = cumulative - below
+            return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket else 0)
+        lower, below = bound, cumulative
+    return lower
+
+
+def snapshot():
+    """
+    Get every counter and gauge
+
+    Returns:
+        list: Dicts with type, name, labels and value for each metric
+    """
+    with _lock:
+        counters = [
+            {"type": "counter", "name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+        gauges = [
+            {"type": "gauge", "name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_gauges.items())
+        ]
+        histograms = [
+            {"type": "histogram", "name": name, "labels": dict(labels), "value": _histogram_value(histogram)}
+            for (name, labels), histogram in sorted(_histograms.items())
+        ]
+        return counters + gauges + histograms
+
+
+def _label_text(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def prometheus_text(prefix=""):
+    """
+    Every metric whose name starts with `prefix` in the Prometheus text format
+
+    Returns:
+        str: One TYPE line per metric name, then a sample line per labels
+    """
+    lines = []
+    typed = set()
+    for metric in snapshot():
+        name = metric["name"]
+        if not name.startswith(prefix):
+            continue
+        if name not in typed:
+            lines.append(f"# TYPE {name} {metric['type']}")
+            typed.add(name)
+        labels = metric["labels"]
+        if metric["type"] != "histogram":
+            lines.append(f"{name}{_label_text(labels)} {metric['value']}")
+            continue
+        histogram = metric["value"]
+        for bound, cumulative in histogram["buckets"]:
+            lines.append(f"{name}_bucket{_label_text(labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_label_text(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_label_text(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Clear every metric, used by tests"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
@@ -0,0 +1,125 @@
+"""
+De-duplication of identical concurrent and retried requests.
+
+SingleFlight lets concurrent calls with the same key share one execution: the
+first caller runs the function, the others wait and get its result (or its
+exception). IdempotencyCache keeps finished responses for a while under a
+client-supplied Idempotency-Key so a retry gets the original response back
+instead of running the request again.
+
+Both are process-local. Requests routed to different worker processes are still
+kept consistent by the questionnaire transactions, they just don't share the
+OpenAI call.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils import metrics
+
+# Seconds a response stays replayable under its Idempotency-Key
+IDEMPOTENCY_WINDOW_SECONDS = int(os.getenv("IDEMPOTENCY_WINDOW_SECONDS", 600))
+
+
+def content_hash(payload):
+    """Stable hash of a JSON-serializable payload"""
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Share one execution between concurrent calls with the same key"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run `fn`, or wait for the call already running under `key`
+
+        Returns:
+            tuple: (result of fn, shared) where shared is True if the result came
+            from another caller's execution
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.increment("single_flight_total", operation=self.name, outcome="shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        metrics.increment("single_flight_total", operation=self.name, outcome="executed")
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class IdempotencyCache:
+    """Responses kept by Idempotency-Key for `window` seconds"""
+
+    def __init__(self, window=None):
+        self.window = IDEMPOTENCY_WINDOW_SECONDS if window is None else window
+        self._lock = threading.Lock()
+        self._responses = {}
+
+    def _drop_expired(self, now):
+        for key, entry in list(self._responses.items()):
+            if entry["expires_at"] <= now:
+                del self._responses[key]
+
+    def get(self, key, fingerprint):
+        """
+        Look up the stored response for a key
+
+        Returns:
+            tuple: ("hit", response), ("mismatch", None) if the key was used for a
+            different request, or ("miss", None)
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._drop_expired(now)
+            entry = self._responses.get(key)
+
+        if entry is None:
+            return "miss", None
+        if entry["fingerprint"] != fingerprint:
+            return "mismatch", None
+        return "hit", entry["response"]
+
+    def put(self, key, fingerprint, response):
+        with self._lock:
+            self._responses[key] = {
+                "fingerprint": fingerprint,
+                "response": response,
+                "expires_at": time.monotonic() + self.window,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
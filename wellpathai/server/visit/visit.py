@@ -1,6 +1,6 @@
 from firebase_admin import firestore
 from datetime import datetime
-from case.case import add_visit_to_case
+from case import counters
 from flask import jsonify
 
 db = firestore.client()
@@ -8,20 +8,31 @@ db = firestore.client()
 def create_visit(user_id, case_id, questionnaire_id):
     
     visit_ref = db.collection("visits").document()
+    visit_data = {
+        "userId": user_id,
+        "caseId": case_id,
+        "visitDate": datetime.now().date().isoformat(),
+        "questionnairesID": questionnaire_id,
+        "consultationID": "",
+        "hasNewReport": True,
+        "appointmentId": "",
+        "appointmentStatus": "unscheduled"
+    }
     try:
-        visit_ref.set({
-            "userId": user_id,
-            "caseId": case_id,
-            "visitDate": datetime.now().date().isoformat(),
-            "questionnairesID": questionnaire_id,
-            "consultationID": "",
-            "hasNewReport": True,
-            "appointmentId": "",
-            "appointmentStatus": "unscheduled"
-        })
+        transaction = db.transaction()
+
+        # Store the visit, list it on the case and count it in one commit
+        @firestore.transactional
+        def _create(transaction):
+            existing = counters.stage(transaction, None, visit_data, {
+                case_id: {"visits": firestore.ArrayUnion([visit_ref.id]), "updatedAt": datetime.now()}
+            })
+            transaction.set(visit_ref, visit_data)
+            return case_id in existing
 
-        # Add visit to the case
-        success = add_visit_to_case(case_id, visit_ref.id)
+        success = _create(transaction)
+        if not success:
+            print(f"Case {case_id} does not exist", flush=True)
 
         return {"visit_id": visit_ref.id, "add_to_case": success}
     
@@ -41,16 +52,41 @@ def get_visit(case_id):
     
     return visit_list
 
-def update_visit_date(visit_id, visit_date):
-    
+def update_visit(visit_id, updates):
+    """
+    Update a visit and the visit counters of its case in one transaction
+
+    Every change of a visit's caseId, hasNewReport or visitDate has to go
+    through here, or through add_visit_to_case, to keep the counters right.
+
+    Args:
+        visit_id (str): The ID of the visit
+        updates (dict): Fields to set on the visit
+
+    Returns:
+        bool: True if the visit exists and was updated
+    """
     visit_ref = db.collection("visits").document(visit_id)
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _update(transaction):
+        visit = visit_ref.get(transaction=transaction)
+        if not visit.exists:
+            return False
+        before = visit.to_dict()
+        counters.stage(transaction, before, {**before, **updates})
+        transaction.update(visit_ref, updates)
+        return True
+
+    return _update(transaction)
+
+def update_visit_date(visit_id, visit_date):
     
     try:
-        visit_ref.update({
+        return update_visit(visit_id, {
             "visitDate": visit_date
         })
-        
-        return True
     
     except Exception as e:
         print(f"Error updating visit date: {str(e)}", flush=True)
@@ -59,15 +95,11 @@ def update_visit_date(visit_id, visit_date):
 # update consultationID
 def update_consultation_id(visit_id, consultation_id):
     
-    visit_ref = db.collection("visits").document(visit_id)
-    
     try:
-        visit_ref.update({
+        return update_visit(visit_id, {
             "consultationID": consultation_id,
             "hasNewReport": True
         })
-        
-        return True
     
     except Exception as e:
         print(f"Error updating consultation ID: {str(e)}", flush=True)
@@ -76,14 +108,10 @@ def update_consultation_id(visit_id, consultation_id):
 # update hasNewReport status
 def update_new_report_status(visit_id, status):
     
-    visit_ref = db.collection("visits").document(visit_id)
-    
     try:
-        visit_ref.update({
+        return update_visit(visit_id, {
             "hasNewReport": status
         })
-        
-        return True
     
     except Exception as e:
         print(f"Error updating new report status: {str(e)}", flush=True)